@@ -1,5 +1,25 @@
+import django
 from django.apps import AppConfig
+from django.core import checks
+
+# bulk_create(update_conflicts=...) is new in Django 4.1
+MINIMUM_DJANGO = (4, 1)
+
+
+def check_django_version(app_configs, **kwargs):
+    if django.VERSION[:2] >= MINIMUM_DJANGO:
+        return []
+    return [
+        checks.Error(
+            f"iatistore requires Django {'.'.join(map(str, MINIMUM_DJANGO))} "
+            f"or later, not {django.get_version()}",
+            id="iatistore.E001",
+        )
+    ]
 
 
 class IatistoreConfig(AppConfig):
     name = "iatistore"
+
+    def ready(self):
+        checks.register(check_django_version)
@@ -0,0 +1,245 @@
+"""
+Timing the build of the materialized views and the endpoints reading
+them, on a synthetic corpus, with a JSON report which can be compared
+with the report of an earlier run.
+
+Views are rebuilt and swapped in, so run this against a scratch database.
+Endpoints are timed with the response cache replaced by a dummy cache,
+so that every request is answered from the views and nothing is left
+behind in the cache.
+"""
+import logging
+import time
+from typing import Dict, Iterable, Iterator, List, NamedTuple, Optional
+
+from django.conf import settings
+from django.db import connection
+from django.test import RequestFactory, override_settings
+from django.utils import timezone
+
+from iatistore import matviews, synthetic
+from iatistore.models import (
+    UNIFIED_TABLES,
+    CombinedNarratives,
+    IatiActivities,
+    IatiXmlTable,
+    NarrativeXmlTable,
+)
+
+logger = logging.getLogger(__name__)
+
+
+class Measurement(NamedTuple):
+    name: str
+    kind: str
+    seconds: float
+    ok: bool = True
+    rows: Optional[int] = None
+    bytes: Optional[int] = None
+    explain: Optional[list] = None
+    # Why a measurement failed, when it raised
+    error: Optional[str] = None
+
+
+# The cache the endpoints are timed with
+BENCHMARK_CACHE = "iatistore_benchmark"
+
+
+def explain(sql: str, analyze: bool = False) -> list:
+    """
+    The plan of `sql` in JSON. With `analyze` the query is
+    run again to report its actual timings and buffers.
+    """
+    options = "ANALYZE, BUFFERS, FORMAT JSON" if analyze else "FORMAT JSON"
+    with connection.cursor() as c:
+        c.execute(f"EXPLAIN ({options}) {sql}")
+        return c.fetchone()[0]
+
+
+def count_rows(relname: str) -> int:
+    with connection.cursor() as c:
+        c.execute(f'SELECT count(*) FROM "{relname}"')
+        return c.fetchone()[0]
+
+
+def remove_synthetic() -> int:
+    """
+    Delete the synthetic activities, leaving everything else
+    """
+    deleted, _ = IatiActivities.objects.filter(
+        iati_identifier__startswith=synthetic.PREFIX
+    ).delete()
+    return deleted
+
+
+def load_synthetic(
+    count: int, versions: Iterable, seed: int = 0, **options
+) -> Measurement:
+    """
+    Replace the synthetic activities with `count` new ones per version,
+    shaped by the activity standard with the options of StandardActivity
+    """
+    remove_synthetic()
+    activities = synthetic.standard_activities(count, list(versions), seed, **options)
+    start = time.monotonic()
+    written = IatiActivities.copy_activities(activities)
+    return Measurement(
+        name="synthetic activities",
+        kind="load",
+        seconds=time.monotonic() - start,
+        rows=written,
+    )
+
+
+def measure_build(
+    table, kind: str = "matview", plan: bool = True, analyze: bool = False
+) -> Measurement:
+    """
+    Time building `table`'s view under its shadow name and swapping
+    it in, as a rebuild does, and optionally how its query is planned
+    """
+    start = time.monotonic()
+    ok = table.matview_build_shadow() and matviews.swap_in([table])
+    seconds = time.monotonic() - start
+    return Measurement(
+        name=table.table_name,
+        kind=kind,
+        seconds=seconds,
+        ok=ok,
+        rows=count_rows(table.table_name) if ok else None,
+        explain=explain(table.sql, analyze) if ok and plan else None,
+    )
+
+
+def measure_endpoint(name: str, view, query: dict = None, **kwargs) -> Measurement:
+    """
+    Time a GET of `view`, reading the whole response.
+    An endpoint which raises is measured as failed, with the error.
+    """
+    path, _, _ = name.partition("?")
+    request = RequestFactory().get(f"/{path}", query)
+    start = time.monotonic()
+    try:
+        response = view(request, **kwargs)
+        if response.streaming:
+            size = sum(len(chunk) for chunk in response.streaming_content)
+        else:
+            size = len(response.content)
+    except Exception as e:
+        logger.error(f"Unable to measure {name}", exc_info=1)
+        return Measurement(
+            name=name,
+            kind="endpoint",
+            seconds=time.monotonic() - start,
+            ok=False,
+            error=f"{type(e).__name__}: {e}",
+        )
+    return Measurement(
+        name=name,
+        kind="endpoint",
+        seconds=time.monotonic() - start,
+        ok=response.status_code == 200,
+        bytes=size,
+    )
+
+
+def uncached():
+    """
+    Settings replacing the response cache with a dummy cache
+    """
+    caches = dict(
+        settings.CACHES,
+        **{BENCHMARK_CACHE: {"BACKEND": "django.core.cache.backends.dummy.DummyCache"}},
+    )
+    return override_settings(CACHES=caches, IATISTORE_CACHE=BENCHMARK_CACHE)
+
+
+def measure_endpoints(tables: Iterable[IatiXmlTable]) -> Iterator[Measurement]:
+    from iatistore import views
+
+    yield measure_endpoint("iatiactivities.json", views.IatiActivities.as_view())
+    transactions = views.IatiTransactions.as_view()
+    yield measure_endpoint("iatitransactions.json", transactions)
+    yield measure_endpoint(
+        "iatitransactions.json?format=delimited",
+        transactions,
+        {"format": "delimited"},
+    )
+    yield measure_endpoint(
+        "participatingorganisations.json",
+        views.IatiParticipatingOrganisation.as_view(),
+    )
+    table_json = views.IatiXmlTableJSON.as_view()
+    for table in tables:
+        yield measure_endpoint(
+            f"table/{table.pk}/content.json", table_json, pk=table.pk
+        )
+
+
+def run(
+    versions: Iterable,
+    load: Optional[dict] = None,
+    plan: bool = True,
+    analyze: bool = False,
+) -> dict:
+    """
+    Optionally load synthetic activities with the `load` options,
+    then time building every view of `versions` and every endpoint.
+    With `analyze` each view's query is run a second time by
+    "EXPLAIN ANALYZE", to report how it was actually run.
+    """
+    versions = list(versions)
+    started = timezone.now()
+    measurements = []
+    if load is not None:
+        measurements.append(load_synthetic(versions=versions, **load))
+
+    tables = list(IatiXmlTable.objects.filter(iati_version__in=versions))
+    matview_tables = (
+        tables
+        + list(NarrativeXmlTable.objects.filter(iati_version__in=versions))
+        + [CombinedNarratives(version) for version in versions]
+    )
+    for table in matview_tables:
+        measurements.append(measure_build(table, plan=plan, analyze=analyze))
+    for table in UNIFIED_TABLES.values():
+        start = time.monotonic()
+        ok = table.rebuild()
+        measurements.append(
+            Measurement(
+                name=table.table_name,
+                kind="unified",
+                seconds=time.monotonic() - start,
+                ok=ok,
+                rows=count_rows(table.table_name) if ok else None,
+            )
+        )
+
+    with uncached():
+        measurements.extend(measure_endpoints(tables))
+
+    return {
+        "started": started.isoformat(),
+        "versions": [str(version) for version in versions],
+        "load": load,
+        "measurements": [m._asdict() for m in measurements],
+    }
+
+
+def compare(report: dict, previous: dict) -> List[Dict]:
+    """
+    The time taken by each measurement in `report`
+    next to the time it took in `previous`
+    """
+    before = {(m["kind"], m["name"]): m["seconds"] for m in previous["measurements"]}
+    return [
+        dict(
+            kind=m["kind"],
+            name=m["name"],
+            seconds=m["seconds"],
+            ok=m.get("ok", True),
+            error=m.get("error"),
+            previous=before.get((m["kind"], m["name"])),
+        )
+        for m in report["measurements"]
+    ]
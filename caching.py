@@ -0,0 +1,99 @@
+"""
+Response caching for endpoints which read from materialized views
+"""
+import hashlib
+
+from django.conf import settings
+from django.core.cache import caches
+from django.http import HttpResponse, HttpResponseNotModified
+from django.utils.cache import patch_vary_headers
+from django.utils.http import parse_etags, quote_etag
+
+from iatistore import generations
+
+
+def response_cache():
+    return caches[getattr(settings, "IATISTORE_CACHE", "default")]
+
+
+def max_cached_bytes() -> int:
+    return getattr(settings, "IATISTORE_CACHE_MAX_BYTES", 8 * 1024 * 1024)
+
+
+# Response headers kept with cached content
+CACHED_HEADERS = ("Content-Type", "Link")
+
+
+def _tee(chunks, key: str, headers: dict):
+    """
+    Pass streamed chunks through, caching the whole
+    response at the end unless it grew too large
+    """
+    buffer, size, limit = [], 0, max_cached_bytes()
+    for chunk in chunks:
+        if buffer is not None:
+            size += len(chunk)
+            if size <= limit:
+                buffer.append(chunk)
+            else:
+                buffer = None
+        yield chunk
+    if buffer is not None:
+        response_cache().set(key, (b"".join(buffer), headers))
+
+
+class CachedResponseMixin:
+    """
+    Cache GET responses keyed on the path, query string, Accept header
+    and the materialized view generation, so that entries are replaced
+    once the views are rebuilt or refreshed rather than expired.
+
+    The key doubles as an ETag, so clients repeating a request with
+    If-None-Match get a 304 while the views are unchanged.
+
+    Entries live in the IATISTORE_CACHE cache (default: "default") whose
+    TIMEOUT and MAX_ENTRIES bound eviction; responses larger than
+    IATISTORE_CACHE_MAX_BYTES are streamed but not cached.
+    """
+
+    def cache_key(self, request) -> str:
+        generation = generations.current(generations.MATVIEWS)
+        query = sorted(request.GET.lists())
+        vary = f"{request.path}|{query}|{request.headers.get('Accept', '')}"
+        digest = hashlib.md5(vary.encode()).hexdigest()
+        return f"iatistore:{generation}:{digest}"
+
+    def dispatch(self, request, *args, **kwargs):
+        if request.method != "GET":
+            return super().dispatch(request, *args, **kwargs)
+
+        key = self.cache_key(request)
+        etag = quote_etag(key)
+        if etag in parse_etags(request.headers.get("If-None-Match", "")):
+            response = HttpResponseNotModified()
+            response["ETag"] = etag
+            patch_vary_headers(response, ["Accept"])
+            return response
+
+        cached = response_cache().get(key)
+        if cached is not None:
+            content, headers = cached
+            response = HttpResponse(content)
+            for header, value in headers.items():
+                response[header] = value
+            response["ETag"] = etag
+            patch_vary_headers(response, ["Accept"])
+            return response
+
+        response = super().dispatch(request, *args, **kwargs)
+        if response.status_code != 200:
+            return response
+        response["ETag"] = etag
+        # The key, and so the content, depends on the Accept header
+        patch_vary_headers(response, ["Accept"])
+        headers = {h: response[h] for h in CACHED_HEADERS if response.has_header(h)}
+        if response.streaming:
+            response.streaming_content = _tee(response.streaming_content, key, headers)
+        elif len(response.content) <= max_cached_bytes():
+            response_cache().set(key, (response.content, headers))
+        return response
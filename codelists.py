@@ -0,0 +1,164 @@
+"""
+In-process lookup of codelist item names by (iati_version, codelist
+label, code, lang), for labelling codes on every row of a response or
+an export without a query or a join per row: see `column_namers` and
+`name_codes`, used by the JSON and Arrow views and the Parquet export.
+
+Each codelist is loaded from IatiCodelistItem the first time it is
+looked up. Loaded codelists are dropped when the codelist generation
+counter, which is bumped by every codelist sync that changes something,
+moves on. The counter is read at most every
+IATISTORE_CODELIST_CHECK_SECONDS (default 60) seconds.
+"""
+import threading
+import time
+from decimal import Decimal
+from typing import Callable, Dict, Iterable, Iterator, Optional, Tuple
+
+from django.conf import settings
+
+from iatistore import generations
+
+DEFAULT_LANG = "en"
+
+
+def version_key(iati_version) -> Decimal:
+    return Decimal(str(iati_version)).quantize(Decimal("0.01"))
+
+
+class Codelist:
+    """
+    The names of one codelist's items: the position of each code,
+    and for each language a tuple of names in that order
+    """
+
+    __slots__ = ("codes", "names")
+
+    def __init__(self, items: Iterable[Tuple[str, Optional[dict]]]):
+        items = [(code, name or {}) for code, name in items]
+        self.codes: Dict[str, int] = {
+            code: index for index, (code, _) in enumerate(items)
+        }
+        langs = {lang for _, name in items for lang in name}
+        self.names: Dict[str, tuple] = {
+            lang: tuple(name.get(lang) for _, name in items) for lang in langs
+        }
+
+    def __len__(self):
+        return len(self.codes)
+
+    def name(self, code: str, lang: str = DEFAULT_LANG) -> Optional[str]:
+        """
+        The name of `code` in `lang`, falling back to the default
+        language and then to any language it has a name in
+        """
+        index = self.codes.get(code)
+        if index is None:
+            return None
+        for fallback in (lang, DEFAULT_LANG):
+            names = self.names.get(fallback)
+            if names and names[index] is not None:
+                return names[index]
+        for names in self.names.values():
+            if names[index] is not None:
+                return names[index]
+        return None
+
+
+class CodelistLookup:
+    def __init__(self, check_seconds: float = None):
+        if check_seconds is None:
+            check_seconds = getattr(settings, "IATISTORE_CODELIST_CHECK_SECONDS", 60)
+        self.check_seconds = check_seconds
+        self._lock = threading.Lock()
+        self._codelists: Dict[Tuple[Decimal, str], Codelist] = {}
+        self._generation = None
+        self._checked = None
+
+    def _check_generation(self):
+        now = time.monotonic()
+        if self._checked is not None and now - self._checked < self.check_seconds:
+            return
+        generation = generations.current(generations.CODELISTS)
+        with self._lock:
+            self._checked = now
+            if generation != self._generation:
+                self._codelists = {}
+                self._generation = generation
+
+    def invalidate(self):
+        """
+        Drop every loaded codelist and read the generation on next use
+        """
+        with self._lock:
+            self._codelists = {}
+            self._checked = None
+
+    @staticmethod
+    def _load(iati_version: Decimal, label: str) -> Codelist:
+        from iatistore.models import IatiCodelistItem
+
+        return Codelist(
+            IatiCodelistItem.objects.filter(
+                codelist__iati_version=iati_version, codelist__label=label
+            ).values_list("code", "name")
+        )
+
+    def codelist(self, iati_version, label: str) -> Codelist:
+        self._check_generation()
+        key = (version_key(iati_version), label)
+        codelist = self._codelists.get(key)
+        if codelist is None:
+            with self._lock:
+                codelist = self._codelists.get(key)
+                if codelist is None:
+                    codelist = self._codelists[key] = self._load(*key)
+        return codelist
+
+    def name(
+        self, iati_version, label: str, code: str, lang: str = DEFAULT_LANG
+    ) -> Optional[str]:
+        return self.codelist(iati_version, label).name(code, lang)
+
+    def namer(
+        self, iati_version, label: str, lang: str = DEFAULT_LANG
+    ) -> Callable[[str], Optional[str]]:
+        """
+        A function naming codes of one codelist, for labelling many rows
+        """
+        codelist = self.codelist(iati_version, label)
+        return lambda code: codelist.name(code, lang)
+
+
+lookup = CodelistLookup()
+
+
+def column_namers(
+    table, lang: str = DEFAULT_LANG
+) -> Dict[str, Callable[[str], Optional[str]]]:
+    """
+    A function naming the codes of each column of `table` which the
+    codelist mapping maps to a codelist, by column name. Only
+    IatiXmlTables have such columns.
+    """
+    from iatistore.models import IatiXmlTable
+
+    if not isinstance(table, IatiXmlTable):
+        return {}
+    return {
+        col_name: lookup.namer(table.iati_version, label, lang)
+        for col_name, label in table.codelist_labels()
+    }
+
+
+def name_codes(
+    rows: Iterable[dict], namers: Dict[str, Callable[[str], Optional[str]]]
+) -> Iterator[dict]:
+    """
+    `rows` with a "<column>_name" value for each column in `namers`
+    """
+    for row in rows:
+        for col_name, namer in namers.items():
+            code = row.get(col_name)
+            row[f"{col_name}_name"] = None if code is None else namer(str(code))
+        yield row
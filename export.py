@@ -0,0 +1,243 @@
+"""
+Columnar export of the materialized views as Arrow record batches,
+written to Parquet files or streamed in the Arrow IPC stream format.
+
+Column types follow each XmlColumn's `col_xsd_type`. Values are cast
+in the database; those which do not parse as their declared type are
+exported as nulls rather than failing the export.
+
+Given a language, columns mapped to a codelist are followed by a
+"<column>_name" column naming their codes, from `codelists.lookup`.
+
+Requires pyarrow, which is optional.
+"""
+import io
+from typing import Callable, Dict, Iterator, List, NamedTuple, Optional
+
+from django.core.exceptions import ImproperlyConfigured
+
+from .codelists import column_namers
+from .streaming import fetch_batches
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+ARROW_STREAM = "application/vnd.apache.arrow.stream"
+
+INTEGER = r"^\s*[-+]?[0-9]+\s*$"
+NUMBER = r"^\s*[-+]?([0-9]+\.?[0-9]*|\.[0-9]+)([eE][-+]?[0-9]+)?\s*$"
+DATE = r"^\s*[0-9]{4}-[0-9]{2}-[0-9]{2}"
+DATETIME = r"^\s*[0-9]{4}-[0-9]{2}-[0-9]{2}T[0-9]{2}:[0-9]{2}"
+
+# SQL casting a text value "{}" to each export type, null if it does not parse
+CASTS = {
+    "text": "{}",
+    "integer": f"CASE WHEN {{}} ~ '{INTEGER}' THEN trim({{}})::numeric::bigint END",
+    "number": f"CASE WHEN {{}} ~ '{NUMBER}' THEN trim({{}})::float8 END",
+    "boolean": (
+        "CASE lower(trim({})) WHEN 'true' THEN true WHEN '1' THEN true "
+        "WHEN 'false' THEN false WHEN '0' THEN false END"
+    ),
+    "date": f"CASE WHEN {{}} ~ '{DATE}' THEN substr(trim({{}}), 1, 10)::date END",
+    "datetime": (
+        f"CASE WHEN {{}} ~ '{DATETIME}' THEN "
+        "(trim({}) || CASE WHEN trim({}) ~ '(Z|[-+][0-9:]+)$' THEN '' "
+        "ELSE 'Z' END)::timestamptz END"
+    ),
+}
+
+XSD_TYPES = {
+    "int": "integer",
+    "integer": "integer",
+    "long": "integer",
+    "short": "integer",
+    "nonNegativeInteger": "integer",
+    "positiveInteger": "integer",
+    "decimal": "number",
+    "double": "number",
+    "float": "number",
+    "boolean": "boolean",
+    "date": "date",
+    "dateTime": "datetime",
+}
+
+
+def require_pyarrow():
+    if pyarrow is None:
+        raise ImproperlyConfigured("Arrow and Parquet exports require pyarrow")
+
+
+def arrow_type(export_type: str):
+    return {
+        "text": pyarrow.string(),
+        "integer": pyarrow.int64(),
+        "number": pyarrow.float64(),
+        "boolean": pyarrow.bool_(),
+        "date": pyarrow.date32(),
+        "datetime": pyarrow.timestamp("us", tz="UTC"),
+        "version": pyarrow.decimal128(3, 2),
+        "ordinality": pyarrow.int32(),
+    }[export_type]
+
+
+class ExportColumn(NamedTuple):
+    name: str
+    export_type: str
+
+    @classmethod
+    def from_xsd(cls, name: str, xsd_type: str = None) -> "ExportColumn":
+        """
+        The export type of an XmlColumn's `col_xsd_type`,
+        with or without its namespace prefix
+        """
+        local_name = (xsd_type or "").rpartition(":")[2]
+        return cls(name, XSD_TYPES.get(local_name, "text"))
+
+    @property
+    def expression(self) -> str:
+        column = f'"{self.name}"'
+        if self.export_type in CASTS:
+            cast = CASTS[self.export_type].replace("{}", f"{column}::text")
+            return f"{cast} AS {column}"
+        return column
+
+    @property
+    def field(self):
+        return pyarrow.field(self.name, arrow_type(self.export_type))
+
+
+NARRATIVE_COLUMNS = [
+    ExportColumn("aims_identifier", "text"),
+    ExportColumn("iati_identifier", "text"),
+    ExportColumn("ordinality", "ordinality"),
+    ExportColumn("narrative_ordinality", "ordinality"),
+    ExportColumn("text", "text"),
+    ExportColumn("lang", "text"),
+    ExportColumn("ref", "text"),
+    ExportColumn("type", "text"),
+]
+
+
+def export_columns(table) -> List[ExportColumn]:
+    """
+    The columns of `table`'s materialized view, an IatiXmlTable, a
+    NarrativeXmlTable or CombinedNarratives, with their export types
+    """
+    from .models import CombinedNarratives, NarrativeXmlTable
+
+    if isinstance(table, NarrativeXmlTable):
+        return NARRATIVE_COLUMNS
+    if isinstance(table, CombinedNarratives):
+        return NARRATIVE_COLUMNS + [ExportColumn("narrative_type", "text")]
+    columns = [
+        ExportColumn("iati_identifier", "text"),
+        ExportColumn("iati_version", "version"),
+    ]
+    for name, xsd_type in table.columns.values_list("col_name", "col_xsd_type"):
+        if name not in ("iati_identifier", "iati_version"):
+            columns.append(ExportColumn.from_xsd(name, xsd_type))
+    return columns
+
+
+def arrow_schema(columns: List[ExportColumn]):
+    require_pyarrow()
+    return pyarrow.schema([column.field for column in columns])
+
+
+Namers = Dict[str, Callable[[str], Optional[str]]]
+
+
+def export_namers(table, lang: str = None) -> Namers:
+    """
+    The functions naming codes in `lang` of `table`'s columns,
+    by column name, or none without a language
+    """
+    return column_namers(table, lang) if lang else {}
+
+
+def export_schema(table, namers: Namers):
+    return arrow_schema(
+        export_columns(table)
+        + [ExportColumn(f"{col_name}_name", "text") for col_name in namers]
+    )
+
+
+def record_batches(table, batch_size: int = None, lang: str = None) -> Iterator:
+    """
+    The rows of `table`'s materialized view as Arrow record batches
+    of up to `batch_size` (default: IATISTORE_CURSOR_ITERSIZE) rows, read
+    from a server-side cursor which is opened before this returns.
+    With `lang`, codes are named in that language.
+    """
+    columns = export_columns(table)
+    namers = export_namers(table, lang)
+    schema = export_schema(table, namers)
+    select = ", ".join(column.expression for column in columns)
+    positions = [
+        [column.name for column in columns].index(col_name) for col_name in namers
+    ]
+    _, batches = fetch_batches(
+        f'SELECT {select} FROM "{table.table_name}"', size=batch_size
+    )
+
+    def arrays(rows: list) -> list:
+        values = list(zip(*rows))
+        for position, namer in zip(positions, namers.values()):
+            values.append(
+                [
+                    None if code is None else namer(str(code))
+                    for code in values[position]
+                ]
+            )
+        return [
+            pyarrow.array(column, type=field.type)
+            for column, field in zip(values, schema)
+        ]
+
+    return (
+        pyarrow.RecordBatch.from_arrays(arrays(rows), schema=schema) for rows in batches
+    )
+
+
+def write_parquet(table, path, batch_size: int = None, lang: str = None) -> int:
+    """
+    Write `table`'s materialized view to a Parquet file at `path`,
+    one row group per batch, returning the number of rows written
+    """
+    schema = export_schema(table, export_namers(table, lang))
+    written = 0
+    with pyarrow.parquet.ParquetWriter(path, schema) as writer:
+        for batch in record_batches(table, batch_size, lang):
+            writer.write_batch(batch)
+            written += batch.num_rows
+    return written
+
+
+def _drain(buffer: io.BytesIO) -> bytes:
+    data = buffer.getvalue()
+    buffer.seek(0)
+    buffer.truncate()
+    return data
+
+
+def ipc_chunks(table, batch_size: int = None, lang: str = None) -> Iterator[bytes]:
+    """
+    `table`'s materialized view in the Arrow IPC stream
+    format, as a chunk of bytes per record batch.
+    Missing pyarrow and database errors are raised before this returns.
+    """
+    require_pyarrow()
+    schema = export_schema(table, export_namers(table, lang))
+    return _ipc_stream(schema, record_batches(table, batch_size, lang))
+
+
+def _ipc_stream(schema, batches: Iterator) -> Iterator[bytes]:
+    buffer = io.BytesIO()
+    with pyarrow.ipc.new_stream(buffer, schema) as writer:
+        for batch in batches:
+            writer.write_batch(batch)
+            yield _drain(buffer)
+    yield _drain(buffer)
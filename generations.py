@@ -0,0 +1,31 @@
+"""
+Generation counters, kept in PostgreSQL sequences so that every process
+sees the same value. A counter is bumped whenever the data it covers
+changes; anything derived from that data can be keyed on the counter
+and needs no other invalidation.
+"""
+from django.db import connection
+
+# Bumped when materialized views are created or refreshed
+MATVIEWS = "iatistore_matview_generation"
+
+# Bumped when codelist names, descriptions or items change
+CODELISTS = "iatistore_codelist_generation"
+
+
+def current(sequence: str) -> int:
+    """
+    The generation, 0 until the first bump: a new sequence
+    already has a "last_value" of 1
+    """
+    with connection.cursor() as c:
+        c.execute(
+            f"SELECT CASE WHEN is_called THEN last_value ELSE 0 END FROM {sequence}"
+        )
+        return c.fetchone()[0]
+
+
+def bump(sequence: str) -> int:
+    with connection.cursor() as c:
+        c.execute("SELECT nextval(%s)", [sequence])
+        return c.fetchone()[0]
@@ -0,0 +1,38 @@
+-- Merge the rows COPY'd into the "iatistore_iatiactivities_staging" temp table
+-- into "iatistore_iatiactivities". Where an activity appears more than once
+-- the last row loaded wins. Activities whose content hash is unchanged only
+-- have "last_seen" updated. Activities published in a new version are moved
+-- to that version's partition.
+UPDATE iatistore_iatiactivities
+SET last_seen = now()
+FROM iatistore_iatiactivities_staging staging
+WHERE iatistore_iatiactivities.id = staging.id
+AND iatistore_iatiactivities.content_hash = staging.content_hash;
+
+DELETE FROM iatistore_iatiactivities
+USING (
+    SELECT DISTINCT ON (id) id, iati_version
+    FROM iatistore_iatiactivities_staging
+    ORDER BY id, seq DESC
+) latest
+WHERE iatistore_iatiactivities.id = latest.id
+AND iatistore_iatiactivities.iati_version <> latest.iati_version;
+
+INSERT INTO iatistore_iatiactivities (id, iati_identifier, content, iati_version, content_hash, reporting_org_ref, last_seen)
+SELECT DISTINCT ON (id)
+    id,
+    iati_identifier,
+    content::xml,
+    iati_version,
+    content_hash,
+    reporting_org_ref,
+    now()
+FROM iatistore_iatiactivities_staging
+ORDER BY id, seq DESC
+ON CONFLICT (id, iati_version) DO UPDATE SET
+    iati_identifier = EXCLUDED.iati_identifier,
+    content = EXCLUDED.content,
+    content_hash = EXCLUDED.content_hash,
+    reporting_org_ref = EXCLUDED.reporting_org_ref,
+    last_seen = EXCLUDED.last_seen
+WHERE iatistore_iatiactivities.content_hash IS DISTINCT FROM EXCLUDED.content_hash;
@@ -1,11 +1,12 @@
 -- This code will update the values of the "Codelist" with a Description and Description
--- field based on the XML content.
+-- field based on the XML content, for the codelists whose ids are passed as "ids".
 WITH cols AS
   (SELECT id,
           xmltable.content,
           COALESCE(lang, default_lang) lc
    FROM iatistore_iaticodelist,
-        xmltable('/codelist/metadata/description/narrative' passing content columns "lang" text PATH '@xml:lang', "default_lang" text PATH '../../../@xml:lang', "content" text PATH '.')),
+        xmltable('/codelist/metadata/description/narrative' passing content columns "lang" text PATH '@xml:lang', "default_lang" text PATH '../../../@xml:lang', "content" text PATH '.'))
+   WHERE id = ANY(%(ids)s)),
                                                               json_aggregated AS
   (SELECT id,
           json_object_agg(lc, content) agg
@@ -16,4 +17,5 @@ UPDATE iatistore_iaticodelist
 SET "description" =
   (SELECT agg
    FROM json_aggregated
-   WHERE json_aggregated.id = iatistore_iaticodelist.id);
\ No newline at end of file
+   WHERE json_aggregated.id = iatistore_iaticodelist.id)
+WHERE id = ANY(%(ids)s);
\ No newline at end of file
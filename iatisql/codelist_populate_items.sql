@@ -1,5 +1,5 @@
 INSERT INTO iatistore_iaticodelistitem (codelist_id, code, activation_date, status, withdrawal_date)
-	SELECT DISTINCT
+	SELECT DISTINCT ON (iatistore_iaticodelist.id, xmltable."code")
 		iatistore_iaticodelist.id codelist_id,
 		xmltable."code",
 		xmltable."activation_date",
@@ -13,4 +13,26 @@ INSERT INTO iatistore_iaticodelistitem (codelist_id, code, activation_date, stat
 			"activation_date" date PATH '@activation-date',
 			"status" text PATH '@status',
 			"withdrawal_date" date PATH '@withdrawal-date'
-	 )
\ No newline at end of file
+	 )
+	WHERE xmltable."code" IS NOT NULL
+	AND iatistore_iaticodelist.id = ANY(%(ids)s)
+ON CONFLICT (codelist_id, code) DO UPDATE SET
+	activation_date = EXCLUDED.activation_date,
+	status = EXCLUDED.status,
+	withdrawal_date = EXCLUDED.withdrawal_date
+WHERE (iatistore_iaticodelistitem.activation_date, iatistore_iaticodelistitem.status, iatistore_iaticodelistitem.withdrawal_date)
+	IS DISTINCT FROM (EXCLUDED.activation_date, EXCLUDED.status, EXCLUDED.withdrawal_date);
+
+-- Items no longer in their codelist's XML
+DELETE FROM iatistore_iaticodelistitem li
+WHERE li.codelist_id = ANY(%(ids)s)
+AND NOT EXISTS (
+	SELECT 1
+	FROM iatistore_iaticodelist,
+	XMLTABLE(
+		'/codelist/codelist-items/codelist-item' PASSING "content"
+		COLUMNS "code" text PATH 'code'
+	)
+	WHERE iatistore_iaticodelist.id = li.codelist_id
+	AND xmltable."code" = li.code
+);
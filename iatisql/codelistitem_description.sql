@@ -1,33 +1,34 @@
-CREATE TEMP TABLE iatistore_iaticodelistitem_description AS (
-	WITH src AS (
-		SELECT 
-			iatistore_iaticodelist.id iaticodelist_id,
-			xmltable.*
-		FROM iatistore_iaticodelist,
-		XMLTABLE(
-			'/codelist/codelist-items/codelist-item/description/narrative' PASSING "content"
-			COLUMNS "lang" text PATH '@xml:lang',
-			"default_lang" text PATH '../../../../@xml:lang',
-			"content" text PATH '.',
-			"code" text PATH '../../code'
-		)
-	), json_aggregated AS (
-		SELECT
-			iaticodelist_id, code,
-			json_object_agg(COALESCE(lang, default_lang), content) agg
-		FROM src
-		WHERE content != ''
-		GROUP BY iaticodelist_id, code
-	) SELECT * FROM json_aggregated);
-
-
-CREATE INDEX ON iatistore_iaticodelistitem_description (code);
-CREATE INDEX ON iatistore_iaticodelistitem_description (iaticodelist_id);
-	
-UPDATE iatistore_iaticodelistitem li SET "description" = (
-	SELECT agg FROM iatistore_iaticodelistitem_description ja 
-	WHERE ja.iaticodelist_id = li.codelist_id
+-- Set the "description" of the items of the codelists whose ids are passed
+-- as "ids", only writing those rows which change
+WITH src AS (
+	SELECT 
+		iatistore_iaticodelist.id iaticodelist_id,
+		xmltable.*
+	FROM iatistore_iaticodelist,
+	XMLTABLE(
+		'/codelist/codelist-items/codelist-item/description/narrative' PASSING "content"
+		COLUMNS "lang" text PATH '@xml:lang',
+		"default_lang" text PATH '../../../../@xml:lang',
+		"content" text PATH '.',
+		"code" text PATH '../../code'
+	)
+	WHERE iatistore_iaticodelist.id = ANY(%(ids)s)
+), json_aggregated AS (
+	SELECT
+		iaticodelist_id, code,
+		jsonb_object_agg(COALESCE(lang, default_lang), content) agg
+	FROM src
+	WHERE content != ''
+	GROUP BY iaticodelist_id, code
+), items AS (
+	SELECT li.id, ja.agg
+	FROM iatistore_iaticodelistitem li
+	LEFT JOIN json_aggregated ja
+	ON ja.iaticodelist_id = li.codelist_id
 	AND ja.code = li.code
-);
-
-DROP TABLE iatistore_iaticodelistitem_description;
+	WHERE li.codelist_id = ANY(%(ids)s)
+)
+UPDATE iatistore_iaticodelistitem li SET "description" = items.agg
+FROM items
+WHERE li.id = items.id
+AND li."description" IS DISTINCT FROM items.agg;
@@ -0,0 +1,113 @@
+"""
+Helpers for loading activity data into PostgreSQL
+"""
+import hashlib
+import io
+import logging
+from typing import Iterable, Iterator, List, Optional, Tuple
+
+from django.utils.text import slugify
+from lxml import etree
+
+DATASTORE_NS = "http://datastore.iatistandard.org/ns"
+
+logger = logging.getLogger(__name__)
+
+
+def activity_fields(a) -> dict:
+    """
+    IatiActivities field values for an "iati-activity" element
+    from the datastore
+    """
+    iati_identifier = a.find("iati-identifier").text.strip()
+    reporting_org = a.find("reporting-org")
+    content = etree.tostring(a)
+    return dict(
+        id=slugify(iati_identifier),
+        iati_identifier=iati_identifier,
+        content=content.decode(),
+        iati_version=a.attrib[f"{{{DATASTORE_NS}}}version"],
+        content_hash=hashlib.sha256(content).hexdigest(),
+        reporting_org_ref=(
+            reporting_org.get("ref") if reporting_org is not None else None
+        ),
+    )
+
+
+def activity_id(a) -> Optional[str]:
+    """
+    The IatiActivities id of an "iati-activity" element which
+    `activity_fields` could not read, if it has an identifier
+    """
+    iati_identifier = (a.findtext("iati-identifier") or "").strip()
+    return slugify(iati_identifier) or None
+
+
+def parse_page(content: bytes) -> Tuple[int, List[dict], List[str]]:
+    """
+    Parse one page of datastore XML into activity field values.
+    Returns the number of activities found alongside the rows
+    for those which could be read and the ids of those which could not.
+    This runs in the worker processes of pipeline.ActivityPipeline,
+    which only import this module, not Django's settings or models.
+    """
+    found, rows, failed = 0, [], []
+    for a in etree.fromstring(content).iter("iati-activity"):
+        found += 1
+        try:
+            rows.append(activity_fields(a))
+        except Exception as e:
+            logger.error(e)
+            unreadable = activity_id(a)
+            if unreadable:
+                failed.append(unreadable)
+    return found, rows, failed
+
+
+def copy_escape(value) -> str:
+    """
+    Escape a value for the PostgreSQL COPY text format
+    """
+    if value is None:
+        return "\\N"
+    return (
+        str(value)
+        .replace("\\", "\\\\")
+        .replace("\t", "\\t")
+        .replace("\n", "\\n")
+        .replace("\r", "\\r")
+    )
+
+
+def copy_lines(rows: Iterable[Iterable]) -> Iterator[str]:
+    """
+    Yield one COPY text format line per row
+    """
+    for row in rows:
+        yield "\t".join(copy_escape(value) for value in row) + "\n"
+
+
+class CopyStream(io.RawIOBase):
+    """
+    A readable file which pulls lines from an iterator on demand,
+    so that "COPY ... FROM STDIN" never holds more than one read
+    buffer of data in memory
+    """
+
+    def __init__(self, lines: Iterable[str]):
+        self._lines = iter(lines)
+        self._buffer = b""
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        while len(self._buffer) < len(b):
+            try:
+                self._buffer += next(self._lines).encode()
+            except StopIteration:
+                break
+        size = min(len(b), len(self._buffer))
+        b[:size] = self._buffer[:size]
+        self._buffer = self._buffer[size:]
+        return size
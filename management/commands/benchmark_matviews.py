@@ -0,0 +1,125 @@
+import json
+from decimal import Decimal
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from iatistore import benchmark, standard
+
+
+class Command(BaseCommand):
+    help = (
+        "Time building the materialized views and the endpoints reading them, "
+        "optionally on synthetic activities, and write a JSON report. "
+        "Views are rebuilt and swapped in: run this against a scratch database."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--iati-version",
+            dest="versions",
+            action="append",
+            type=Decimal,
+            help="IATI version to benchmark (repeatable; default: IATI_VERSIONS)",
+        )
+        parser.add_argument(
+            "--load",
+            action="store_true",
+            help="Load synthetic activities before timing",
+        )
+        parser.add_argument(
+            "--activities",
+            type=int,
+            default=1000,
+            help="Synthetic activities per IATI version (default: 1000)",
+        )
+        parser.add_argument(
+            "--transactions",
+            type=int,
+            default=5,
+            help="Transactions per synthetic activity (default: 5)",
+        )
+        parser.add_argument(
+            "--narratives",
+            type=int,
+            default=2,
+            help="Narratives per narrative element (default: 2)",
+        )
+        parser.add_argument(
+            "--seed", type=int, default=0, help="Seed of the synthetic activities"
+        )
+        parser.add_argument(
+            "--keep",
+            action="store_true",
+            help="Keep the synthetic activities afterwards",
+        )
+        parser.add_argument(
+            "--no-explain",
+            action="store_false",
+            dest="explain",
+            help="Skip EXPLAIN of each view's query",
+        )
+        parser.add_argument(
+            "--analyze",
+            action="store_true",
+            help="EXPLAIN ANALYZE each view's query, which runs it again",
+        )
+        parser.add_argument("--output", help="Write the JSON report to this file")
+        parser.add_argument(
+            "--compare", help="Compare timings with an earlier JSON report"
+        )
+
+    def handle(self, *args, **options):
+        previous = None
+        if options["compare"]:
+            try:
+                with open(options["compare"]) as f:
+                    previous = json.load(f)
+            except (OSError, ValueError) as e:
+                raise CommandError(f"Could not read {options['compare']}: {e}")
+
+        versions = options["versions"] or getattr(settings, "IATI_VERSIONS")
+        load = None
+        if options["load"]:
+            missing = [v for v in versions if not standard.has_summary_table(v)]
+            if missing:
+                raise CommandError(
+                    "No activity standard summary table for "
+                    f"{', '.join(map(str, missing))}"
+                )
+            load = dict(
+                count=options["activities"],
+                seed=options["seed"],
+                repeats=dict(
+                    transaction=options["transactions"],
+                    narrative=options["narratives"],
+                ),
+            )
+        try:
+            report = benchmark.run(
+                versions,
+                load=load,
+                plan=options["explain"],
+                analyze=options["analyze"],
+            )
+        finally:
+            if load is not None and not options["keep"]:
+                benchmark.remove_synthetic()
+
+        if options["output"]:
+            with open(options["output"], "w") as f:
+                json.dump(report, f, indent=2, default=str)
+
+        timings = (
+            benchmark.compare(report, previous) if previous else report["measurements"]
+        )
+        for timing in timings:
+            kind, name, seconds = timing["kind"], timing["name"], timing["seconds"]
+            line = f"{kind:<15} {name:<50} {seconds:8.2f}s"
+            before = timing.get("previous")
+            if before:
+                line += f" (was {before:.2f}s, {seconds / before:.2f}x)"
+            if not timing.get("ok", True):
+                line += f" FAILED {timing.get('error') or ''}".rstrip()
+                line = self.style.ERROR(line)
+            self.stdout.write(line)
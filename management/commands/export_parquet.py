@@ -0,0 +1,86 @@
+import os
+import time
+from decimal import Decimal
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management.base import BaseCommand, CommandError
+
+from iatistore import export
+from iatistore.models import CombinedNarratives, IatiXmlTable, NarrativeXmlTable
+
+
+class Command(BaseCommand):
+    help = (
+        "Write the materialized views of IatiXmlTables and NarrativeXmlTables "
+        "to Parquet files, typed from their columns' XSD types"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("output", help="Directory to write Parquet files to")
+        parser.add_argument(
+            "--iati-version",
+            dest="versions",
+            action="append",
+            type=Decimal,
+            help="IATI version to export (repeatable; default: IATI_VERSIONS)",
+        )
+        parser.add_argument(
+            "--row-expression",
+            help="Only export tables with this row expression",
+        )
+        parser.add_argument(
+            "--no-narratives",
+            action="store_false",
+            dest="narratives",
+            help="Skip narrative views",
+        )
+        parser.add_argument(
+            "--names",
+            metavar="LANG",
+            help="Add the names, in LANG, of codes in columns mapped to a codelist",
+        )
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=None,
+            help="Rows per record batch (default: IATISTORE_CURSOR_ITERSIZE)",
+        )
+
+    def handle(self, *args, **options):
+        try:
+            export.require_pyarrow()
+        except ImproperlyConfigured as e:
+            raise CommandError(e)
+        os.makedirs(options["output"], exist_ok=True)
+
+        versions = options["versions"] or getattr(settings, "IATI_VERSIONS")
+        row_expression = options["row_expression"]
+        querysets = [IatiXmlTable.objects.filter(iati_version__in=versions)]
+        if options["narratives"]:
+            querysets.append(
+                NarrativeXmlTable.objects.filter(iati_version__in=versions)
+            )
+        tables = []
+        for queryset in querysets:
+            if row_expression:
+                queryset = queryset.filter(row_expression=row_expression)
+            tables += list(queryset)
+        if options["narratives"] and not row_expression:
+            tables += [CombinedNarratives(version) for version in versions]
+
+        for table in tables:
+            if not table.matview_exists():
+                self.stderr.write(f"Skipping {table}: no materialized view")
+                continue
+            path = os.path.join(options["output"], f"{table.table_name}.parquet")
+            start = time.monotonic()
+            written = export.write_parquet(
+                table, path, options["batch_size"], lang=options["names"]
+            )
+            self.stdout.write(
+                self.style.SUCCESS(
+                    f"{written} rows of {table} to {path} "
+                    f"in {time.monotonic() - start:.2f}s"
+                )
+            )
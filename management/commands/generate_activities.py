@@ -0,0 +1,111 @@
+import os
+import time
+from decimal import Decimal
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from iatistore import standard, synthetic
+from iatistore.models import IatiActivities, batched
+
+
+def repeat(value: str):
+    element, _, count = value.partition("=")
+    if not element or not count.isdigit():
+        raise ValueError(value)
+    return element, int(count)
+
+
+class Command(BaseCommand):
+    help = (
+        "Generate synthetic activities shaped by the activity standard summary "
+        "tables and load them into IatiActivities, or write them to files"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--iati-version",
+            dest="versions",
+            action="append",
+            type=Decimal,
+            help="IATI version to generate (repeatable; default: IATI_VERSIONS)",
+        )
+        parser.add_argument(
+            "--count",
+            type=int,
+            default=10000,
+            help="Activities per IATI version (default: 10000)",
+        )
+        parser.add_argument(
+            "--repeat",
+            action="append",
+            type=repeat,
+            default=[],
+            metavar="ELEMENT=COUNT",
+            help=(
+                "Number of an element, by name or path below iati-activity, "
+                "in each activity (repeatable, e.g. transaction=20 narrative=2)"
+            ),
+        )
+        parser.add_argument(
+            "--optional",
+            type=float,
+            default=0.5,
+            help="Probability of generating each optional element and attribute",
+        )
+        parser.add_argument(
+            "--codelists",
+            action="store_true",
+            help="Pick codes from the codelists in the database",
+        )
+        parser.add_argument(
+            "--seed", type=int, default=0, help="Seed of the synthetic activities"
+        )
+        parser.add_argument(
+            "--output",
+            help="Write iati-activities files to this directory instead of loading",
+        )
+        parser.add_argument(
+            "--per-file",
+            type=int,
+            default=10000,
+            help="Activities per file written (default: 10000)",
+        )
+
+    def handle(self, *args, **options):
+        versions = options["versions"] or getattr(settings, "IATI_VERSIONS")
+        missing = [v for v in versions if not standard.has_summary_table(v)]
+        if missing:
+            raise CommandError(
+                f"No activity standard summary table for {', '.join(map(str, missing))}"
+            )
+        if options["output"]:
+            os.makedirs(options["output"], exist_ok=True)
+
+        for version in versions:
+            generator_options = dict(
+                repeats=dict(options["repeat"]), optional=options["optional"]
+            )
+            if options["codelists"]:
+                generator_options["codes"] = synthetic.database_codes(version)
+            activities = synthetic.standard_activities(
+                options["count"], [version], options["seed"], **generator_options
+            )
+            start = time.monotonic()
+            if options["output"]:
+                written = 0
+                for number, batch in enumerate(
+                    batched(activities, options["per_file"])
+                ):
+                    name = f"{synthetic.PREFIX.lower()}-{version}-{number:05d}.xml"
+                    path = os.path.join(options["output"], name)
+                    written += synthetic.write_activities(path, batch, version)
+            else:
+                written = IatiActivities.copy_activities(activities)
+            seconds = time.monotonic() - start
+            self.stdout.write(
+                self.style.SUCCESS(
+                    f"{written} activities of version {version} in {seconds:.2f}s "
+                    f"({written / seconds if seconds else 0:.0f} activities/s)"
+                )
+            )
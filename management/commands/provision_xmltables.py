@@ -0,0 +1,91 @@
+from decimal import Decimal
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from iatistore import matviews, standard
+from iatistore.models import UNIFIED_TABLES, IatiXmlTable
+
+
+class Command(BaseCommand):
+    help = (
+        "Create or update the IatiXmlTable and IatiXmlColumn definitions of "
+        "each IATI version from the activity standard summary tables, "
+        "touching only the tables whose columns differ"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--iati-version",
+            dest="versions",
+            action="append",
+            type=Decimal,
+            help="IATI version to provision (repeatable; default: IATI_VERSIONS)",
+        )
+        parser.add_argument(
+            "--prune",
+            action="store_true",
+            help="Remove columns which are not in the standard",
+        )
+        parser.add_argument(
+            "--dry-run",
+            action="store_true",
+            help="Report what would change without saving anything",
+        )
+        parser.add_argument(
+            "--rebuild",
+            action="store_true",
+            help=(
+                "Rebuild the materialized views of the tables which changed "
+                "and the unified tables read from them"
+            ),
+        )
+        parser.add_argument(
+            "--workers",
+            type=int,
+            default=getattr(settings, "IATISTORE_MATVIEW_WORKERS", 4),
+            help="Number of database connections to build views on",
+        )
+
+    def handle(self, *args, **options):
+        versions = options["versions"] or getattr(settings, "IATI_VERSIONS")
+        missing = [v for v in versions if not standard.has_summary_table(v)]
+        if missing:
+            raise CommandError(
+                "No activity standard summary table for "
+                f"{', '.join(map(str, missing))}"
+            )
+
+        changed = []
+        for version in versions:
+            changes = IatiXmlTable.provision(
+                version, prune=options["prune"], dry_run=options["dry_run"]
+            )
+            for change in changes:
+                action = "created" if change.created else "updated"
+                line = f"v{version} {change.row_expression}: {action}"
+                if change.added:
+                    line += f", +{', +'.join(change.added)}"
+                if change.removed:
+                    line += f", -{', -'.join(change.removed)}"
+                self.stdout.write(line)
+            changed += [change.table for change in changes if change.table]
+            self.stdout.write(
+                self.style.SUCCESS(f"v{version}: {len(changes)} tables changed")
+            )
+
+        if options["rebuild"] and changed:
+            timings = matviews.rebuild(changed, workers=options["workers"])
+            # Unified tables copy the views, so they would be stale otherwise
+            row_expressions = {table.row_expression for table in changed}
+            timings += matviews.rebuild_unified(
+                table
+                for table in UNIFIED_TABLES.values()
+                if table.row_expression in row_expressions
+            )
+            for timing in timings:
+                style = self.style.SUCCESS if timing.ok else self.style.ERROR
+                status = "ok" if timing.ok else "FAILED"
+                self.stdout.write(
+                    style(f"{timing.seconds:9.2f}s  {status:6}  {timing.name}")
+                )
@@ -0,0 +1,88 @@
+from decimal import Decimal
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from iatistore import matviews
+from iatistore.models import (
+    UNIFIED_TABLES,
+    CombinedNarratives,
+    IatiXmlTable,
+    NarrativeXmlTable,
+)
+
+
+class Command(BaseCommand):
+    help = (
+        "Rebuild the materialized views of every IatiXmlTable and "
+        "NarrativeXmlTable, recreating any views which depend on them, "
+        "then the unified cross-version tables read by the API"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--workers",
+            type=int,
+            default=getattr(settings, "IATISTORE_MATVIEW_WORKERS", 4),
+            help="Number of database connections to build views on",
+        )
+        parser.add_argument(
+            "--iati-version",
+            dest="versions",
+            action="append",
+            type=Decimal,
+            help="IATI version to rebuild (repeatable; default: IATI_VERSIONS)",
+        )
+        parser.add_argument(
+            "--refresh",
+            action="store_true",
+            help=(
+                "Refresh views in place (concurrently or by build-and-swap) "
+                "so that readers never find them missing"
+            ),
+        )
+        parser.add_argument(
+            "--no-narratives",
+            action="store_false",
+            dest="narratives",
+            help=(
+                "Skip the combined narrative views. The views per "
+                "NarrativeXmlTable are only built with --narrative-views"
+            ),
+        )
+        parser.add_argument(
+            "--narrative-views",
+            action="store_true",
+            help="Also rebuild a view per NarrativeXmlTable",
+        )
+        parser.add_argument(
+            "--no-unified",
+            action="store_false",
+            dest="unified",
+            help="Skip rebuilding the unified cross-version tables",
+        )
+
+    def handle(self, *args, **options):
+        versions = options["versions"] or getattr(settings, "IATI_VERSIONS")
+        tables = list(IatiXmlTable.objects.filter(iati_version__in=versions))
+        if options["narratives"]:
+            tables += [CombinedNarratives(version) for version in versions]
+        if options["narrative_views"]:
+            tables += list(NarrativeXmlTable.objects.filter(iati_version__in=versions))
+
+        timings = matviews.rebuild(
+            tables, workers=options["workers"], refresh=options["refresh"]
+        )
+        if options["unified"]:
+            timings += matviews.rebuild_unified(UNIFIED_TABLES.values())
+
+        for timing in sorted(timings, key=lambda t: t.seconds, reverse=True):
+            style = self.style.SUCCESS if timing.ok else self.style.ERROR
+            status = "ok" if timing.ok else "FAILED"
+            line = f"{timing.seconds:9.2f}s  {status:6}  {timing.name}"
+            self.stdout.write(style(line))
+        failed = sum(1 for timing in timings if not timing.ok)
+        self.stdout.write(
+            f"{len(timings)} views in {sum(t.seconds for t in timings):.2f}s "
+            f"of build time, {failed} failed"
+        )
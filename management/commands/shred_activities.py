@@ -0,0 +1,38 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from iatistore import shredder
+
+
+class Command(BaseCommand):
+    help = (
+        "Parse activities into the header, transaction, participating-org "
+        "and narrative side tables, if their content changed since they "
+        "were last parsed"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--all",
+            action="store_true",
+            dest="everything",
+            help="Parse every activity again",
+        )
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=None,
+            help="Activities per batch (default: IATISTORE_BATCH_SIZE)",
+        )
+
+    def handle(self, *args, **options):
+        start = time.monotonic()
+        shredded = shredder.shred_pending(
+            everything=options["everything"], batch_size=options["batch_size"]
+        )
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Shredded {shredded} activities in {time.monotonic() - start:.2f}s"
+            )
+        )
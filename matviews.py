@@ -0,0 +1,236 @@
+"""
+Rebuilding the materialized views behind IatiXmlTable and NarrativeXmlTable.
+
+Views are built under shadow names across a pool of threads, each with
+its own database connection, while the current views stay readable.
+The views which were built are then swapped in together in one
+transaction, which also drops the views and materialized views depending
+on them (they would otherwise be silently removed by "DROP ... CASCADE")
+and recreates them with their indexes. If anything in that transaction
+fails, every view and dependent is left as it was.
+"""
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Iterable, List, NamedTuple, Set
+
+from django.db import connection, transaction
+
+from iatistore import generations
+
+logger = logging.getLogger(__name__)
+
+DEPENDENTS_SQL = """
+WITH RECURSIVE dependents AS (
+    SELECT
+        dependent.oid,
+        dependent.relname,
+        dependent.relkind,
+        source.relname AS depends_on
+    FROM pg_depend
+    JOIN pg_rewrite ON pg_depend.objid = pg_rewrite.oid
+    JOIN pg_class dependent ON pg_rewrite.ev_class = dependent.oid
+    JOIN pg_class source ON pg_depend.refobjid = source.oid
+    WHERE pg_depend.classid = 'pg_rewrite'::regclass
+    AND source.relname = ANY(%s)
+    AND pg_table_is_visible(source.oid)
+    AND dependent.oid <> source.oid
+  UNION
+    SELECT dependent.oid, dependent.relname, dependent.relkind, source.relname
+    FROM dependents source
+    JOIN pg_depend ON pg_depend.refobjid = source.oid
+    JOIN pg_rewrite ON pg_depend.objid = pg_rewrite.oid
+    JOIN pg_class dependent ON pg_rewrite.ev_class = dependent.oid
+    WHERE pg_depend.classid = 'pg_rewrite'::regclass
+    AND dependent.oid <> source.oid
+)
+SELECT
+    relname,
+    relkind,
+    array_agg(DISTINCT depends_on),
+    pg_get_viewdef(oid),
+    ARRAY(SELECT indexdef FROM pg_indexes WHERE tablename = relname)
+FROM dependents
+GROUP BY oid, relname, relkind
+"""
+
+
+class Dependent(NamedTuple):
+    """
+    A view which depends on a view being rebuilt
+    """
+
+    name: str
+    materialized: bool
+    depends_on: Set[str]
+    definition: str
+    indexes: List[str]
+
+    @property
+    def kind(self) -> str:
+        return "MATERIALIZED VIEW" if self.materialized else "VIEW"
+
+    def drop(self):
+        with connection.cursor() as c:
+            c.execute(f'DROP {self.kind} IF EXISTS "{self.name}" CASCADE')
+
+    def create(self) -> bool:
+        with connection.cursor() as c:
+            c.execute(f'CREATE {self.kind} "{self.name}" AS {self.definition}')
+            for index in self.indexes:
+                c.execute(index)
+        return True
+
+
+class Timing(NamedTuple):
+    name: str
+    seconds: float
+    ok: bool
+
+
+def get_dependents(names: Iterable[str]) -> Dict[str, Dependent]:
+    """
+    All views depending, directly or not, on the relations `names`
+    """
+    names = list(names)
+    with connection.cursor() as c:
+        c.execute(DEPENDENTS_SQL, [names])
+        dependents = {
+            name: Dependent(
+                name=name,
+                materialized=relkind == "m",
+                depends_on=set(depends_on),
+                definition=definition,
+                indexes=list(indexes),
+            )
+            for name, relkind, depends_on, definition, indexes in c.fetchall()
+            if name not in names
+        }
+    return dependents
+
+
+def in_dependency_order(dependents: Dict[str, Dependent]) -> List[Dependent]:
+    """
+    `dependents` ordered so that each comes after
+    the dependents it depends on
+    """
+    ordered, placed = [], set()
+    remaining = dict(dependents)
+    while remaining:
+        ready = [
+            name
+            for name, dependent in remaining.items()
+            if not (dependent.depends_on & set(remaining)) - placed
+        ]
+        if not ready:
+            raise ValueError(f"Circular dependencies among {sorted(remaining)}")
+        for name in ready:
+            ordered.append(remaining.pop(name))
+            placed.add(name)
+    return ordered
+
+
+def _run(name: str, build: Callable[[], bool]) -> Timing:
+    """
+    Build one view on this thread's connection
+    """
+    start = time.monotonic()
+    try:
+        ok = build() is not False
+    except Exception:
+        logger.error(f"Unable to build {name}", exc_info=1)
+        ok = False
+    timing = Timing(name=name, seconds=time.monotonic() - start, ok=ok)
+    logger.info(f"{name}: {'built' if ok else 'FAILED'} in {timing.seconds:.2f}s")
+    return timing
+
+
+def _run_on_worker(name: str, build: Callable[[], bool]) -> Timing:
+    """
+    Build one view on a pool thread, closing the
+    connection Django opened for that thread
+    """
+    try:
+        return _run(name, build)
+    finally:
+        connection.close()
+
+
+def swap_in(tables: List) -> bool:
+    """
+    Replace the views of `tables` with their shadow views in one
+    transaction, recreating the views which depend on them
+    """
+    start = time.monotonic()
+    try:
+        with transaction.atomic():
+            dependents = get_dependents(table.table_name for table in tables)
+            for dependent in dependents.values():
+                logger.info(f"Recreating {dependent.kind.lower()} {dependent.name}")
+                dependent.drop()
+            for table in tables:
+                table.matview_replace()
+            for dependent in in_dependency_order(dependents):
+                dependent.create()
+    except Exception:
+        logger.error("Unable to swap in the rebuilt views", exc_info=1)
+        for table in tables:
+            table.matview_drop_shadow()
+        return False
+    logger.info(
+        f"Swapped in {len(tables)} views and recreated {len(dependents)} "
+        f"dependents in {time.monotonic() - start:.2f}s"
+    )
+    return True
+
+
+def rebuild(tables: Iterable, workers: int = 4, refresh: bool = False) -> List[Timing]:
+    """
+    Rebuild the materialized views of `tables` (IatiXmlTable or
+    NarrativeXmlTable instances) on `workers` connections, then
+    swap in those which were built, recreating the views which
+    depend on them.
+    With `refresh` views with a unique index are refreshed in place
+    with "REFRESH ... CONCURRENTLY" instead, leaving their dependents
+    alone; the rest are rebuilt and swapped in as usual.
+    """
+    tables = {table.table_name: table for table in tables}
+    in_place = {
+        name
+        for name, table in tables.items()
+        if refresh and table.matview_exists() and table.matview_is_unique()
+    }
+
+    def build(table) -> Timing:
+        if table.table_name in in_place:
+            return _run_on_worker(str(table), table.matview_refresh)
+        return _run_on_worker(str(table), table.matview_build_shadow)
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        timings = list(pool.map(build, tables.values()))
+
+    built = [
+        table
+        for table, timing in zip(tables.values(), timings)
+        if timing.ok and table.table_name not in in_place
+    ]
+    # Every swap and dependent is handled in one transaction on this
+    # connection, so the workers never contend for the same dependents
+    if built and not swap_in(built):
+        timings = [
+            timing._replace(ok=False) if name not in in_place else timing
+            for name, timing in zip(tables, timings)
+        ]
+    if any(timing.ok for timing in timings):
+        generations.bump(generations.MATVIEWS)
+    return timings
+
+
+def rebuild_unified(tables: Iterable) -> List[Timing]:
+    """
+    Rebuild the UnifiedXmlTable `tables`, one after the other on the
+    calling thread, from the materialized views they are read from.
+    This is the only place unified tables are built: the endpoints
+    reading them answer 503 until they exist.
+    """
+    return [_run(str(table), table.rebuild) for table in tables]
@@ -0,0 +1,21 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("iatistore", "0016_auto_20200122_0636"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="iatiactivities",
+            name="content_hash",
+            field=models.CharField(blank=True, max_length=64, null=True),
+        ),
+        migrations.AddField(
+            model_name="iatiactivities",
+            name="last_seen",
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
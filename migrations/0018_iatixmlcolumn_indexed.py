@@ -0,0 +1,16 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("iatistore", "0017_iatiactivities_content_hash"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="iatixmlcolumn",
+            name="indexed",
+            field=models.BooleanField(default=False),
+        ),
+    ]
@@ -0,0 +1,23 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("iatistore", "0018_iatixmlcolumn_indexed"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="iatiactivities",
+            name="reporting_org_ref",
+            field=models.TextField(blank=True, db_index=True, null=True),
+        ),
+        migrations.RunSQL(
+            """
+            UPDATE iatistore_iatiactivities
+            SET reporting_org_ref = (xpath('/iati-activity/reporting-org/@ref', content))[1]::text
+            """,
+            migrations.RunSQL.noop,
+        ),
+    ]
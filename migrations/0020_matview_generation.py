@@ -0,0 +1,15 @@
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("iatistore", "0019_iatiactivities_reporting_org_ref"),
+    ]
+
+    operations = [
+        migrations.RunSQL(
+            "CREATE SEQUENCE IF NOT EXISTS iatistore_matview_generation",
+            "DROP SEQUENCE IF EXISTS iatistore_matview_generation",
+        ),
+    ]
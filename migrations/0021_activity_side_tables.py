@@ -0,0 +1,158 @@
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("iatistore", "0020_matview_generation"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="IatiActivityHeader",
+            fields=[
+                (
+                    "activity",
+                    models.OneToOneField(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        primary_key=True,
+                        related_name="header",
+                        serialize=False,
+                        to="iatistore.IatiActivities",
+                    ),
+                ),
+                ("iati_identifier", models.TextField(db_index=True)),
+                ("iati_version", models.DecimalField(decimal_places=2, max_digits=3)),
+                (
+                    "content_hash",
+                    models.CharField(blank=True, max_length=64, null=True),
+                ),
+                ("default_currency", models.TextField(blank=True, null=True)),
+                ("default_lang", models.TextField(blank=True, null=True)),
+                ("hierarchy", models.IntegerField(blank=True, null=True)),
+                (
+                    "last_updated_datetime",
+                    models.DateTimeField(blank=True, null=True),
+                ),
+                (
+                    "reporting_org_ref",
+                    models.TextField(blank=True, db_index=True, null=True),
+                ),
+                ("reporting_org_type", models.TextField(blank=True, null=True)),
+                ("title", models.TextField(blank=True, null=True)),
+                ("activity_status_code", models.TextField(blank=True, null=True)),
+                ("start_planned", models.DateField(blank=True, null=True)),
+                ("start_actual", models.DateField(blank=True, null=True)),
+                ("end_planned", models.DateField(blank=True, null=True)),
+                ("end_actual", models.DateField(blank=True, null=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name="IatiActivityTransaction",
+            fields=[
+                (
+                    "id",
+                    models.AutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("iati_identifier", models.TextField(db_index=True)),
+                ("ordinality", models.IntegerField()),
+                ("ref", models.TextField(blank=True, null=True)),
+                ("transaction_type_code", models.TextField(blank=True, null=True)),
+                ("transaction_date", models.DateField(blank=True, null=True)),
+                (
+                    "value",
+                    models.DecimalField(
+                        blank=True, decimal_places=2, max_digits=20, null=True
+                    ),
+                ),
+                ("value_currency", models.TextField(blank=True, null=True)),
+                ("value_date", models.DateField(blank=True, null=True)),
+                ("provider_org_ref", models.TextField(blank=True, null=True)),
+                ("receiver_org_ref", models.TextField(blank=True, null=True)),
+                (
+                    "activity",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="transactions",
+                        to="iatistore.IatiActivities",
+                    ),
+                ),
+            ],
+            options={
+                "unique_together": {("activity", "ordinality")},
+            },
+        ),
+        migrations.CreateModel(
+            name="IatiActivityParticipatingOrg",
+            fields=[
+                (
+                    "id",
+                    models.AutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("iati_identifier", models.TextField(db_index=True)),
+                ("ordinality", models.IntegerField()),
+                ("ref", models.TextField(blank=True, db_index=True, null=True)),
+                ("type", models.TextField(blank=True, null=True)),
+                ("role", models.TextField(blank=True, null=True)),
+                ("name", models.TextField(blank=True, null=True)),
+                (
+                    "activity",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="participating_orgs",
+                        to="iatistore.IatiActivities",
+                    ),
+                ),
+            ],
+            options={
+                "unique_together": {("activity", "ordinality")},
+            },
+        ),
+        migrations.CreateModel(
+            name="IatiActivityNarrative",
+            fields=[
+                (
+                    "id",
+                    models.AutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("iati_identifier", models.TextField(db_index=True)),
+                ("ordinality", models.IntegerField()),
+                ("element", models.TextField()),
+                ("lang", models.TextField(blank=True, null=True)),
+                ("text", models.TextField(blank=True, null=True)),
+                (
+                    "activity",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="narratives",
+                        to="iatistore.IatiActivities",
+                    ),
+                ),
+            ],
+            options={
+                "unique_together": {("activity", "ordinality")},
+            },
+        ),
+        migrations.AddIndex(
+            model_name="iatiactivitynarrative",
+            index=models.Index(
+                fields=["element", "lang"], name="iatistore_narr_element_lang"
+            ),
+        ),
+    ]
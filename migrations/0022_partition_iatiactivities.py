@@ -0,0 +1,179 @@
+from decimal import Decimal
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+# Names and SQL are written out here rather than imported from
+# iatistore.partitions and iatistore.matviews, which may change later
+TABLE = "iatistore_iatiactivities"
+DEFAULT_PARTITION = f"{TABLE}_default"
+
+# The indexes Django created for "reporting_org_ref" (migration 0019)
+INDEXES = [
+    f'CREATE INDEX "{TABLE}_reporting_org_ref_7ecab302" '
+    f'ON "{TABLE}" (reporting_org_ref)',
+    f'CREATE INDEX "{TABLE}_reporting_org_ref_7ecab302_like" '
+    f'ON "{TABLE}" (reporting_org_ref text_pattern_ops)',
+]
+
+# Views and materialized views reading the table, directly or not,
+# with their definitions and indexes
+DEPENDENTS_SQL = """
+WITH RECURSIVE dependents AS (
+    SELECT dependent.oid, dependent.relname, dependent.relkind, 1 AS depth
+    FROM pg_depend
+    JOIN pg_rewrite ON pg_depend.objid = pg_rewrite.oid
+    JOIN pg_class dependent ON pg_rewrite.ev_class = dependent.oid
+    WHERE pg_depend.classid = 'pg_rewrite'::regclass
+    AND pg_depend.refobjid = to_regclass(%s)
+    AND dependent.oid <> pg_depend.refobjid
+  UNION
+    SELECT dependent.oid, dependent.relname, dependent.relkind, source.depth + 1
+    FROM dependents source
+    JOIN pg_depend ON pg_depend.refobjid = source.oid
+    JOIN pg_rewrite ON pg_depend.objid = pg_rewrite.oid
+    JOIN pg_class dependent ON pg_rewrite.ev_class = dependent.oid
+    WHERE pg_depend.classid = 'pg_rewrite'::regclass
+    AND dependent.oid <> source.oid
+)
+SELECT
+    relname,
+    relkind = 'm',
+    pg_get_viewdef(oid),
+    ARRAY(SELECT indexdef FROM pg_indexes WHERE tablename = relname)
+FROM dependents
+GROUP BY oid, relname, relkind
+ORDER BY max(depth)
+"""
+
+
+def partition_name(version) -> str:
+    version = Decimal(str(version)).quantize(Decimal("0.01"))
+    return f"{TABLE}_v{str(version).replace('.', '')}"
+
+
+def convert(schema_editor, create_table, constraints, versions_sql):
+    """
+    Replace the activities table with a copy created by `create_table`,
+    keeping the (materialized) views which read from it
+    """
+    with schema_editor.connection.cursor() as c:
+        c.execute(DEPENDENTS_SQL, [f'"{TABLE}"'])
+        # Deepest last, so recreated after what they read
+        dependents = c.fetchall()
+        for name, materialized, _, _ in reversed(dependents):
+            kind = "MATERIALIZED VIEW" if materialized else "VIEW"
+            c.execute(f'DROP {kind} IF EXISTS "{name}" CASCADE')
+
+        c.execute(f'ALTER TABLE "{TABLE}" RENAME TO "{TABLE}_old"')
+        c.execute(create_table)
+        c.execute(versions_sql)
+        for (version,) in c.fetchall():
+            c.execute(
+                f'CREATE TABLE "{partition_name(version)}" PARTITION OF "{TABLE}" '
+                "FOR VALUES IN (%s)",
+                [version],
+            )
+        c.execute(f'INSERT INTO "{TABLE}" SELECT * FROM "{TABLE}_old"')
+        c.execute(f'DROP TABLE "{TABLE}_old"')
+        for constraint in constraints:
+            c.execute(constraint)
+        c.execute(f'ANALYZE "{TABLE}"')
+
+        for name, materialized, definition, indexes in dependents:
+            kind = "MATERIALIZED VIEW" if materialized else "VIEW"
+            c.execute(f'CREATE {kind} "{name}" AS {definition}')
+            for index in indexes:
+                c.execute(index)
+
+
+def partition(apps, schema_editor):
+    versions = [str(version) for version in getattr(settings, "IATI_VERSIONS", [])]
+    convert(
+        schema_editor,
+        create_table=f"""
+        CREATE TABLE "{TABLE}" (LIKE "{TABLE}_old" INCLUDING DEFAULTS)
+        PARTITION BY LIST (iati_version);
+        CREATE TABLE "{DEFAULT_PARTITION}" PARTITION OF "{TABLE}" DEFAULT
+        """,
+        constraints=[
+            f'ALTER TABLE "{TABLE}" ADD CONSTRAINT "{TABLE}_pkey" '
+            "PRIMARY KEY (id, iati_version)",
+        ]
+        + INDEXES,
+        versions_sql=(
+            f'SELECT DISTINCT iati_version FROM "{TABLE}_old" '
+            f"UNION SELECT unnest('{{{','.join(versions)}}}'::numeric[])"
+        ),
+    )
+
+
+def unpartition(apps, schema_editor):
+    convert(
+        schema_editor,
+        create_table=(
+            f'CREATE TABLE "{TABLE}" (LIKE "{TABLE}_old" INCLUDING DEFAULTS); '
+            # An activity may only be in one version once unpartitioned
+            f'DELETE FROM "{TABLE}_old" old USING "{TABLE}_old" newer '
+            "WHERE old.id = newer.id AND old.iati_version < newer.iati_version"
+        ),
+        constraints=[
+            f'ALTER TABLE "{TABLE}" ADD CONSTRAINT "{TABLE}_pkey" PRIMARY KEY (id)',
+        ]
+        + INDEXES,
+        versions_sql="SELECT NULL WHERE false",
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("iatistore", "0021_activity_side_tables"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="iatiactivityheader",
+            name="activity",
+            field=models.OneToOneField(
+                db_constraint=False,
+                on_delete=django.db.models.deletion.CASCADE,
+                primary_key=True,
+                related_name="header",
+                serialize=False,
+                to="iatistore.IatiActivities",
+            ),
+        ),
+        migrations.AlterField(
+            model_name="iatiactivitytransaction",
+            name="activity",
+            field=models.ForeignKey(
+                db_constraint=False,
+                on_delete=django.db.models.deletion.CASCADE,
+                related_name="transactions",
+                to="iatistore.IatiActivities",
+            ),
+        ),
+        migrations.AlterField(
+            model_name="iatiactivityparticipatingorg",
+            name="activity",
+            field=models.ForeignKey(
+                db_constraint=False,
+                on_delete=django.db.models.deletion.CASCADE,
+                related_name="participating_orgs",
+                to="iatistore.IatiActivities",
+            ),
+        ),
+        migrations.AlterField(
+            model_name="iatiactivitynarrative",
+            name="activity",
+            field=models.ForeignKey(
+                db_constraint=False,
+                on_delete=django.db.models.deletion.CASCADE,
+                related_name="narratives",
+                to="iatistore.IatiActivities",
+            ),
+        ),
+        migrations.RunPython(partition, unpartition),
+    ]
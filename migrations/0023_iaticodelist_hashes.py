@@ -0,0 +1,21 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("iatistore", "0022_partition_iatiactivities"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="iaticodelist",
+            name="content_hash",
+            field=models.CharField(blank=True, max_length=64, null=True),
+        ),
+        migrations.AddField(
+            model_name="iaticodelist",
+            name="shredded_hash",
+            field=models.CharField(blank=True, max_length=64, null=True),
+        ),
+    ]
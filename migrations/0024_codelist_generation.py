@@ -0,0 +1,15 @@
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("iatistore", "0023_iaticodelist_hashes"),
+    ]
+
+    operations = [
+        migrations.RunSQL(
+            "CREATE SEQUENCE IF NOT EXISTS iatistore_codelist_generation",
+            "DROP SEQUENCE IF EXISTS iatistore_codelist_generation",
+        ),
+    ]
@@ -0,0 +1,16 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("iatistore", "0024_codelist_generation"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="iatixmltable",
+            name="enrich_codelists",
+            field=models.BooleanField(default=False),
+        ),
+    ]
@@ -0,0 +1,40 @@
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("iatistore", "0025_iatixmltable_enrich_codelists"),
+    ]
+
+    operations = [
+        migrations.RunSQL(
+            """
+            CREATE OR REPLACE FUNCTION iatistore_ts_config("lang" TEXT)
+            RETURNS regconfig AS $$
+              -- The text search configuration for a narrative's xml:lang,
+              -- ignoring any region ("en-GB") and case
+              SELECT CASE lower(split_part(replace("lang", '_', '-'), '-', 1))
+                WHEN 'da' THEN 'danish'
+                WHEN 'de' THEN 'german'
+                WHEN 'en' THEN 'english'
+                WHEN 'es' THEN 'spanish'
+                WHEN 'fi' THEN 'finnish'
+                WHEN 'fr' THEN 'french'
+                WHEN 'hu' THEN 'hungarian'
+                WHEN 'it' THEN 'italian'
+                WHEN 'nl' THEN 'dutch'
+                WHEN 'no' THEN 'norwegian'
+                WHEN 'nb' THEN 'norwegian'
+                WHEN 'pt' THEN 'portuguese'
+                WHEN 'ro' THEN 'romanian'
+                WHEN 'ru' THEN 'russian'
+                WHEN 'sv' THEN 'swedish'
+                WHEN 'tr' THEN 'turkish'
+                ELSE 'simple'
+              END::regconfig;
+            $$ LANGUAGE SQL IMMUTABLE;
+            """,
+            'DROP FUNCTION IF EXISTS iatistore_ts_config("lang" TEXT)',
+        ),
+    ]
@@ -0,0 +1,20 @@
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("iatistore", "0026_ts_config"),
+    ]
+
+    operations = [
+        migrations.RunSQL(
+            """
+            CREATE INDEX IF NOT EXISTS "iatistore_narr_search_gin"
+            ON iatistore_iatiactivitynarrative USING gin (
+                to_tsvector(iatistore_ts_config("lang"), COALESCE("text", ''))
+            )
+            """,
+            'DROP INDEX IF EXISTS "iatistore_narr_search_gin"',
+        ),
+    ]
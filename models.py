@@ -1,12 +1,18 @@
 # Create your models here.
+import hashlib
 import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
 
-from django.db import models, connection
+from django.db import models, connection, transaction
 from django.db.utils import ProgrammingError
+from django.utils import timezone
 from django.utils.text import slugify
 
 from importlib import resources
-from iatistore import iatisql
+from iatistore import generations, iatisql, matviews, shredder, standard
+from iatistore.ingest import CopyStream, activity_fields, activity_id, copy_lines
 from cachedrequests.requesters import (
     DataStoreRequest,
     etree,
@@ -17,8 +23,7 @@ from requests.exceptions import HTTPError
 from xmltables.models import XmlColumn, XmlField, XmlTable
 from django.contrib.postgres.aggregates import ArrayAgg
 from django.db.models import JSONField
-from typing import List
-from collections import defaultdict
+from typing import Dict, Iterable, List, NamedTuple, Sequence, Tuple
 from decimal import Decimal
 from django.conf import settings
 
@@ -27,11 +32,96 @@ iati_version = getattr(settings, "DEFAULT_IATI_VERSION")
 
 logger = logging.getLogger(__name__)
 
+
+def sql_statements(script: str) -> List[str]:
+    """
+    The statements of an "iatisql" script, each of which
+    ends with a semicolon at the end of a line
+    """
+    return [
+        statement.strip()
+        for statement in script.split(";\n")
+        if statement.strip()
+        and not all(
+            line.strip().startswith("--") or not line.strip()
+            for line in statement.splitlines()
+        )
+    ]
+
+
+def batched(iterable: Iterable, size: int):
+    """
+    Yield lists of up to `size` items from `iterable`
+    """
+    iterator = iter(iterable)
+    while True:
+        batch = list(islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
+
+def unique_rows(rows: Iterable[dict]) -> Tuple[List[dict], List[dict]]:
+    """
+    The last of the activity rows with each primary key, in order, and
+    the rows left out. Distinct identifiers can slugify to the same key.
+    """
+    unique, duplicates = {}, []
+    for row in rows:
+        if row["id"] in unique:
+            duplicates.append(unique[row["id"]])
+        unique[row["id"]] = row
+    for row in duplicates:
+        logger.warning(
+            f"Skipping {row['iati_identifier']}: a later activity "
+            f"in the batch has the same id {row['id']}"
+        )
+    return list(unique.values()), duplicates
+
+
+class BatchReport(NamedTuple):
+    """
+    Outcome of writing one batch of activities
+    """
+
+    batch: int
+    written: int
+    failed: int
+    seconds: float
+    # Activities left out for sharing their primary key with a later one
+    skipped: int = 0
+
+    @property
+    def rate(self) -> float:
+        return self.written / self.seconds if self.seconds else 0.0
+
+
+class Changeset(NamedTuple):
+    """
+    Primary keys of activities by what an incremental fetch did with them
+    """
+
+    inserted: List[str]
+    updated: List[str]
+    unchanged: List[str]
+    disappeared: List[str]
+    # New or changed activities which could not be written
+    failed: List[str]
+    # The iati_identifiers of activities left out for sharing their
+    # primary key with a later activity in the same batch
+    skipped: List[str]
+
+    @property
+    def changed(self) -> List[str]:
+        return self.inserted + self.updated
+
+
 narrative_fields = """
 SELECT 
     slugify(iati_identifier) AS "aims_identifier",
     "iati_identifier",
     "ordinality",
+    "narrative_ordinality",
     "xmltable"."text",
     COALESCE("xmltable"."lang", "activity_lang") AS "lang",
     "ref",
@@ -49,6 +139,7 @@ FROM (
         )
     ) parent, xmltable('//narrative' PASSING content
     COLUMNS
+        "narrative_ordinality" FOR ORDINALITY,
         "text" text PATH '.',
         "lang" text path '@xml:lang'
 )
@@ -58,6 +149,10 @@ FROM (
 class IatiActivities(models.Model):
     """
     The main data source for each Activity
+
+    The table is list partitioned by iati_version (see `partitions`),
+    so its primary key is really ("id", "iati_version"). An activity
+    is only kept in the version it was last published in.
     """
 
     id = models.TextField(primary_key=True)
@@ -67,32 +162,406 @@ class IatiActivities(models.Model):
     # Parameters from the parent "iati-activities" file properties
     iati_version = models.DecimalField(max_digits=3, decimal_places=2)
 
+    # The reporting organisation's ref, for filtering
+    reporting_org_ref = models.TextField(null=True, blank=True, db_index=True)
+
+    # Change tracking for incremental fetches
+    content_hash = models.CharField(max_length=64, null=True, blank=True)
+    last_seen = models.DateTimeField(null=True, blank=True)
+
+    activity_fields = staticmethod(activity_fields)
+
     @classmethod
-    def fetch(cls, params=None):
+    def fetch(cls, params=None, batch_size: int = None, scope=None) -> Changeset:
         """
         For Uzbekistan (MIFT-AIMS load)
         IatiActivities.fetch(params = [('recipient-country', 'UZ'),('stream', 'True')])
+
+        Only new activities and those whose content hash differs
+        are written; unchanged activities just have `last_seen` bumped.
+        Activities in `scope` (default: all activities) which were not
+        seen by this fetch are reported as disappeared.
         """
         params = params or {}
-        for a in DataStoreRequest(params).activities():
-            iati_identifier = a.find("iati-identifier").text.strip()
-            content = etree.tostring(a)
-            defaults = dict(
-                id=slugify(iati_identifier),
-                content=etree.tostring(a).decode(),
-                iati_version=a.attrib["{http://datastore.iatistandard.org/ns}version"],
+        batch_size = batch_size or getattr(settings, "IATISTORE_BATCH_SIZE", 500)
+        started = timezone.now()
+        changes = Changeset(
+            inserted=[], updated=[], unchanged=[], disappeared=[], failed=[], skipped=[]
+        )
+
+        activities = DataStoreRequest(params).activities()
+        for batch in batched(activities, batch_size):
+            rows = []
+            for a in batch:
+                try:
+                    rows.append(cls.activity_fields(a))
+                except Exception as e:
+                    logger.error(e)
+                    # Still published, so it has not disappeared
+                    failed = activity_id(a)
+                    if failed:
+                        changes.failed.append(failed)
+
+            cls.write_changes(rows, started, changes)
+
+        scope = cls.objects.all() if scope is None else scope
+        unseen = scope.filter(
+            models.Q(last_seen__lt=started) | models.Q(last_seen__isnull=True)
+        )
+        # Seen, but not written
+        unseen = unseen.exclude(pk__in=changes.failed)
+        changes.disappeared.extend(unseen.values_list("pk", flat=True))
+        logger.info(
+            f"{len(changes.inserted)} inserted, {len(changes.updated)} updated, "
+            f"{len(changes.unchanged)} unchanged, "
+            f"{len(changes.disappeared)} disappeared, {len(changes.failed)} failed, "
+            f"{len(changes.skipped)} skipped"
+        )
+        return changes
+
+    @classmethod
+    def write_changes(cls, rows: List[dict], seen_at, changes: Changeset) -> int:
+        """
+        Write the new and modified activities among `rows` (activity
+        field values) and record what happened to each of them in
+        `changes`, going by the rows which were actually written.
+        Returns the number of activities written.
+        """
+        rows, duplicates = unique_rows(rows)
+        changes.skipped.extend(row["iati_identifier"] for row in duplicates)
+        known = dict(
+            cls.objects.filter(pk__in=[row["id"] for row in rows]).values_list(
+                "pk", "content_hash"
             )
-            try:
-                instance, created = cls.objects.update_or_create(
-                    iati_identifier=iati_identifier, defaults=defaults
+        )
+        changed, unchanged = [], []
+        for row in rows:
+            row["last_seen"] = seen_at
+            if row["id"] in known and known[row["id"]] == row["content_hash"]:
+                unchanged.append(row["id"])
+            else:
+                changed.append(row)
+
+        if unchanged:
+            cls.objects.filter(pk__in=unchanged).update(last_seen=seen_at)
+        changes.unchanged.extend(unchanged)
+
+        written = {row["id"] for row in cls.upsert(changed)} if changed else set()
+        for row in changed:
+            if row["id"] not in written:
+                changes.failed.append(row["id"])
+            elif row["id"] in known:
+                changes.updated.append(row["id"])
+            else:
+                changes.inserted.append(row["id"])
+        return len(written)
+
+    @classmethod
+    def upsert(cls, rows: List[dict]) -> List[dict]:
+        """
+        Insert or update activity rows in a single statement.
+        If the statement fails, rows are retried one at a time
+        so that a bad row does not lose the rest of the batch.
+        Returns the rows written.
+        """
+        # "ON CONFLICT DO UPDATE" may not touch the same row twice
+        rows, _ = unique_rows(rows)
+        unique_fields = ["id", "iati_version"]
+        update_fields = [f for f in rows[0] if f not in unique_fields] if rows else []
+        try:
+            with transaction.atomic():
+                cls.remove_other_versions(rows)
+                cls.objects.bulk_create(
+                    [cls(**row) for row in rows],
+                    update_conflicts=True,
+                    unique_fields=unique_fields,
+                    update_fields=update_fields,
                 )
+        except Exception as e:
+            logger.error(f"Batch write failed, retrying row by row: {e}")
+        else:
+            cls.shred(rows)
+            return rows
+
+        written = []
+        for row in rows:
+            try:
+                with transaction.atomic():
+                    cls.remove_other_versions([row])
+                    cls.objects.bulk_create(
+                        [cls(**row)],
+                        update_conflicts=True,
+                        unique_fields=unique_fields,
+                        update_fields=update_fields,
+                    )
+                written.append(row)
             except Exception as e:
-                logger.error(e)
+                logger.error(f"Unable to write {row['iati_identifier']}: {e}")
+        cls.shred(written)
+        return written
+
+    @classmethod
+    def remove_other_versions(cls, rows: List[dict]):
+        """
+        Delete the rows for activities among `rows` which are stored
+        under a different iati_version, in another partition
+        """
+        with connection.cursor() as c:
+            c.execute(
+                f"""
+                DELETE FROM {cls._meta.db_table} stored
+                USING unnest(%s::text[], %s::numeric[]) AS incoming(id, iati_version)
+                WHERE stored.id = incoming.id
+                AND stored.iati_version <> incoming.iati_version
+                """,
+                [[row["id"] for row in rows], [row["iati_version"] for row in rows]],
+            )
+
+    @classmethod
+    def shred(cls, rows: List[dict]):
+        """
+        Parse the activities just written into the side tables
+        when settings.IATISTORE_SHRED_ON_INGEST is set
+        """
+        if rows and shredder.shred_on_ingest():
+            shredder.shred_rows(rows)
+
+    @classmethod
+    def fetch_bulk(cls, params=None, batch_size: int = None) -> List[BatchReport]:
+        """
+        Like `fetch` but writes activities in batches of `batch_size`
+        (default: settings.IATISTORE_BATCH_SIZE), upserting on the
+        slugified iati_identifier
+        IatiActivities.fetch_bulk(params = [('recipient-country', 'UZ'),('stream', 'True')])
+        """
+        params = params or {}
+        batch_size = batch_size or getattr(settings, "IATISTORE_BATCH_SIZE", 500)
+        reports = []
+        now = timezone.now()
+        activities = DataStoreRequest(params).activities()
+        for number, batch in enumerate(batched(activities, batch_size), start=1):
+            start = time.monotonic()
+            rows = []
+            for a in batch:
+                try:
+                    rows.append(dict(cls.activity_fields(a), last_seen=now))
+                except Exception as e:
+                    logger.error(e)
+            rows, duplicates = unique_rows(rows)
+            written = len(cls.upsert(rows)) if rows else 0
+            report = BatchReport(
+                batch=number,
+                written=written,
+                # Rows which could not be parsed or written
+                failed=len(batch) - len(duplicates) - written,
+                seconds=time.monotonic() - start,
+                skipped=len(duplicates),
+            )
+            logger.info(
+                f"Batch {report.batch}: {report.written} written, "
+                f"{report.skipped} skipped, "
+                f"{report.failed} failed in {report.seconds:.2f}s "
+                f"({report.rate:.0f} activities/s)"
+            )
+            reports.append(report)
+        return reports
+
+    @classmethod
+    def fetch_copy(cls, params=None) -> int:
+        """
+        Stream activities into a staging table with "COPY FROM STDIN"
+        then merge them into this table in one statement.
+        Memory use does not grow with the number of activities.
+        IatiActivities.fetch_copy(params = [('recipient-country', 'UZ'),('stream', 'True')])
+        """
+        return cls.copy_activities(DataStoreRequest(params or {}).activities())
+
+    @classmethod
+    def copy_activities(cls, activities: Iterable) -> int:
+        """
+        Load "iati-activity" elements from any source as `fetch_copy` does
+        """
+        columns = (
+            "id",
+            "iati_identifier",
+            "content",
+            "iati_version",
+            "content_hash",
+            "reporting_org_ref",
+        )
+        loaded = 0
+
+        def rows():
+            nonlocal loaded
+            for a in activities:
+                try:
+                    fields = cls.activity_fields(a)
+                except Exception as e:
+                    logger.error(e)
+                    continue
+                loaded += 1
+                yield [fields[column] for column in columns]
+
+        copy_sql = (
+            f"COPY iatistore_iatiactivities_staging ({', '.join(columns)}) FROM STDIN"
+        )
+        start = time.monotonic()
+        with transaction.atomic(), connection.cursor() as c:
+            c.execute(
+                """
+                CREATE TEMP TABLE iatistore_iatiactivities_staging (
+                    seq bigint GENERATED ALWAYS AS IDENTITY,
+                    id text,
+                    iati_identifier text,
+                    content text,
+                    iati_version numeric(3, 2),
+                    content_hash varchar(64),
+                    reporting_org_ref text
+                ) ON COMMIT DROP
+                """
+            )
+            stream = CopyStream(copy_lines(rows()))
+            if hasattr(c.cursor, "copy_expert"):
+                # psycopg2
+                c.cursor.copy_expert(copy_sql, stream)
+            else:
+                # psycopg 3
+                with c.cursor.copy(copy_sql) as copy:
+                    while data := stream.read(65536):
+                        copy.write(data)
+            # Run one at a time, so that rowcount is the INSERT's
+            # whatever the driver reports for a multi-statement execute
+            merge = resources.read_text(iatisql, "activities_merge_staging.sql")
+            for statement in sql_statements(merge):
+                c.execute(statement)
+            merged = c.rowcount
+        if shredder.shred_on_ingest():
+            shredder.shred_pending()
+        seconds = time.monotonic() - start
+        logger.info(
+            f"Loaded {loaded} activities, merged {merged} in {seconds:.2f}s "
+            f"({loaded / seconds if seconds else 0:.0f} activities/s)"
+        )
+        return merged
+
+    def __str__(self):
+        return f"{self.iati_identifier}"
+
+
+class IatiActivityHeader(models.Model):
+    """
+    Activity level fields, parsed from the content of
+    an IatiActivities row by `shredder`
+    """
+
+    activity = models.OneToOneField(
+        IatiActivities,
+        primary_key=True,
+        on_delete=models.CASCADE,
+        related_name="header",
+        db_constraint=False,
+    )
+    iati_identifier = models.TextField(db_index=True)
+    iati_version = models.DecimalField(max_digits=3, decimal_places=2)
+    # The IatiActivities content hash this was parsed from
+    content_hash = models.CharField(max_length=64, null=True, blank=True)
+
+    default_currency = models.TextField(null=True, blank=True)
+    default_lang = models.TextField(null=True, blank=True)
+    hierarchy = models.IntegerField(null=True, blank=True)
+    last_updated_datetime = models.DateTimeField(null=True, blank=True)
+    reporting_org_ref = models.TextField(null=True, blank=True, db_index=True)
+    reporting_org_type = models.TextField(null=True, blank=True)
+    title = models.TextField(null=True, blank=True)
+    activity_status_code = models.TextField(null=True, blank=True)
+    start_planned = models.DateField(null=True, blank=True)
+    start_actual = models.DateField(null=True, blank=True)
+    end_planned = models.DateField(null=True, blank=True)
+    end_actual = models.DateField(null=True, blank=True)
 
     def __str__(self):
         return f"{self.iati_identifier}"
 
 
+class IatiActivityTransaction(models.Model):
+    """
+    A "transaction" of an activity, parsed by `shredder`
+    """
+
+    activity = models.ForeignKey(
+        IatiActivities,
+        on_delete=models.CASCADE,
+        related_name="transactions",
+        db_constraint=False,
+    )
+    iati_identifier = models.TextField(db_index=True)
+    ordinality = models.IntegerField()
+
+    ref = models.TextField(null=True, blank=True)
+    transaction_type_code = models.TextField(null=True, blank=True)
+    transaction_date = models.DateField(null=True, blank=True)
+    value = models.DecimalField(max_digits=20, decimal_places=2, null=True, blank=True)
+    value_currency = models.TextField(null=True, blank=True)
+    value_date = models.DateField(null=True, blank=True)
+    provider_org_ref = models.TextField(null=True, blank=True)
+    receiver_org_ref = models.TextField(null=True, blank=True)
+
+    class Meta:
+        unique_together = [["activity", "ordinality"]]
+
+
+class IatiActivityParticipatingOrg(models.Model):
+    """
+    A "participating-org" of an activity, parsed by `shredder`
+    """
+
+    activity = models.ForeignKey(
+        IatiActivities,
+        on_delete=models.CASCADE,
+        related_name="participating_orgs",
+        db_constraint=False,
+    )
+    iati_identifier = models.TextField(db_index=True)
+    ordinality = models.IntegerField()
+
+    ref = models.TextField(null=True, blank=True, db_index=True)
+    type = models.TextField(null=True, blank=True)
+    role = models.TextField(null=True, blank=True)
+    name = models.TextField(null=True, blank=True)
+
+    class Meta:
+        unique_together = [["activity", "ordinality"]]
+
+
+class IatiActivityNarrative(models.Model):
+    """
+    Every "narrative" of an activity, parsed by `shredder`.
+    `element` is the path of the narrative's parent
+    from "iati-activity", such as "transaction/description".
+    Migration 0027 adds a GIN index on the search vector
+    which queries.NarrativeSearch.apply_shredded searches.
+    """
+
+    activity = models.ForeignKey(
+        IatiActivities,
+        on_delete=models.CASCADE,
+        related_name="narratives",
+        db_constraint=False,
+    )
+    iati_identifier = models.TextField(db_index=True)
+    ordinality = models.IntegerField()
+
+    element = models.TextField()
+    lang = models.TextField(null=True, blank=True)
+    text = models.TextField(null=True, blank=True)
+
+    class Meta:
+        unique_together = [["activity", "ordinality"]]
+        indexes = [
+            models.Index(fields=["element", "lang"], name="iatistore_narr_element_lang")
+        ]
+
+
 class IatiCodelistMapping(models.Model):
     content = XmlField(null=True)
     iati_version = models.DecimalField(
@@ -107,6 +576,25 @@ class IatiCodelistMapping(models.Model):
             )
         super().save(*args, **kwargs)
 
+    def codelist_paths(self) -> Dict[str, str]:
+        """
+        Codelist labels by the path, without leading slashes, of the
+        element or attribute they apply to. Mappings with a condition
+        (such as on a vocabulary) are left out.
+        """
+        if not self.content:
+            return {}
+        content = self.content
+        if isinstance(content, str):
+            content = content.encode()
+        root = etree.fromstring(content)
+        paths = {}
+        for mapping in root.iter("mapping"):
+            path, codelist = mapping.findtext("path"), mapping.find("codelist")
+            if path and codelist is not None and mapping.find("condition") is None:
+                paths[path.strip().lstrip("/")] = codelist.get("ref")
+        return paths
+
     @classmethod
     def update_mappings(cls, iati_version: Decimal = 2.03):
         cls.objects.get_or_create(iati_version=iati_version)[0].save()
@@ -223,12 +711,26 @@ class IatiCodelist(models.Model):
     name = JSONField(blank=True, null=True)
     description = JSONField(blank=True, null=True)
 
+    # Digests of the content, as fetched and as last shredded into
+    # names, descriptions and items, so that only changes are processed
+    content_hash = models.CharField(max_length=64, null=True, blank=True)
+    shredded_hash = models.CharField(max_length=64, null=True, blank=True)
+
     def __str__(self):
         return f"{self.label} {self.iati_version}"
 
     class Meta:
         unique_together = [["iati_version", "label"]]
 
+    # Scripts deriving names, descriptions and items from the codelist XML
+    CONTENT_SCRIPTS = (
+        "codelist_name.sql",
+        "codelist_description.sql",
+        "codelist_populate_items.sql",
+        "codelistitem_name.sql",
+        "codelistitem_description.sql",
+    )
+
     @staticmethod
     def _set_names():
         """
@@ -236,9 +738,63 @@ class IatiCodelist(models.Model):
         and runthe functions there to update the name and description fields
         """
 
+        ids = {"ids": list(IatiCodelist.objects.values_list("pk", flat=True))}
         with connection.cursor() as c:
-            c.execute(resources.read_text(iatisql, "codelist_name.sql"))
-            c.execute(resources.read_text(iatisql, "codelist_description.sql"))
+            c.execute(resources.read_text(iatisql, "codelist_name.sql"), ids)
+            c.execute(resources.read_text(iatisql, "codelist_description.sql"), ids)
+
+    @classmethod
+    def update_from_content(cls, ids: List[int] = None) -> List[int]:
+        """
+        Run every script in CONTENT_SCRIPTS in one transaction, so that
+        readers never see names or items half updated, for the codelists
+        `ids` (default: those whose content changed since last run).
+        Returns the ids of the codelists updated.
+        """
+        if ids is None:
+            ids = list(
+                cls.objects.filter(
+                    models.Q(shredded_hash__isnull=True)
+                    | ~models.Q(shredded_hash=models.F("content_hash"))
+                ).values_list("pk", flat=True)
+            )
+        if not ids:
+            return []
+        with transaction.atomic(), connection.cursor() as c:
+            for script in cls.CONTENT_SCRIPTS:
+                start = time.monotonic()
+                c.execute(resources.read_text(iatisql, script), {"ids": ids})
+                logger.info(f"{script} in {time.monotonic() - start:.2f}s")
+            cls.objects.filter(pk__in=ids).update(
+                shredded_hash=models.F("content_hash")
+            )
+        generations.bump(generations.CODELISTS)
+        return ids
+
+    @staticmethod
+    def request_content(iati_version, label: str, embedded: bool) -> dict:
+        """
+        Fetch one codelist, returning its field values,
+        or None if it does not exist for that version
+        """
+        logger.info(f"Fetching codelist {label} for {iati_version}")
+        try:
+            content = CodelistRequest(
+                version=iati_version, codelist_name=label, embedded=embedded
+            ).as_xml()
+        except HTTPError:
+            logger.warn(f"Codelist {label} appears not to exist for {iati_version}")
+            return None
+        assert label == content.attrib.get("name")
+        xml = etree.tostring(content)
+        return dict(
+            iati_version=iati_version,
+            label=label,
+            embedded=embedded,
+            content=xml.decode(),
+            content_hash=hashlib.sha256(xml).hexdigest(),
+            complete=content.attrib.get("complete", None) == "1",
+        )
 
     def save(self, *args, **kwargs):
         if not self.content:
@@ -262,19 +818,48 @@ class IatiCodelist(models.Model):
 
     @classmethod
     def fetch_all(cls):
-        for v in iati_versions:
-            logger.info(f"Fetching codelists for {v}")
-            for label in cls.EMBEDDED_CODELISTS:
-                try:
-                    instance = cls.objects.get(iati_version=v, label=label).save()
-                except cls.DoesNotExist:
-                    cls(iati_version=v, label=label, embedded=True).save()
+        return cls.sync_all()
 
-            for label in cls.NONEMBEDDED_CODELISTS:
-                try:
-                    instance = cls.objects.get(iati_version=v, label=label).save()
-                except cls.DoesNotExist:
-                    cls(iati_version=v, label=label, embedded=False).save()
+    @classmethod
+    def sync_all(cls, workers: int = None) -> int:
+        """
+        Fetch every codelist of every IATI version on `workers`
+        (default: settings.IATISTORE_CODELIST_WORKERS) threads,
+        write them in one statement and then update names,
+        descriptions and items of those whose content changed,
+        refreshing the views which name codes if any did.
+        Returns the number of codelists written.
+        """
+        workers = workers or getattr(settings, "IATISTORE_CODELIST_WORKERS", 8)
+        requests = [
+            (v, label, embedded)
+            for v in iati_versions
+            for embedded, labels in (
+                (True, cls.EMBEDDED_CODELISTS),
+                (False, cls.NONEMBEDDED_CODELISTS),
+            )
+            for label in sorted(labels)
+        ]
+        start = time.monotonic()
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            fetched = pool.map(lambda r: cls.request_content(*r), requests)
+            rows = [row for row in fetched if row is not None]
+        logger.info(
+            f"Fetched {len(rows)} of {len(requests)} codelists "
+            f"in {time.monotonic() - start:.2f}s"
+        )
+
+        cls.objects.bulk_create(
+            [cls(**row) for row in rows],
+            update_conflicts=True,
+            unique_fields=["iati_version", "label"],
+            update_fields=["content", "content_hash", "embedded", "complete"],
+        )
+        changed = cls.update_from_content()
+        logger.info(f"{len(changed)} codelists changed")
+        if changed:
+            IatiXmlTable.refresh_enriched()
+        return len(rows)
 
     def update_items(self):
         pass
@@ -309,12 +894,205 @@ class IatiCodelistItem(models.Model):
         return f"{self.code} {name}"
 
 
-class NarrativeXmlTable(XmlTable):
+def sql_literal(value: str) -> str:
+    return "'" + value.replace("'", "''") + "'"
+
+
+def index_name(relname: str, columns: Sequence[str], suffix: str = "idx") -> str:
+    """
+    A name for an index on `columns` of `relname` which fits
+    PostgreSQL's 63 character limit on identifiers
+    """
+    name = f"{relname}_{'_'.join(columns)}_{suffix}"
+    if len(name) > 63:
+        digest = hashlib.md5(name.encode()).hexdigest()[:8]
+        name = f"{name[:54]}_{digest}"
+    return name
+
+
+class MatviewMixin:
+    """
+    Materialized view handling for an XmlTable with
+    an `iati_version` and a `sql` property
+    """
+
+    # Columns which together identify a row of the view. When set the view
+    # gets a unique index and can be refreshed with "REFRESH ... CONCURRENTLY"
+    unique_columns: Tuple[str, ...] = ()
+
+    @property
+    def indexed_columns(self) -> List[str]:
+        """
+        Columns of the view to give a B-tree index
+        """
+        return ["iati_identifier"]
+
+    @property
+    def table_name(self):
+        return slugify(f"{self.row_expression}{self.iati_version}".replace("-", "_"))
+
+    @property
+    def shadow_name(self):
+        return f"{self.table_name}__new"
+
+    def index_sql(self, relname: str) -> List[Tuple[str, str]]:
+        """
+        The name and "CREATE INDEX" statement of each index
+        on the view, as if it were called `relname`
+        """
+        indexes = []
+        if self.unique_columns:
+            name = index_name(relname, self.unique_columns, "uniq")
+            columns = ", ".join(f'"{column}"' for column in self.unique_columns)
+            indexes.append(
+                (
+                    name,
+                    f'CREATE UNIQUE INDEX IF NOT EXISTS "{name}" '
+                    f'ON "{relname}" ({columns})',
+                )
+            )
+        for column in self.indexed_columns:
+            name = index_name(relname, [column])
+            indexes.append(
+                (
+                    name,
+                    f'CREATE INDEX IF NOT EXISTS "{name}" ON "{relname}" ("{column}")',
+                )
+            )
+        return indexes
+
+    def matview_index(self, relname: str = None):
+        """
+        Create any of the view's indexes which are missing
+        """
+        relname = relname or self.table_name
+        with connection.cursor() as c:
+            for name, statement in self.index_sql(relname):
+                try:
+                    c.execute(statement)
+                except Exception as e:
+                    logger.warning(f"Unable to create index {name}: {e}")
+
+    def matview_create(self, relname: str = None) -> bool:
+        """
+        Create the materialized view and its indexes, returning
+        whether that succeeded. `relname` overrides the view name.
+        """
+        relname = relname or self.table_name
+        with connection.cursor() as c:
+            try:
+                c.execute(f'CREATE MATERIALIZED VIEW "{relname}" AS {self.sql}')
+            except Exception as e:
+                logger.error(f"""Unable to continue; SQL was {self.sql}""", exc_info=1)
+                return False
+        self.matview_index(relname)
+        generations.bump(generations.MATVIEWS)
+        return True
+
+    def matview_drop(self):
+        """
+        Drop the materialized view, which fails while other views
+        depend on it. `rebuild` replaces it, keeping those views.
+        """
+        with connection.cursor() as c:
+            c.execute(f'DROP MATERIALIZED VIEW IF EXISTS "{self.table_name}"')
+
+    def rebuild(self) -> bool:
+        """
+        Build the view afresh, recreating the views which depend on it
+        """
+        return self.matview_swap()
+
+    def matview_exists(self) -> bool:
+        with connection.cursor() as c:
+            c.execute(
+                "SELECT 1 FROM pg_matviews WHERE matviewname = %s", [self.table_name]
+            )
+            return c.fetchone() is not None
+
+    def matview_is_unique(self) -> bool:
+        """
+        Whether the view has the unique index which
+        "REFRESH ... CONCURRENTLY" requires
+        """
+        with connection.cursor() as c:
+            c.execute(
+                """
+                SELECT 1 FROM pg_index
+                JOIN pg_class ON pg_index.indrelid = pg_class.oid
+                WHERE pg_class.relname = %s
+                AND pg_index.indisunique
+                AND pg_index.indpred IS NULL
+                """,
+                [self.table_name],
+            )
+            return c.fetchone() is not None
+
+    def matview_refresh(self) -> bool:
+        """
+        Refresh the view without readers ever finding it missing:
+        with "REFRESH ... CONCURRENTLY" where the view has a unique
+        index, otherwise by building a shadow copy and swapping it in
+        """
+        if not self.matview_exists():
+            return self.matview_create()
+        if self.matview_is_unique():
+            with connection.cursor() as c:
+                c.execute(f'REFRESH MATERIALIZED VIEW CONCURRENTLY "{self.table_name}"')
+            generations.bump(generations.MATVIEWS)
+            return True
+        return self.matview_swap()
+
+    def matview_build_shadow(self) -> bool:
+        """
+        Build the view under its shadow name, leaving the current view be
+        """
+        self.matview_drop_shadow()
+        return self.matview_create(self.shadow_name)
+
+    def matview_drop_shadow(self):
+        with connection.cursor() as c:
+            c.execute(f'DROP MATERIALIZED VIEW IF EXISTS "{self.shadow_name}"')
+
+    def matview_replace(self):
+        """
+        Replace the current view, if any, with the shadow view, renaming its
+        indexes. Views depending on the current view must be dropped first.
+        """
+        with connection.cursor() as c:
+            c.execute(f'DROP MATERIALIZED VIEW IF EXISTS "{self.table_name}"')
+            c.execute(
+                f'ALTER MATERIALIZED VIEW "{self.shadow_name}" '
+                f'RENAME TO "{self.table_name}"'
+            )
+            renames = zip(
+                self.index_sql(self.shadow_name), self.index_sql(self.table_name)
+            )
+            for (shadow_index, _), (index, _) in renames:
+                c.execute(f'ALTER INDEX IF EXISTS "{shadow_index}" RENAME TO "{index}"')
+
+    def matview_swap(self) -> bool:
+        """
+        Build the view under its shadow name, then replace the current
+        view with it, renaming its indexes and recreating dependent
+        views, in a single transaction
+        """
+        if not self.matview_build_shadow():
+            return False
+        if not matviews.swap_in([self]):
+            return False
+        generations.bump(generations.MATVIEWS)
+        return True
+
+
+class NarrativeXmlTable(MatviewMixin, XmlTable):
     iati_version = models.DecimalField(
         max_digits=3, decimal_places=2, default=iati_version
     )
     narrative_type = models.CharField(max_length=512)
 
+    unique_columns = ("iati_identifier", "ordinality", "narrative_ordinality")
+
     @property
     def default_language_field(self):
         if "iati-activity" not in self.row_expression:
@@ -333,32 +1111,216 @@ class NarrativeXmlTable(XmlTable):
             default_language_field=self.default_language_field,
         )
         s += f" WHERE iati_version = {self.iati_version}"
-        return s
+        # A search vector per narrative, stemmed for its language
+        return f"""
+SELECT
+    narratives.*,
+    to_tsvector(iatistore_ts_config("lang"), COALESCE("text", '')) AS "search"
+FROM ({s}) narratives
+"""
 
-    def materialize(self):
-        from django.db import connection
+    def index_sql(self, relname: str) -> List[Tuple[str, str]]:
+        return super().index_sql(relname) + [search_index_sql(relname)]
 
-        name = slugify(f"{self.row_expression}{self.iati_version}".replace("-", "_"))
-        with connection.cursor() as c:
-            c.execute(f'DROP MATERIALIZED VIEW IF EXISTS "{name}" CASCADE')
-            try:
-                c.execute(f'CREATE MATERIALIZED VIEW "{name}" AS {self.sql}')
-            except Exception as e:
-                logger.error(f"""Unable to continue; SQL was {self.sql}""", exc_info=1)
-                # continue
+    def materialize(self) -> bool:
+        return self.rebuild()
 
 
-class IatiXmlTable(XmlTable):
-    iati_version = models.DecimalField(
-        max_digits=3, decimal_places=2, default=iati_version
+def search_index_sql(relname: str) -> Tuple[str, str]:
+    """
+    The name and statement of a GIN index on
+    the "search" vector of a narrative view
+    """
+    name = index_name(relname, ["search"], "gin")
+    return (
+        name,
+        f'CREATE INDEX IF NOT EXISTS "{name}" ON "{relname}" USING gin ("search")',
     )
 
+
+class CombinedNarratives(MatviewMixin):
+    """
+    The narratives of every NarrativeXmlTable of one IATI version in one
+    materialized view, tagged with their narrative_type. Each activity is
+    parsed once, whatever the number of narrative paths: every narrative
+    is read along with the names of its ancestors, and matched to the
+    row expressions of the NarrativeXmlTables.
+
+    A row expression ending in "/narrative" matches the narratives
+    directly below that path; any other matches the narratives
+    anywhere below it. A narrative matched by several tables has a row
+    for each, told apart by "narrative_table_id".
+    """
+
+    unique_columns = (
+        "iati_identifier",
+        "narrative_table_id",
+        "narrative_ordinality",
+    )
+
+    def __init__(self, iati_version):
+        self.iati_version = iati_version
+
+    def __str__(self):
+        return f"narratives v{self.iati_version}"
+
     @property
     def table_name(self):
-        return slugify(f"{self.row_expression}{self.iati_version}".replace("-", "_"))
+        return slugify(f"narratives_{self.iati_version}")
+
+    def narrative_tables(self):
+        return NarrativeXmlTable.objects.filter(iati_version=self.iati_version)
+
+    @staticmethod
+    def narrative_path(table) -> Tuple[str, bool]:
+        """
+        The parent path of the narratives of a NarrativeXmlTable,
+        and whether only narratives directly below it match
+        """
+        path = table.row_expression.rstrip("/")
+        exact = path.endswith("/narrative")
+        if exact:
+            path = path[: -len("/narrative")]
+        return path, exact
+
+    def narrative_paths(self) -> List[Tuple[str, str, bool]]:
+        """
+        The parent path, narrative type and whether only
+        narratives directly below it match, for each NarrativeXmlTable
+        """
+        paths = []
+        for table in self.narrative_tables():
+            path, exact = self.narrative_path(table)
+            paths.append((path, table.narrative_type, exact))
+        return paths
 
     @property
     def sql(self):
+        tables = [
+            (table, *self.narrative_path(table)) for table in self.narrative_tables()
+        ]
+        types = ", ".join(
+            f"({table.pk}, {sql_literal(path)}, {path.count('/')}, "
+            f"{sql_literal(table.narrative_type)}, {exact})"
+            for table, path, exact in tables
+        )
+        types = f"VALUES {types}" if types else "SELECT 0, '', 0, '', false WHERE false"
+        # Ancestors are read from the activity down, as deep as the deepest
+        # path. Narratives below that are matched on the start of their path.
+        depth = max([path.count("/") for _, path, _ in tables], default=1)
+        ancestors = ",\n        ".join(
+            f"\"a{n}\" text PATH 'name(ancestor::*[last() - {n - 1}])'"
+            for n in range(1, depth + 1)
+        )
+        path = ", ".join(f"NULLIF(\"a{n}\", '')" for n in range(1, depth + 1))
+        return f"""
+SELECT
+    slugify(narratives.iati_identifier) AS "aims_identifier",
+    narratives.iati_identifier,
+    types.narrative_table_id,
+    types.narrative_type,
+    ROW_NUMBER() OVER (
+        PARTITION BY narratives.iati_identifier, types.narrative_table_id
+        ORDER BY narratives.narrative_ordinality
+    ) AS "ordinality",
+    narratives.narrative_ordinality,
+    narratives.text,
+    narratives.lang,
+    narratives.ref,
+    narratives.type,
+    to_tsvector(
+        iatistore_ts_config(narratives.lang), COALESCE(narratives.text, '')
+    ) AS "search"
+FROM (
+    SELECT
+        TRIM(iati_identifier) AS iati_identifier,
+        xmltable.narrative_ordinality,
+        xmltable.text,
+        COALESCE(xmltable.lang, xmltable.activity_lang) AS lang,
+        xmltable.ref,
+        xmltable.type,
+        xmltable.depth,
+        concat_ws('/', '', {path}) AS parent_path
+    FROM {IatiActivities._meta.db_table},
+    xmltable('/iati-activity//narrative' PASSING content
+    COLUMNS
+        "narrative_ordinality" FOR ORDINALITY,
+        "text" text PATH '.',
+        "lang" text PATH '@xml:lang',
+        "activity_lang" text PATH 'ancestor::iati-activity[1]/@xml:lang',
+        "ref" text PATH '../@ref',
+        "type" text PATH '../@type',
+        "depth" integer PATH 'count(ancestor::*)',
+        {ancestors}
+    )
+    WHERE iati_version = {self.iati_version}
+) narratives
+JOIN ({types}) types(narrative_table_id, path, depth, narrative_type, exact)
+ON (
+    types.exact
+    AND narratives.depth = types.depth
+    AND narratives.parent_path = types.path
+) OR (
+    NOT types.exact
+    AND (
+        narratives.parent_path = types.path
+        OR narratives.parent_path LIKE types.path || '/%'
+    )
+)
+"""
+
+    def index_sql(self, relname: str) -> List[Tuple[str, str]]:
+        return super().index_sql(relname) + [search_index_sql(relname)]
+
+
+def column_path(row_expression: str, column_expression: str) -> str:
+    """
+    The path, without leading slashes, of a column's
+    expression relative to its row expression
+    """
+    expression = column_expression.strip()
+    if expression.startswith("./"):
+        expression = expression[2:]
+    if expression in ("", "."):
+        return row_expression.lstrip("/")
+    return f"{row_expression}/{expression}".lstrip("/")
+
+
+class Provisioned(NamedTuple):
+    """
+    What provisioning changed of one IatiXmlTable
+    """
+
+    row_expression: str
+    created: bool
+    added: List[str]
+    removed: List[str]
+    # None when nothing was saved
+    table: "IatiXmlTable" = None
+
+
+class IatiXmlTable(MatviewMixin, XmlTable):
+    iati_version = models.DecimalField(
+        max_digits=3, decimal_places=2, default=iati_version
+    )
+    # Add a "<column>_name" column, the names of the code in each language,
+    # for columns which the IatiCodelistMapping maps to a codelist
+    enrich_codelists = models.BooleanField(default=False)
+
+    @property
+    def indexed_columns(self) -> List[str]:
+        declared = IatiXmlColumn.objects.filter(
+            xmltable__pk=self.pk, indexed=True
+        ).values_list("col_name", flat=True)
+        return super().indexed_columns + [
+            column for column in declared if column != "iati_identifier"
+        ]
+
+    @property
+    def source_sql(self):
+        """
+        The rows of this table's columns from every activity
+        """
         supersql = super().sql
         table = IatiActivities._meta.db_table
         return f"""
@@ -372,18 +1334,141 @@ FROM
 WHERE {table}.iati_version = {self.iati_version}
 """
 
-    # TODO: Refactor this into a reusable thing
-    def matview_create(self):
-        with connection.cursor() as c:
-            try:
-                c.execute(f'CREATE MATERIALIZED VIEW "{self.table_name}" AS {self.sql}')
-            except Exception as e:
-                logger.error(f"""Unable to continue; SQL was {self.sql}""", exc_info=1)
+    @property
+    def sql(self):
+        sql = self.source_sql
+        columns = self.codelist_labels() if self.enrich_codelists else []
+        if not columns:
+            return sql
+        codelists = IatiCodelist._meta.db_table
+        items = IatiCodelistItem._meta.db_table
+        names = ", ".join(
+            f'"label_{n}"."name" AS "{col_name}_name"'
+            for n, (col_name, _) in enumerate(columns)
+        )
+        # Joined on the codelist's label, so that the view survives
+        # codelists being fetched again; names are null until they are
+        joins = "\n".join(
+            f'LEFT JOIN {codelists} "codelist_{n}" '
+            f'ON "codelist_{n}".iati_version = {self.iati_version} '
+            f'AND "codelist_{n}".label = {sql_literal(label)}\n'
+            f'LEFT JOIN {items} "label_{n}" '
+            f'ON "label_{n}".codelist_id = "codelist_{n}".id '
+            f'AND "label_{n}".code = source."{col_name}"::text'
+            for n, (col_name, label) in enumerate(columns)
+        )
+        return f"SELECT source.*, {names} FROM ({sql}) source\n{joins}"
 
-    def matview_drop(self):
-        name = slugify(f"{self.row_expression}{self.iati_version}".replace("-", "_"))
-        with connection.cursor() as c:
-            c.execute(f'DROP MATERIALIZED VIEW IF EXISTS "{self.table_name}" CASCADE')
+    def codelist_labels(self) -> List[Tuple[str, str]]:
+        """
+        The names of the columns which the codelist mapping for this
+        version maps to a codelist, with that codelist's label
+        """
+        mapping = IatiCodelistMapping.objects.filter(
+            iati_version=self.iati_version
+        ).first()
+        if mapping is None:
+            return []
+        paths = mapping.codelist_paths()
+        columns = []
+        for col_name, expression in self.columns.values_list(
+            "col_name", "column_expression"
+        ):
+            label = paths.get(column_path(self.row_expression, expression))
+            if label:
+                columns.append((col_name, label))
+        return columns
+
+    @classmethod
+    def refresh_enriched(cls, workers: int = None) -> List[matviews.Timing]:
+        """
+        Refresh the views built with `enrich_codelists`, which read the
+        names of codes when refreshed, and the unified tables copying them
+        """
+        tables = [
+            table
+            for table in cls.objects.filter(enrich_codelists=True)
+            if table.matview_exists()
+        ]
+        if not tables:
+            return []
+        workers = workers or getattr(settings, "IATISTORE_MATVIEW_WORKERS", 4)
+        timings = matviews.rebuild(tables, workers=workers, refresh=True)
+        row_expressions = {table.row_expression for table in tables}
+        return timings + matviews.rebuild_unified(
+            table
+            for table in UNIFIED_TABLES.values()
+            if table.row_expression in row_expressions
+        )
+
+    @classmethod
+    def provision(
+        cls, iati_version, prune: bool = False, dry_run: bool = False
+    ) -> List[Provisioned]:
+        """
+        Create or update the tables and columns of `iati_version` to match
+        the activity standard summary table (see `standard`). Only tables
+        whose columns differ are touched, so the returned tables are the
+        ones whose materialized views need rebuilding. Columns which are
+        not in the standard are kept unless `prune` is set.
+        Columns are shared between tables with identical definitions.
+        """
+        definitions = standard.table_definitions(iati_version)
+        existing = {}
+        for table in cls.objects.filter(iati_version=iati_version).order_by("pk"):
+            existing.setdefault(table.row_expression, table)
+        shared = {
+            standard.ColumnDefinition(*values): pk
+            for *values, pk in IatiXmlColumn.objects.values_list(
+                "col_name", "column_expression", "col_xsd_type", "pk"
+            )
+        }
+
+        changes = []
+        with transaction.atomic():
+            for row_expression, columns in definitions.items():
+                table = existing.get(row_expression)
+                current = {}
+                if table is not None:
+                    current = {
+                        standard.ColumnDefinition(*values): pk
+                        for *values, pk in table.columns.values_list(
+                            "col_name", "column_expression", "col_xsd_type", "pk"
+                        )
+                    }
+                wanted = {column.col_name for column in columns}
+                added = [column for column in columns if column not in current]
+                removed = [
+                    column
+                    for column in current
+                    if column not in columns and (prune or column.col_name in wanted)
+                ]
+                if table is not None and not added and not removed:
+                    continue
+                if not dry_run:
+                    if table is None:
+                        table = cls.objects.create(
+                            row_expression=row_expression,
+                            document_expression='"content"',
+                            iati_version=iati_version,
+                        )
+                    for column in added:
+                        if column not in shared:
+                            shared[column] = IatiXmlColumn.objects.create(
+                                **column._asdict()
+                            ).pk
+                    table.columns.remove(*[current[column] for column in removed])
+                    table.columns.add(*[shared[column] for column in added])
+                changes.append(
+                    Provisioned(
+                        row_expression=row_expression,
+                        created=row_expression not in existing,
+                        added=[column.col_name for column in added],
+                        removed=[column.col_name for column in removed],
+                        table=None if dry_run else table,
+                    )
+                )
+        return changes
 
     def execute(self):
         """
@@ -448,4 +1533,170 @@ class IatiXmlColumnManager(models.Manager):
 
 
 class IatiXmlColumn(XmlColumn):
+    # Give this column a B-tree index on the
+    # materialized views of the tables using it
+    indexed = models.BooleanField(default=False)
+
     objects = IatiXmlColumnManager()
+
+
+class UnifiedXmlTable:
+    """
+    A table holding the rows of every IATI version's IatiXmlTable view for
+    one row expression, restricted to the columns common to all of
+    IATI_VERSIONS. It is list-partitioned by iati_version with one partition
+    per version, indexed on iati_identifier, and rebuilt with the views so
+    that endpoints read one pre-unioned relation instead of a runtime UNION.
+    Only matviews.rebuild_unified builds it, never a request.
+    """
+
+    def __init__(
+        self,
+        row_expression: str,
+        columns: Sequence[str] = None,
+        exclude_prefixes: Sequence[str] = (),
+    ):
+        self.row_expression = row_expression
+        self._columns = columns
+        self.exclude_prefixes = exclude_prefixes
+
+    def __str__(self):
+        return f"{self.row_expression} (unified)"
+
+    @property
+    def table_name(self):
+        return slugify(f"{self.row_expression}_unified".replace("-", "_"))
+
+    @property
+    def shadow_name(self):
+        return f"{self.table_name}__new"
+
+    def tables(self):
+        return IatiXmlTable.objects.filter(
+            row_expression=self.row_expression, iati_version__in=iati_versions
+        ).order_by("iati_version")
+
+    @property
+    def columns(self) -> List[str]:
+        if self._columns is None:
+            common = IatiXmlColumn.objects.get_versions_for_column(self.row_expression)
+            for prefix in self.exclude_prefixes:
+                common = common.exclude(col_name__startswith=prefix)
+            self._columns = list(
+                common.filter(versions__contains=list(iati_versions))
+                .values_list("col_name", flat=True)
+                .distinct()
+            )
+        return ["iati_identifier", "iati_version"] + [
+            column
+            for column in self._columns
+            if column not in ("iati_identifier", "iati_version")
+        ]
+
+    def exists(self) -> bool:
+        with connection.cursor() as c:
+            c.execute("SELECT to_regclass(%s) IS NOT NULL", [f'"{self.table_name}"'])
+            return c.fetchone()[0]
+
+    def partition_name(self, relname: str, version) -> str:
+        return f"{relname}_{slugify(str(version))}"
+
+    def rebuild(self) -> bool:
+        """
+        Build the table under its shadow name from the
+        per-version views, then swap it in
+        """
+        tables = [table for table in self.tables() if table.matview_exists()]
+        if not tables:
+            logger.error(f"No materialized views to build {self} from")
+            return False
+        columns = self.columns
+
+        with connection.cursor() as c:
+            views = []
+            for table in tables:
+                c.execute(
+                    """
+                    SELECT attname, format_type(atttypid, atttypmod)
+                    FROM pg_attribute
+                    WHERE attrelid = to_regclass(%s) AND attnum > 0
+                    """,
+                    [f'"{table.table_name}"'],
+                )
+                views.append(dict(c.fetchall()))
+            types = views[0]
+            missing = [column for column in columns if column not in types]
+            if missing:
+                logger.error(f"Unable to build {self}: no columns {missing}")
+                return False
+            # Codelist labels added to the views by IatiXmlTable.enrich_codelists
+            columns = columns + [
+                f"{column}_name"
+                for column in columns
+                if all(f"{column}_name" in view for view in views)
+            ]
+            quoted = ", ".join(f'"{column}"' for column in columns)
+            definition = ", ".join(f'"{column}" {types[column]}' for column in columns)
+
+            c.execute(f'DROP TABLE IF EXISTS "{self.shadow_name}" CASCADE')
+            c.execute(
+                f'CREATE TABLE "{self.shadow_name}" ({definition}) '
+                "PARTITION BY LIST (iati_version)"
+            )
+            for table in tables:
+                partition = self.partition_name(self.shadow_name, table.iati_version)
+                c.execute(
+                    f'CREATE TABLE "{partition}" PARTITION OF "{self.shadow_name}" '
+                    "FOR VALUES IN (%s)",
+                    [table.iati_version],
+                )
+                c.execute(
+                    f'INSERT INTO "{partition}" ({quoted}) '
+                    f'SELECT {quoted} FROM "{table.table_name}"'
+                )
+            name = index_name(self.shadow_name, ["iati_identifier"])
+            c.execute(
+                f'CREATE INDEX "{name}" ON "{self.shadow_name}" (iati_identifier)'
+            )
+            c.execute(f'ANALYZE "{self.shadow_name}"')
+
+        with transaction.atomic(), connection.cursor() as c:
+            dependents = matviews.get_dependents([self.table_name])
+            for dependent in dependents.values():
+                dependent.drop()
+            c.execute(f'DROP TABLE IF EXISTS "{self.table_name}"')
+            c.execute(f'ALTER TABLE "{self.shadow_name}" RENAME TO "{self.table_name}"')
+            c.execute(
+                f'ALTER INDEX "{name}" RENAME TO '
+                f'"{index_name(self.table_name, ["iati_identifier"])}"'
+            )
+            for table in tables:
+                old = self.partition_name(self.shadow_name, table.iati_version)
+                new = self.partition_name(self.table_name, table.iati_version)
+                c.execute(f'ALTER TABLE "{old}" RENAME TO "{new}"')
+            for dependent in matviews.in_dependency_order(dependents):
+                dependent.create()
+        generations.bump(generations.MATVIEWS)
+        return True
+
+
+# The relations read by the aggregate JSON and protobuf endpoints
+UNIFIED_TABLES = {
+    table.row_expression: table
+    for table in [
+        UnifiedXmlTable("/iati-activity", exclude_prefixes=("fss", "crs")),
+        UnifiedXmlTable(
+            "/iati-activity/transaction",
+            columns=[
+                "value",
+                "value_currency",
+                "value_value_date",
+                "transaction_type_code",
+                "ref",
+            ],
+        ),
+        UnifiedXmlTable(
+            "/iati-activity/participating-org", columns=["type", "ref", "role"]
+        ),
+    ]
+}
@@ -0,0 +1,68 @@
+"""
+Managing the list partitions by iati_version of "iatistore_iatiactivities".
+
+Each IATI version has its own partition so that the materialized views,
+which filter on one version, scan only that partition. Activities of any
+version without one land in the default partition until `add_partition`
+moves them to their own.
+"""
+from decimal import Decimal
+
+from django.db import connection, transaction
+
+ACTIVITIES = "iatistore_iatiactivities"
+
+
+def partition_name(version, table: str = ACTIVITIES) -> str:
+    version = Decimal(str(version)).quantize(Decimal("0.01"))
+    return f"{table}_v{str(version).replace('.', '')}"
+
+
+def default_name(table: str = ACTIVITIES) -> str:
+    return f"{table}_default"
+
+
+def partition_versions(table: str = ACTIVITIES) -> list:
+    """
+    The iati_version values which have their own partition of `table`
+    """
+    with connection.cursor() as c:
+        c.execute(
+            """
+            SELECT pg_get_expr(child.relpartbound, child.oid)
+            FROM pg_inherits
+            JOIN pg_class child ON child.oid = pg_inherits.inhrelid
+            WHERE pg_inherits.inhparent = to_regclass(%s)
+            """,
+            [f'"{table}"'],
+        )
+        bounds = [row[0] for row in c.fetchall()]
+    # Bounds read "FOR VALUES IN (2.03)" or "DEFAULT"
+    return sorted(
+        Decimal(bound.split("(", 1)[1].rstrip(")").strip("'"))
+        for bound in bounds
+        if bound.startswith("FOR VALUES IN")
+    )
+
+
+def add_partition(version, table: str = ACTIVITIES) -> bool:
+    """
+    Give `version` its own partition of `table`, moving its rows out of
+    the default partition. Returns False if it already has one.
+    """
+    version = Decimal(str(version))
+    if version in partition_versions(table):
+        return False
+    name, default = partition_name(version, table), default_name(table)
+    with transaction.atomic(), connection.cursor() as c:
+        c.execute(f'CREATE TABLE "{name}" (LIKE "{table}" INCLUDING DEFAULTS)')
+        c.execute(
+            f'WITH moved AS (DELETE FROM "{default}" WHERE iati_version = %s '
+            f'RETURNING *) INSERT INTO "{name}" SELECT * FROM moved',
+            [version],
+        )
+        c.execute(
+            f'ALTER TABLE "{table}" ATTACH PARTITION "{name}" FOR VALUES IN (%s)',
+            [version],
+        )
+    return True
@@ -0,0 +1,333 @@
+"""
+Pipelined ingest of activities from the IATI datastore.
+
+Pages are fetched concurrently on threads, parsed and serialized in a
+process pool and written in batches by a single writer. Bounded queues
+between the stages mean a slow stage holds back the ones before it
+instead of letting work pile up in memory.
+
+Pages are written in page order, whatever order they were fetched and
+parsed in, so a later page's copy of an activity always wins.
+
+The page source is any callable taking a page number and returning the
+raw XML of that page, or an empty value past the last page, so the
+pipeline can be run against a local stub instead of the datastore:
+
+    pages = [open(f, "rb").read() for f in files]
+    ActivityPipeline(lambda n: pages[n] if n < len(pages) else b"").run()
+"""
+import logging
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import count
+from typing import Callable, Iterator, List, Optional, Tuple
+
+from django.conf import settings
+from django.db import models
+from django.utils import timezone
+
+from iatistore.ingest import parse_page
+from iatistore.models import BatchReport, Changeset, IatiActivities
+
+logger = logging.getLogger(__name__)
+
+# Marks the end of the items on a queue
+DONE = object()
+
+
+def datastore_pages(params=None, page_size: int = 1000) -> Callable[[int], bytes]:
+    """
+    A page source reading `page_size` activities at a time
+    from the datastore with "limit" and "offset" parameters
+    """
+    from cachedrequests.requesters import DataStoreRequest
+
+    params = list(params.items()) if isinstance(params, dict) else list(params or [])
+    params = [(key, value) for key, value in params if key != "stream"]
+
+    def fetch_page(number: int) -> bytes:
+        return DataStoreRequest(
+            params + [("limit", page_size), ("offset", number * page_size)]
+        ).content()
+
+    return fetch_page
+
+
+class ActivityPipeline:
+    """
+    Fetch, parse and write activities from `fetch_page` with
+    `fetchers` fetch threads and `parsers` parse processes.
+    At most `window` pages (default: enough to fill every queue)
+    are fetched ahead of the page being written.
+    Activities in `scope` (default: all activities) which were
+    not seen are reported as disappeared.
+    """
+
+    def __init__(
+        self,
+        fetch_page: Callable[[int], bytes],
+        fetchers: int = 4,
+        parsers: Optional[int] = None,
+        batch_size: Optional[int] = None,
+        queue_size: int = 8,
+        retries: int = 2,
+        scope=None,
+        window: Optional[int] = None,
+    ):
+        self.fetch_page = fetch_page
+        self.fetchers = fetchers
+        self.parsers = parsers
+        self.batch_size = batch_size or getattr(settings, "IATISTORE_BATCH_SIZE", 500)
+        self.queue_size = queue_size
+        self.retries = retries
+        self.scope = scope
+        self.window = window or 2 * queue_size + fetchers
+
+        # (page number, content) and (page number, rows, failed ids)
+        self.pages = queue.Queue(maxsize=queue_size)
+        self.parsed = queue.Queue(maxsize=queue_size)
+        # Set at the first empty page, or when the writer stops
+        self.exhausted = threading.Event()
+        self.stopped = threading.Event()
+        self.failed_pages = []
+        # The number of the first empty page
+        self.last_page = None
+        self._numbers = count()
+        self._lock = threading.Lock()
+        # A page number is only handed out when the page
+        # `window` pages before it has been written
+        self._window = threading.Semaphore(self.window)
+
+    def _stopping(self) -> bool:
+        return self.exhausted.is_set() or self.stopped.is_set()
+
+    def _next_number(self) -> Optional[int]:
+        """
+        The next page number to fetch, or None
+        once there are no more pages to hand out
+        """
+        while not self._stopping():
+            if self._window.acquire(timeout=0.1):
+                with self._lock:
+                    if self._stopping():
+                        return None
+                    return next(self._numbers)
+        return None
+
+    def _end_at(self, number: int):
+        """
+        Note that page `number` is empty, so there are no more pages
+        """
+        with self._lock:
+            if self.last_page is None or number < self.last_page:
+                self.last_page = number
+            self.exhausted.set()
+
+    def _fetch(self):
+        """
+        Fetch pages in order of page number until
+        an empty page shows that there are no more
+        """
+        while (number := self._next_number()) is not None:
+            for attempt in range(self.retries + 1):
+                try:
+                    content = self.fetch_page(number)
+                    break
+                except Exception as e:
+                    logger.warning(f"Page {number} attempt {attempt + 1}: {e}")
+            else:
+                logger.error(f"Giving up on page {number}")
+                self.failed_pages.append(number)
+                # The writer waits for every page before the last
+                self.parsed.put((number, [], []))
+                continue
+            if not content:
+                self._end_at(number)
+                return
+            self.pages.put((number, content))
+
+    def _deliver(self, number: int, future):
+        try:
+            found, rows, failed = future.result()
+        except Exception as e:
+            logger.error(f"Unable to parse page {number}: {e}")
+            self.failed_pages.append(number)
+            found, rows, failed = None, [], []
+        if found == 0:
+            self._end_at(number)
+        self.parsed.put((number, rows, failed))
+
+    def _parse(self, pool: ProcessPoolExecutor):
+        """
+        Hand pages to the process pool, keeping at most
+        `queue_size` of them in flight
+        """
+        pending = deque()
+        try:
+            while not self.stopped.is_set():
+                try:
+                    # Still delivering parsed pages while no more arrive,
+                    # as none will once the window is full
+                    page = self.pages.get(timeout=0.1 if pending else None)
+                except queue.Empty:
+                    page = None
+                if page is DONE:
+                    break
+                if page is not None:
+                    number, content = page
+                    pending.append((number, pool.submit(parse_page, content)))
+                while pending and (
+                    len(pending) >= self.queue_size or pending[0][1].done()
+                ):
+                    self._deliver(*pending.popleft())
+            while pending and not self.stopped.is_set():
+                self._deliver(*pending.popleft())
+        finally:
+            self.parsed.put(DONE)
+
+    def _in_page_order(self) -> Iterator[Tuple[List[dict], List[str]]]:
+        """
+        The rows and failed ids of each parsed page up to
+        the first empty page in page order, holding back
+        pages which arrive early
+        """
+        early, expected = {}, 0
+        while True:
+            page = self.parsed.get()
+            if page is DONE:
+                break
+            number, rows, failed = page
+            early[number] = rows, failed
+            while expected in early and (
+                self.last_page is None or expected < self.last_page
+            ):
+                yield early.pop(expected)
+                expected += 1
+                self._window.release()
+        # Anything left is past the first empty page
+
+    def _close_pages(self, fetchers: List[threading.Thread]):
+        for thread in fetchers:
+            thread.join()
+        self.pages.put(DONE)
+
+    def _drain(self, stages: List[threading.Thread]):
+        """
+        Empty the queues until every stage has finished,
+        so that none of them is left blocked on a full queue
+        """
+        while any(thread.is_alive() for thread in stages):
+            for q in (self.pages, self.parsed):
+                try:
+                    while True:
+                        if q.get_nowait() is DONE and q is self.pages:
+                            # The parse stage still needs it, and it comes
+                            # after the last fetcher, so there is room
+                            q.put(DONE)
+                            break
+                except queue.Empty:
+                    pass
+            for thread in stages:
+                thread.join(timeout=0.05)
+
+    def _write(self, rows: List[dict], number: int, seen_at, changes: Changeset):
+        """
+        Write one batch and report on it
+        """
+        start = time.monotonic()
+        failed, skipped = len(changes.failed), len(changes.skipped)
+        written = IatiActivities.write_changes(rows, seen_at, changes)
+        report = BatchReport(
+            batch=number,
+            written=written,
+            failed=len(changes.failed) - failed,
+            seconds=time.monotonic() - start,
+            skipped=len(changes.skipped) - skipped,
+        )
+        logger.info(
+            f"Batch {report.batch}: {len(rows)} activities, {report.written} written, "
+            f"{report.skipped} skipped, "
+            f"{report.failed} failed in {report.seconds:.2f}s "
+            f"({report.rate:.0f} activities/s)"
+        )
+        return report
+
+    def run(self) -> Changeset:
+        """
+        Run every stage to completion, writing from the calling thread
+        """
+        seen_at = timezone.now()
+        changes = Changeset(
+            inserted=[], updated=[], unchanged=[], disappeared=[], failed=[], skipped=[]
+        )
+
+        pool = ProcessPoolExecutor(self.parsers)
+        fetchers = [
+            threading.Thread(target=self._fetch, daemon=True)
+            for _ in range(self.fetchers)
+        ]
+        stages = fetchers + [
+            threading.Thread(target=self._close_pages, args=(fetchers,), daemon=True),
+            threading.Thread(target=self._parse, args=(pool,), daemon=True),
+        ]
+        for thread in stages:
+            thread.start()
+
+        try:
+            rows, number = [], 0
+            for page, failed in self._in_page_order():
+                rows.extend(page)
+                # Still published, so they have not disappeared
+                changes.failed.extend(failed)
+                if len(rows) >= self.batch_size:
+                    number += 1
+                    self._write(rows, number, seen_at, changes)
+                    rows = []
+            if rows:
+                number += 1
+                self._write(rows, number, seen_at, changes)
+        finally:
+            # Stops the stages early if writing failed
+            self.stopped.set()
+            self._drain(stages)
+            pool.shutdown(cancel_futures=True)
+
+        # Pages past the end might be failures of pages which never existed
+        failed_pages = sorted(
+            number
+            for number in self.failed_pages
+            if self.last_page is None or number < self.last_page
+        )
+        if failed_pages:
+            # The activities of those pages were not seen either
+            logger.error(
+                f"Pages not fetched or parsed: {failed_pages}; "
+                "not looking for disappeared activities"
+            )
+        else:
+            scope = IatiActivities.objects.all() if self.scope is None else self.scope
+            changes.disappeared.extend(
+                scope.filter(
+                    models.Q(last_seen__lt=seen_at) | models.Q(last_seen__isnull=True)
+                )
+                .exclude(pk__in=changes.failed)
+                .values_list("pk", flat=True)
+            )
+        logger.info(
+            f"{len(changes.inserted)} inserted, {len(changes.updated)} updated, "
+            f"{len(changes.unchanged)} unchanged, "
+            f"{len(changes.disappeared)} disappeared, {len(changes.failed)} failed, "
+            f"{len(changes.skipped)} skipped"
+        )
+        return changes
+
+
+def fetch_pipelined(params=None, page_size: int = 1000, **options) -> Changeset:
+    """
+    Pipelined equivalent of IatiActivities.fetch
+    fetch_pipelined(params = [('recipient-country', 'UZ')], fetchers=8)
+    """
+    return ActivityPipeline(datastore_pages(params, page_size), **options).run()
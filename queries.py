@@ -0,0 +1,373 @@
+"""
+Filtering and keyset pagination for the JSON API
+"""
+from decimal import Decimal, InvalidOperation
+from typing import List, Optional, Tuple
+
+from django.conf import settings
+from django.core.exceptions import BadRequest
+from django.db import connection
+
+from .models import (
+    IatiActivities,
+    IatiActivityHeader,
+    IatiActivityNarrative,
+    IatiActivityTransaction,
+)
+
+
+class ActivityQuery:
+    """
+    Filters and keyset pagination read from a request's query string.
+
+    `iati_identifier`, `iati_version` and `reporting_org` (the reporting
+    organisation's ref) filter rows. `limit` asks for pages of that many
+    activities, ordered by iati_identifier; `after` continues from the
+    last iati_identifier of the previous page. Each page is a range scan
+    on the iati_identifier indexes of the views however deep it is.
+    """
+
+    def __init__(self, request):
+        self.request = request
+        self.iati_identifier = request.GET.get("iati_identifier")
+        self.iati_version = self._decimal("iati_version")
+        self.reporting_org = request.GET.get("reporting_org")
+        self.after = request.GET.get("after")
+        self.limit = self._limit()
+        # The "after" value for the following page, known once applied
+        self.next: Optional[str] = None
+
+    def _decimal(self, key: str) -> Optional[Decimal]:
+        value = self.request.GET.get(key)
+        if value is None:
+            return None
+        try:
+            return Decimal(value)
+        except InvalidOperation:
+            raise BadRequest(f"{key} must be a number")
+
+    def _limit(self) -> Optional[int]:
+        value = self.request.GET.get("limit")
+        if value is None:
+            return None
+        maximum = getattr(settings, "IATISTORE_PAGE_MAX", 1000)
+        try:
+            limit = int(value)
+        except ValueError:
+            raise BadRequest("limit must be an integer")
+        if not 0 < limit <= maximum:
+            raise BadRequest(f"limit must be between 1 and {maximum}")
+        return limit
+
+    @property
+    def paginated(self) -> bool:
+        return self.limit is not None or self.after is not None
+
+    def where(self) -> Tuple[List[str], list]:
+        """
+        Conditions on the "iati_identifier" and "iati_version"
+        columns of a source, with their parameters
+        """
+        clauses, params = [], []
+        if self.iati_identifier is not None:
+            clauses.append("iati_identifier = %s")
+            params.append(self.iati_identifier)
+        if self.iati_version is not None:
+            clauses.append("iati_version = %s")
+            params.append(self.iati_version)
+        if self.reporting_org is not None:
+            clauses.append(
+                "iati_identifier IN (SELECT iati_identifier "
+                f"FROM {IatiActivities._meta.db_table} WHERE reporting_org_ref = %s)"
+            )
+            params.append(self.reporting_org)
+        if self.after is not None:
+            clauses.append("iati_identifier > %s")
+            params.append(self.after)
+        return clauses, params
+
+    def apply(
+        self, source: str, ordered: bool = False, keys: str = None
+    ) -> Tuple[str, list]:
+        """
+        SQL and parameters for this query's rows of `source`,
+        which must have "iati_identifier" and "iati_version" columns.
+        Paginated or `ordered` rows are sorted by iati_identifier.
+        Where `source` is more than a plain select, `keys` selects the
+        "iati_identifier" and "iati_version" columns of the table it
+        reads, indexed on iati_identifier, for pages to be found with
+        an index scan instead of by running `source`.
+        """
+        clauses, params = self.where()
+        if self.limit is not None:
+            self._find_page_end(f"({keys or source}) src", clauses, params)
+            if self.next is not None:
+                clauses = clauses + ["iati_identifier <= %s"]
+                params = params + [self.next]
+        sql = f"SELECT * FROM ({source}) src"
+        if clauses:
+            sql += " WHERE " + " AND ".join(clauses)
+        if self.paginated or ordered:
+            sql += " ORDER BY iati_identifier"
+        return sql, params
+
+    def _find_page_end(self, relation: str, clauses: List[str], params: list):
+        """
+        Read up to one more than `limit` activities past `after` from
+        `relation`, in iati_identifier order. If there are that many,
+        the last on this page is where the next one starts.
+        """
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+        with connection.cursor() as c:
+            c.execute(
+                f"SELECT DISTINCT iati_identifier FROM {relation} {where} "
+                "ORDER BY iati_identifier LIMIT %s",
+                params + [self.limit + 1],
+            )
+            identifiers = [row[0] for row in c.fetchall()]
+        if len(identifiers) > self.limit:
+            self.next = identifiers[self.limit - 1]
+
+    def next_url(self) -> Optional[str]:
+        if self.next is None:
+            return None
+        query = self.request.GET.copy()
+        query["after"] = self.next
+        return self.request.build_absolute_uri(f"?{query.urlencode()}")
+
+    def add_link(self, response):
+        """
+        Point to the next page with a "Link" header
+        """
+        url = self.next_url()
+        if url:
+            response["Link"] = f'<{url}>; rel="next"'
+        return response
+
+
+# Transaction fields built by `transactions_sql`, one array of each per activity
+TRANSACTION_FIELDS = (
+    "value",
+    "currency",
+    "datestamp",
+    "transaction_type_code",
+    "id",
+)
+
+
+def transactions_sql(table_names: List[str]) -> str:
+    """
+    One row per activity from the transaction views `table_names`,
+    as `aggregate_transactions` builds it.
+    The views do not keep document order, so transactions are ordered
+    by value date and then by every other field: only identical
+    transactions tie, and the ids are the same from one request to
+    the next.
+    """
+    columns = (
+        "iati_identifier, iati_version, value, value_currency, "
+        "value_value_date, transaction_type_code, ref"
+    )
+    transactions = " UNION ALL ".join(
+        f'SELECT {columns} FROM "{name}"' for name in table_names
+    )
+    return aggregate_transactions(
+        f"""
+    SELECT
+        transactions.*,
+        ROW_NUMBER() OVER (
+            PARTITION BY iati_identifier, iati_version
+            ORDER BY value_value_date, transaction_type_code, value,
+                value_currency, ref
+        ) AS "ord"
+    FROM ({transactions}) transactions
+"""
+    )
+
+
+# The activities of the shredded transactions, for finding pages
+SHREDDED_TRANSACTION_KEYS = f"""
+SELECT transactions.iati_identifier, header.iati_version
+FROM {IatiActivityTransaction._meta.db_table} transactions
+JOIN {IatiActivityHeader._meta.db_table} header
+ON header.activity_id = transactions.activity_id
+"""
+
+
+def shredded_transactions_sql() -> str:
+    """
+    One row per activity from IatiActivityTransaction, as
+    `aggregate_transactions` builds it, in document order
+    """
+    return aggregate_transactions(
+        f"""
+    SELECT
+        transactions.iati_identifier,
+        header.iati_version,
+        transactions.value,
+        transactions.value_currency,
+        transactions.value_date AS "value_value_date",
+        transactions.transaction_type_code,
+        transactions.ref,
+        transactions.ordinality AS "ord"
+    FROM {IatiActivityTransaction._meta.db_table} transactions
+    JOIN {IatiActivityHeader._meta.db_table} header
+    ON header.activity_id = transactions.activity_id
+"""
+    )
+
+
+def aggregate_transactions(numbered: str) -> str:
+    """
+    One row per activity from the transactions `numbered` by their
+    position in the activity ("ord"), with its transactions' fields as
+    parallel arrays ready to be set on "Transaction" messages: values as
+    floats, value dates as YYYYMMDD integers and ids falling back to the
+    activity's identifier and the transaction's position when there is
+    no ref
+    """
+    return f"""
+SELECT
+    iati_identifier,
+    iati_version,
+    'V' || (iati_version * 100)::int AS "version",
+    array_agg(value::float8 ORDER BY ord) AS "value",
+    array_agg(value_currency ORDER BY ord) AS "currency",
+    array_agg(
+        to_char(value_value_date::date, 'YYYYMMDD')::int ORDER BY ord
+    ) AS "datestamp",
+    array_agg(transaction_type_code::text ORDER BY ord) AS "transaction_type_code",
+    array_agg(COALESCE(ref, iati_identifier || ' - ' || ord) ORDER BY ord) AS "id"
+FROM ({numbered}) numbered
+GROUP BY iati_identifier, iati_version
+"""
+
+
+# The language of an xml:lang, ignoring any region ("en-GB") and case
+LANGUAGE = "lower(split_part(replace({}, '_', '-'), '-', 1))"
+
+# The text search configurations of iatistore_ts_config (migration 0026)
+TS_CONFIGS = (
+    "danish",
+    "dutch",
+    "english",
+    "finnish",
+    "french",
+    "german",
+    "hungarian",
+    "italian",
+    "norwegian",
+    "portuguese",
+    "romanian",
+    "russian",
+    "spanish",
+    "swedish",
+    "turkish",
+    "simple",
+)
+
+
+class NarrativeSearch:
+    """
+    A full text search of narratives read from a request's query string.
+
+    `q` is the search, in web search syntax. With `lang` only narratives
+    in that language are searched, and `q` is stemmed for it. Without,
+    narratives in every language are searched with `q` stemmed for each
+    of them. `narrative_type` limits the search to some narratives, such
+    as "title" or "description", and `limit` (default 20) is the number
+    of activities returned, best matches first.
+    """
+
+    def __init__(self, request):
+        self.q = request.GET.get("q", "").strip()
+        if not self.q:
+            raise BadRequest("q is required")
+        self.lang = request.GET.get("lang") or None
+        self.narrative_types = request.GET.getlist("narrative_type")
+        maximum = getattr(settings, "IATISTORE_PAGE_MAX", 1000)
+        try:
+            self.limit = int(request.GET.get("limit", 20))
+        except ValueError:
+            raise BadRequest("limit must be an integer")
+        if not 0 < self.limit <= maximum:
+            raise BadRequest(f"limit must be between 1 and {maximum}")
+
+    def apply(self, table_names: List[str]) -> Tuple[str, list]:
+        """
+        SQL and parameters ranking the activities with narratives
+        in the combined narrative views `table_names` matching the search
+        """
+        narratives = " UNION ALL ".join(
+            f'SELECT iati_identifier, narrative_type, lang, search FROM "{name}"'
+            for name in table_names
+        )
+        where, params = "", []
+        if self.narrative_types:
+            where, params = "WHERE narrative_type = ANY(%s)", [self.narrative_types]
+        return self.rank(f"SELECT * FROM ({narratives}) narratives {where}", params)
+
+    def apply_shredded(self, paths: List[Tuple[str, str, bool]]) -> Tuple[str, list]:
+        """
+        SQL and parameters ranking the activities with narratives in
+        IatiActivityNarrative matching the search. `paths` are the
+        narrative paths of CombinedNarratives, by which narrative types
+        are matched to the elements which narratives were found below.
+        """
+        clauses, params = [], []
+        for path, narrative_type, exact in paths:
+            if narrative_type not in self.narrative_types:
+                continue
+            element = path[len("/iati-activity") :].lstrip("/")
+            if exact:
+                clauses.append("element = %s")
+                params.append(element)
+            elif element:
+                clauses.append("(element = %s OR element LIKE %s)")
+                params += [element, f"{element}/%"]
+            else:
+                clauses.append("true")
+        where = ""
+        if self.narrative_types:
+            where = f"WHERE {' OR '.join(clauses) or 'false'}"
+        # The expression of the GIN index on IatiActivityNarrative
+        search = "to_tsvector(iatistore_ts_config(lang), COALESCE(text, ''))"
+        narratives = f"""
+    SELECT iati_identifier, lang, {search} AS "search"
+    FROM {IatiActivityNarrative._meta.db_table}
+    {where}
+"""
+        return self.rank(narratives, params)
+
+    def query(self) -> Tuple[str, list]:
+        """
+        The tsquery of `q`, stemmed for `lang` or else for every
+        language, so that it matches narratives in any of them
+        """
+        if self.lang:
+            query = "websearch_to_tsquery(iatistore_ts_config(%s), %s)"
+            return query, [self.lang, self.q]
+        query = "websearch_to_tsquery(%s::regconfig, %s)"
+        return (
+            " || ".join([query] * len(TS_CONFIGS)),
+            [param for config in TS_CONFIGS for param in (config, self.q)],
+        )
+
+    def rank(self, narratives: str, params: list) -> Tuple[str, list]:
+        """
+        Rank the activities of the `narratives` matching the search
+        """
+        query, query_params = self.query()
+        where, where_params = "", []
+        if self.lang:
+            where = f"AND {LANGUAGE.format('lang')} = {LANGUAGE.format('%s')}"
+            where_params = [self.lang]
+        sql = f"""
+SELECT iati_identifier, max(ts_rank(search, search_query.q)) AS "rank"
+FROM ({narratives}) narratives, (SELECT {query} AS q) search_query
+WHERE search @@ search_query.q {where}
+GROUP BY iati_identifier
+ORDER BY "rank" DESC, iati_identifier
+LIMIT %s
+"""
+        return sql, params + query_params + where_params + [self.limit]
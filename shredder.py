@@ -0,0 +1,277 @@
+"""
+Parsing each activity once, at ingest time, into typed rows of
+IatiActivityHeader, IatiActivityTransaction, IatiActivityParticipatingOrg
+and IatiActivityNarrative, so that queries on those fields read indexed
+tables instead of running xmltable() over every activity's content.
+
+Activities are shredded as they are written when
+settings.IATISTORE_SHRED_ON_INGEST is set; `shred_pending` catches up
+with those whose content changed since they were last shredded. The
+transaction and narrative search endpoints read the side tables when
+that setting is on, since the side tables are then kept current.
+"""
+import logging
+from datetime import date, datetime, timezone
+from decimal import Decimal, InvalidOperation
+from typing import Iterable, List, NamedTuple, Optional
+
+from django.conf import settings
+from django.db import models, transaction
+from django.utils.dateparse import parse_datetime
+from lxml import etree
+
+from iatistore import generations
+
+logger = logging.getLogger(__name__)
+
+XML_LANG = "{http://www.w3.org/XML/1998/namespace}lang"
+
+# "activity-date" types, as codes (2.0x) and as names (1.0x)
+ACTIVITY_DATES = {
+    "1": "start_planned",
+    "2": "start_actual",
+    "3": "end_planned",
+    "4": "end_actual",
+    "start-planned": "start_planned",
+    "start-actual": "start_actual",
+    "end-planned": "end_planned",
+    "end-actual": "end_actual",
+}
+
+# The largest value which fits IatiActivityTransaction.value
+MAX_VALUE = Decimal(10) ** 18
+
+
+def shred_on_ingest() -> bool:
+    return getattr(settings, "IATISTORE_SHRED_ON_INGEST", False)
+
+
+def _strip(value: Optional[str]) -> Optional[str]:
+    if value is None:
+        return None
+    return value.strip() or None
+
+
+def _attr(element, path: str, name: str) -> Optional[str]:
+    found = element.find(path)
+    return _strip(found.get(name)) if found is not None else None
+
+
+def _date(value: Optional[str]) -> Optional[date]:
+    try:
+        return date.fromisoformat(value.strip()[:10])
+    except (AttributeError, ValueError):
+        return None
+
+
+def _datetime(value: Optional[str]) -> Optional[datetime]:
+    try:
+        parsed = parse_datetime(value.strip())
+    except (AttributeError, ValueError):
+        return None
+    if parsed is not None and parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed
+
+
+def _int(value: Optional[str]) -> Optional[int]:
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _value(value: Optional[str]) -> Optional[Decimal]:
+    try:
+        parsed = Decimal(value.strip().replace(",", ""))
+    except (AttributeError, InvalidOperation):
+        return None
+    return parsed if parsed.is_finite() and abs(parsed) < MAX_VALUE else None
+
+
+def _name(element) -> Optional[str]:
+    """
+    The first narrative of `element`, or its
+    own text for IATI 1.0x
+    """
+    if element is None:
+        return None
+    narrative = element.find("narrative")
+    return _strip((narrative if narrative is not None else element).text)
+
+
+def _element_path(element, root) -> str:
+    parts = []
+    while element is not None and element is not root:
+        parts.append(etree.QName(element).localname)
+        element = element.getparent()
+    return "/".join(reversed(parts))
+
+
+class Shredded(NamedTuple):
+    header: dict
+    transactions: List[dict]
+    participating_orgs: List[dict]
+    narratives: List[dict]
+
+
+def shred(row: dict) -> Shredded:
+    """
+    Parse the "content" of an IatiActivities row (as field
+    values) into the field values of its side table rows
+    """
+    content = row["content"]
+    root = etree.fromstring(content.encode() if isinstance(content, str) else content)
+    activity = dict(activity_id=row["id"], iati_identifier=row["iati_identifier"])
+    lang = root.get(XML_LANG)
+
+    header = dict(
+        activity,
+        iati_version=row["iati_version"],
+        content_hash=row.get("content_hash"),
+        default_currency=_strip(root.get("default-currency")),
+        default_lang=lang,
+        hierarchy=_int(root.get("hierarchy")),
+        last_updated_datetime=_datetime(root.get("last-updated-datetime")),
+        reporting_org_ref=_attr(root, "reporting-org", "ref"),
+        reporting_org_type=_attr(root, "reporting-org", "type"),
+        title=_name(root.find("title")),
+        activity_status_code=_attr(root, "activity-status", "code"),
+        start_planned=None,
+        start_actual=None,
+        end_planned=None,
+        end_actual=None,
+    )
+    for activity_date in root.iterfind("activity-date"):
+        field = ACTIVITY_DATES.get(activity_date.get("type"))
+        if field and header.get(field) is None:
+            header[field] = _date(activity_date.get("iso-date"))
+
+    transactions = [
+        dict(
+            activity,
+            ordinality=ordinality,
+            ref=_strip(t.get("ref")),
+            transaction_type_code=_attr(t, "transaction-type", "code"),
+            transaction_date=_date(_attr(t, "transaction-date", "iso-date")),
+            value=_value(t.findtext("value")),
+            value_currency=_attr(t, "value", "currency"),
+            value_date=_date(_attr(t, "value", "value-date")),
+            provider_org_ref=_attr(t, "provider-org", "ref"),
+            receiver_org_ref=_attr(t, "receiver-org", "ref"),
+        )
+        for ordinality, t in enumerate(root.iterfind("transaction"), start=1)
+    ]
+
+    participating_orgs = [
+        dict(
+            activity,
+            ordinality=ordinality,
+            ref=_strip(org.get("ref")),
+            type=_strip(org.get("type")),
+            role=_strip(org.get("role")),
+            name=_name(org),
+        )
+        for ordinality, org in enumerate(root.iterfind("participating-org"), start=1)
+    ]
+
+    narratives = [
+        dict(
+            activity,
+            ordinality=ordinality,
+            element=_element_path(narrative.getparent(), root),
+            lang=narrative.get(XML_LANG) or lang,
+            text=_strip(narrative.text),
+        )
+        for ordinality, narrative in enumerate(root.iter("narrative"), start=1)
+    ]
+
+    return Shredded(header, transactions, participating_orgs, narratives)
+
+
+def write(shredded: List[Shredded]):
+    """
+    Replace the side table rows of the activities in `shredded`
+    """
+    from iatistore.models import (
+        IatiActivityHeader,
+        IatiActivityNarrative,
+        IatiActivityParticipatingOrg,
+        IatiActivityTransaction,
+    )
+
+    if not shredded:
+        return
+    ids = [s.header["activity_id"] for s in shredded]
+    update_fields = [f for f in shredded[0].header if f != "activity_id"]
+    with transaction.atomic():
+        IatiActivityHeader.objects.bulk_create(
+            [IatiActivityHeader(**s.header) for s in shredded],
+            update_conflicts=True,
+            unique_fields=["activity"],
+            update_fields=update_fields,
+        )
+        for model, attr in (
+            (IatiActivityTransaction, "transactions"),
+            (IatiActivityParticipatingOrg, "participating_orgs"),
+            (IatiActivityNarrative, "narratives"),
+        ):
+            model.objects.filter(activity_id__in=ids).delete()
+            model.objects.bulk_create(
+                [model(**fields) for s in shredded for fields in getattr(s, attr)],
+                batch_size=1000,
+            )
+
+
+def _shred_batch(rows: Iterable[dict]) -> int:
+    shredded = []
+    for row in rows:
+        try:
+            shredded.append(shred(row))
+        except Exception as e:
+            logger.error(f"Unable to shred {row.get('iati_identifier')}: {e}")
+    write(shredded)
+    return len(shredded)
+
+
+def _changed(shredded: int) -> int:
+    # Endpoints read the side tables, and cache on this generation,
+    # so it is bumped once per run rather than per batch
+    if shredded:
+        generations.bump(generations.MATVIEWS)
+    return shredded
+
+
+def shred_rows(rows: Iterable[dict]) -> int:
+    """
+    Shred and write IatiActivities rows (as field values),
+    skipping those which cannot be parsed.
+    Returns the number of activities shredded.
+    """
+    return _changed(_shred_batch(rows))
+
+
+def shred_pending(everything: bool = False, batch_size: int = None) -> int:
+    """
+    Shred the activities which have not been shredded since their
+    content last changed (or all of them, with `everything`),
+    `batch_size` (default: settings.IATISTORE_BATCH_SIZE) at a time.
+    Returns the number of activities shredded.
+    """
+    from iatistore.models import IatiActivities, batched
+
+    batch_size = batch_size or getattr(settings, "IATISTORE_BATCH_SIZE", 500)
+    activities = IatiActivities.objects.all()
+    if not everything:
+        activities = activities.filter(
+            models.Q(header__isnull=True)
+            | ~models.Q(header__content_hash=models.F("content_hash"))
+        )
+    rows = activities.values(
+        "id", "iati_identifier", "iati_version", "content", "content_hash"
+    ).iterator(chunk_size=batch_size)
+    shredded = 0
+    for batch in batched(rows, batch_size):
+        shredded += _shred_batch(batch)
+        logger.info(f"Shredded {shredded} activities")
+    return _changed(shredded)
@@ -0,0 +1,299 @@
+"""
+The IATI activity standard, per version, as read from the summary tables
+in `iatixml` ("activity-standard-summary-table-<version>.csv").
+
+Each table lists the elements, attributes and text of the standard in
+document order with their XML path, type, occurrence and (from 2.01 on)
+codelist. They are read into a tree of `Element`s rooted at the
+"iati-activity" element, from which `table_definitions` derives the
+row and column expressions of an IatiXmlTable per repeating element.
+
+The 1.03 table has no codelist column: codelists are read from the
+links to them in its definitions. It also gives the elements of
+"iati-activity", which the 1.03 schema allows in any number and order,
+as "1..*"; they are read as optional.
+"""
+import csv
+import functools
+import re
+from decimal import Decimal
+from importlib import resources
+from typing import Dict, Iterator, List, NamedTuple, Optional
+
+from iatistore import iatixml
+
+ACTIVITY = "iati-activities/iati-activity"
+XML_NS = "http://www.w3.org/XML/1998/namespace"
+
+# Types of the 1.03 table, which does not use XSD type names
+TYPES_103 = {
+    "Text": "xsd:string",
+    "mixed": "xsd:string",
+    "Decimal": "xsd:decimal",
+    "Integer": "xsd:integer",
+    "Boolean": "xsd:boolean",
+    "DateTime": "xsd:dateTime",
+}
+
+# Links to codelists in the 1.03 definitions, with the attribute
+# they are for when they are in an element's definition
+CODELIST_LINK_103 = re.compile(r"(?:@([\w:-]+)\s*attribute\b[^@]*?)?codelists/([\w-]+)")
+
+# Labels of the 1.03 codelist links which are not their name in
+# CamelCase; None for links to lists which are not codelists
+CODELIST_LABELS_103 = {
+    "admin1": None,
+    "admin2": None,
+    "organisation": None,
+    "crs-repayment-type": "LoanRepaymentType",
+    "repayment-nopa": "LoanRepaymentPeriod",
+}
+
+# Text of elements which the summary tables leave out
+TEXT_TYPES = {"value": "xsd:decimal"}
+
+# Columns which every IatiXmlTable view has already
+RESERVED_COLUMNS = ("iati_identifier", "iati_version")
+
+
+def summary_table_name(iati_version) -> str:
+    version = Decimal(str(iati_version)).quantize(Decimal("0.01"))
+    return f"activity-standard-summary-table-{version}.csv"
+
+
+def has_summary_table(iati_version) -> bool:
+    return resources.is_resource(iatixml, summary_table_name(iati_version))
+
+
+def summary_rows(iati_version) -> Iterator[Dict[str, str]]:
+    """
+    The rows of the summary table of `iati_version`, with values stripped
+    """
+    with resources.open_text(
+        iatixml, summary_table_name(iati_version), encoding="utf-8"
+    ) as f:
+        for row in csv.DictReader(f):
+            yield {key: (value or "").strip() for key, value in row.items()}
+
+
+def codelist_label_103(name: str) -> Optional[str]:
+    """
+    The label of the codelist linked to as "codelists/<name>" in 1.03:
+    "organisation_role" is "OrganisationRole"
+    """
+    if name in CODELIST_LABELS_103:
+        return CODELIST_LABELS_103[name]
+    return "".join(part.capitalize() for part in re.split(r"[-_]", name))
+
+
+def codelists_103(definition: str) -> Dict[Optional[str], str]:
+    """
+    The labels of the codelists linked to from a 1.03 definition, by the
+    attribute they are for, or None when the definition does not say
+    """
+    codelists = {}
+    for attribute, name in CODELIST_LINK_103.findall(definition):
+        label = codelist_label_103(name)
+        if label:
+            codelists.setdefault(attribute or None, label)
+    return codelists
+
+
+def xsd_type(table_type: str) -> Optional[str]:
+    """
+    The XSD type of a summary table "Type", or None if it has none
+    """
+    return TYPES_103.get(table_type, table_type) or None
+
+
+class Occurrence(NamedTuple):
+    minimum: int
+    # None when unbounded
+    maximum: Optional[int]
+
+    @classmethod
+    def parse(cls, occur: str) -> "Occurrence":
+        """
+        An occurrence such as "0..1" or "1..*". Missing bounds,
+        as in some rows of the 1.03 table, read as 0 and 1.
+        """
+        low, _, high = occur.partition("..")
+        return cls(
+            int(low) if low.isdigit() else 0,
+            None if high == "*" else int(high) if high.isdigit() else 1,
+        )
+
+    @property
+    def repeats(self) -> bool:
+        return self.maximum is None or self.maximum > 1
+
+
+class Value(NamedTuple):
+    """
+    An attribute of an element or its text
+    """
+
+    name: str
+    xsd_type: Optional[str]
+    codelist: Optional[str]
+    required: bool
+
+    @property
+    def qualified_name(self) -> str:
+        """
+        The name of this attribute for lxml
+        """
+        if self.name.startswith("xml:"):
+            return f"{{{XML_NS}}}{self.name[4:]}"
+        return self.name
+
+
+class Element:
+    """
+    One element of the standard with its attributes, its text
+    and its child elements, in the order of the summary table
+    """
+
+    def __init__(self, path: str, occurrence: Occurrence, codelist: str = None):
+        # Relative to "iati-activity", which has the path ""
+        self.path = path
+        self.occurrence = occurrence
+        self.codelist = codelist
+        self.text: Optional[Value] = None
+        self.attributes: List[Value] = []
+        self.children: List["Element"] = []
+
+    @property
+    def name(self) -> str:
+        return self.path.rpartition("/")[2] or "iati-activity"
+
+    def walk(self) -> Iterator["Element"]:
+        """
+        This element and every element below it
+        """
+        yield self
+        for child in self.children:
+            yield from child.walk()
+
+    def __repr__(self):
+        return f"<Element {self.path or self.name}>"
+
+
+@functools.lru_cache(maxsize=None)
+def activity_standard(iati_version) -> Element:
+    """
+    The "iati-activity" element of `iati_version`'s summary table
+    """
+    root = Element("", Occurrence(1, None))
+    elements = {"": root}
+    # Codelists of attributes, from the 1.03 definitions of their element
+    attribute_codelists: Dict[str, Dict[Optional[str], str]] = {}
+    for row in summary_rows(iati_version):
+        xml = row["XML"]
+        if xml != ACTIVITY and not xml.startswith(f"{ACTIVITY}/"):
+            continue
+        path = xml[len(ACTIVITY) :].lstrip("/")
+        parent_path, _, name = path.rpartition("/")
+        occurrence = Occurrence.parse(row["Occur"])
+        if "Codelist" in row:
+            codelist = row["Codelist"] or None
+        else:
+            linked = codelists_103(row.get("Definition", ""))
+            if name.startswith("@"):
+                element_codelists = attribute_codelists.get(parent_path, {})
+                # A link in an attribute's own definition is for it
+                codelist = (
+                    next(iter(linked.values()), None)
+                    or element_codelists.get(name[1:])
+                    or (element_codelists.get(None) if name == "@code" else None)
+                )
+            else:
+                attribute_codelists[path] = linked
+                codelist = None
+            if not parent_path and occurrence == Occurrence(1, None):
+                occurrence = Occurrence(0, None)
+        if name.startswith("@"):
+            parent = elements.get(parent_path)
+            if parent is not None:
+                parent.attributes.append(
+                    Value(
+                        name[1:],
+                        xsd_type(row["Type"]),
+                        codelist,
+                        occurrence.minimum > 0,
+                    )
+                )
+        elif name == "text()":
+            parent = elements.get(parent_path)
+            if parent is not None:
+                parent.text = Value(name, xsd_type(row["Type"]), codelist, True)
+        elif path and path not in elements and parent_path in elements:
+            element = Element(path, occurrence, codelist)
+            elements[parent_path].children.append(element)
+            elements[path] = element
+    for element in root.walk():
+        if element.text is None and element.name in TEXT_TYPES:
+            element.text = Value("text()", TEXT_TYPES[element.name], None, True)
+    return root
+
+
+class ColumnDefinition(NamedTuple):
+    col_name: str
+    column_expression: str
+    col_xsd_type: str
+
+
+def col_name(column_expression: str) -> str:
+    """
+    The column name of a column expression:
+    "transaction-type/@code" is "transaction_type_code"
+    """
+    return (
+        column_expression.replace("/@", "_")
+        .replace("@", "")
+        .replace(":", "_")
+        .replace("-", "_")
+        .replace("/", "_")
+    )
+
+
+def _columns(element: Element, relative: str = "") -> Iterator[ColumnDefinition]:
+    for attribute in element.attributes:
+        expression = f"{relative}@{attribute.name}"
+        yield ColumnDefinition(
+            col_name(expression), expression, attribute.xsd_type or "xsd:string"
+        )
+    if element.text is not None:
+        expression = relative.rstrip("/") or "text()"
+        yield ColumnDefinition(
+            col_name(relative.rstrip("/") or element.name),
+            expression,
+            element.text.xsd_type or "xsd:string",
+        )
+    for child in element.children:
+        if not child.occurrence.repeats and child.name != "narrative":
+            yield from _columns(child, f"{relative}{child.name}/")
+
+
+def table_definitions(iati_version) -> Dict[str, List[ColumnDefinition]]:
+    """
+    The columns of an IatiXmlTable for "iati-activity" and for each
+    element which may repeat, by row expression. The columns are the
+    attributes and text of the element and of the elements below it
+    which may not repeat. Narratives are left to the narrative views.
+    """
+    tables = {}
+    for element in activity_standard(iati_version).walk():
+        if element.path and not element.occurrence.repeats:
+            continue
+        if "narrative" in element.path.split("/"):
+            continue
+        columns = {}
+        for column in _columns(element):
+            if column.col_name not in RESERVED_COLUMNS:
+                columns.setdefault(column.col_name, column)
+        if columns:
+            tables[f"/iati-activity/{element.path}".rstrip("/")] = list(
+                columns.values()
+            )
+    return tables
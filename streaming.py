@@ -0,0 +1,109 @@
+"""
+Streaming rows from a server-side cursor as JSON or NDJSON
+"""
+from itertools import islice
+from typing import Iterator, List, Optional, Tuple
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connection
+from django.http import StreamingHttpResponse
+
+NDJSON = "application/x-ndjson"
+
+
+def cursor_itersize() -> int:
+    return getattr(settings, "IATISTORE_CURSOR_ITERSIZE", 2000)
+
+
+def fetch_batches(
+    sql: str, params=None, size: int = None
+) -> Tuple[List[str], Iterator[list]]:
+    """
+    The column names of `sql` and its rows in lists of `size` (default:
+    IATISTORE_CURSOR_ITERSIZE), read from a server-side cursor.
+    The query runs, and its first rows are fetched, before this returns,
+    so that database errors are raised to the view instead of ending
+    a streamed response part way through.
+    """
+    size = size or cursor_itersize()
+    cursor = connection.chunked_cursor()
+    try:
+        cursor.cursor.itersize = size
+        cursor.execute(sql, params)
+        rows = cursor.fetchmany(size)
+    except Exception:
+        cursor.close()
+        raise
+    # Named cursors only have a description once rows are fetched
+    columns = [col[0] for col in cursor.description or ()]
+    return columns, _batches(cursor, rows, size)
+
+
+def _batches(cursor, rows: list, size: int) -> Iterator[list]:
+    with cursor:
+        while rows:
+            yield rows
+            rows = cursor.fetchmany(size)
+
+
+def iterate_rows(sql: str, params=None) -> Iterator[dict]:
+    """
+    Each row of `sql` as a dict, read as `fetch_batches` reads them
+    """
+    columns, batches = fetch_batches(sql, params)
+    return (dict(zip(columns, row)) for batch in batches for row in batch)
+
+
+def wants_ndjson(request) -> bool:
+    return request.GET.get("format") == "ndjson" or NDJSON in request.headers.get(
+        "Accept", ""
+    )
+
+
+def json_chunks(rows: Iterator[dict], envelope: Optional[str] = "results", **extra):
+    """
+    Encode `rows` as a JSON array, a few hundred rows per chunk.
+    With an `envelope` the array is the value of that key in an object
+    which also holds the `extra` items.
+    """
+    encode = DjangoJSONEncoder().encode
+    if envelope:
+        head = "".join(f"{encode(k)}: {encode(v)}, " for k, v in extra.items())
+        yield f"{{{head}{encode(envelope)}: ["
+    else:
+        yield "["
+    separator = ""
+    rows = iter(rows)
+    while True:
+        chunk = list(islice(rows, 500))
+        if not chunk:
+            break
+        yield separator + ",\n".join(encode(row) for row in chunk)
+        separator = ",\n"
+    yield "]}" if envelope else "]"
+
+
+def ndjson_chunks(rows: Iterator[dict]):
+    encode = DjangoJSONEncoder().encode
+    rows = iter(rows)
+    while True:
+        chunk = list(islice(rows, 500))
+        if not chunk:
+            break
+        yield "".join(encode(row) + "\n" for row in chunk)
+
+
+def streaming_json_response(
+    request, rows: Iterator[dict], envelope: Optional[str] = "results", **extra
+) -> StreamingHttpResponse:
+    """
+    Stream `rows` as NDJSON if the client asked for it with
+    "?format=ndjson" or its Accept header, otherwise as JSON.
+    `extra` items go alongside the rows in the JSON envelope.
+    """
+    if wants_ndjson(request):
+        return StreamingHttpResponse(ndjson_chunks(rows), content_type=NDJSON)
+    return StreamingHttpResponse(
+        json_chunks(rows, envelope, **extra), content_type="application/json"
+    )
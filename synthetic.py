@@ -0,0 +1,252 @@
+"""
+Synthetic IATI activities, generated offline, for benchmarks and
+load tests. The same `seed` always generates the same activities.
+
+`synthetic_activities` generates a small fixed shape of activity.
+`standard_activities` generates every element of the activity standard
+summary table of a version (see `standard`), with configurable numbers
+of each element.
+"""
+import random
+from datetime import date, timedelta
+from typing import Callable, Dict, Iterable, Iterator, Sequence
+
+from lxml import etree
+
+from iatistore import standard
+from iatistore.ingest import DATASTORE_NS
+
+XML_LANG = "{http://www.w3.org/XML/1998/namespace}lang"
+
+# Identifiers of generated activities start with this, so that they
+# can be told apart from (and deleted without touching) real ones
+PREFIX = "XX-SYNTHETIC"
+
+LANGS = ("en", "fr", "es")
+WORDS = (
+    "water sanitation health education rural urban support programme "
+    "capacity building food security climate resilience governance "
+    "infrastructure nutrition livelihoods emergency response district"
+).split()
+
+
+def _words(rng: random.Random, count: int) -> str:
+    return " ".join(rng.choice(WORDS) for _ in range(count)).capitalize()
+
+
+def _narratives(parent, rng: random.Random, count: int, words: int = 6):
+    for n in range(count):
+        narrative = etree.SubElement(parent, "narrative")
+        if n:
+            narrative.set(XML_LANG, LANGS[n % len(LANGS)])
+        narrative.text = _words(rng, words)
+
+
+def synthetic_activity(
+    number: int,
+    iati_version,
+    transactions: int = 5,
+    narratives: int = 2,
+    rng: random.Random = None,
+):
+    """
+    One "iati-activity" element, as read from the datastore, with
+    `transactions` transactions and `narratives` narratives (in
+    different languages) to each narrative element
+    """
+    rng = rng or random.Random(number)
+    version = str(iati_version)
+    identifier = f"{PREFIX}-{version.replace('.', '')}-{number:08d}"
+    start = date(2010, 1, 1) + timedelta(days=rng.randrange(3650))
+
+    a = etree.Element("iati-activity", nsmap={"iati-extra": DATASTORE_NS})
+    a.set(f"{{{DATASTORE_NS}}}version", version)
+    a.set(XML_LANG, "en")
+    a.set("default-currency", rng.choice(("USD", "EUR", "GBP")))
+    a.set("last-updated-datetime", f"{start.isoformat()}T00:00:00")
+    etree.SubElement(a, "iati-identifier").text = identifier
+    reporting_org = etree.SubElement(
+        a, "reporting-org", ref=f"{PREFIX}-ORG-{number % 50}", type="10"
+    )
+    _narratives(reporting_org, rng, 1, 3)
+    _narratives(etree.SubElement(a, "title"), rng, narratives)
+    _narratives(etree.SubElement(a, "description", type="1"), rng, narratives, 30)
+    for role in ("1", "4"):
+        org = etree.SubElement(
+            a, "participating-org", ref=f"{PREFIX}-ORG-{rng.randrange(50)}", role=role
+        )
+        _narratives(org, rng, 1, 3)
+    etree.SubElement(a, "activity-status", code=rng.choice("1234"))
+    etree.SubElement(a, "activity-date", type="1", **{"iso-date": start.isoformat()})
+    etree.SubElement(
+        a,
+        "activity-date",
+        type="3",
+        **{"iso-date": (start + timedelta(days=730)).isoformat()},
+    )
+    for n in range(transactions):
+        day = (start + timedelta(days=30 * n)).isoformat()
+        t = etree.SubElement(a, "transaction", ref=f"{identifier}-{n}")
+        etree.SubElement(t, "transaction-type", code=rng.choice(("2", "3", "4")))
+        etree.SubElement(t, "transaction-date", **{"iso-date": day})
+        value = etree.SubElement(t, "value", **{"value-date": day})
+        value.text = f"{rng.randrange(100, 10 ** 7)}.{rng.randrange(100):02d}"
+        _narratives(etree.SubElement(t, "description"), rng, narratives, 4)
+        etree.SubElement(t, "provider-org", ref=f"{PREFIX}-ORG-{rng.randrange(50)}")
+    return a
+
+
+def synthetic_activities(
+    count: int, versions: Sequence, seed: int = 0, **cardinalities
+) -> Iterator:
+    """
+    `count` synthetic activities for each of `versions`
+    """
+    rng = random.Random(seed)
+    for version in versions:
+        for number in range(count):
+            yield synthetic_activity(number, version, rng=rng, **cardinalities)
+
+
+# Codes for codelists when no codes are given, by summary table label
+FALLBACK_CODES = {
+    "Currency": ("USD", "EUR", "GBP"),
+    "Language": LANGS,
+    "Version": ("2.03",),
+}
+
+
+def fallback_codes(label: str) -> Sequence[str]:
+    return FALLBACK_CODES.get(label, ("1", "2", "3"))
+
+
+def database_codes(iati_version) -> Callable[[str], Sequence[str]]:
+    """
+    Codes from the codelists in the database, for generating activities
+    with valid codes. Codelists which are not there fall back to
+    `fallback_codes`.
+    """
+    from iatistore.codelists import lookup
+
+    def codes(label: str) -> Sequence[str]:
+        codelist = lookup.codelist(iati_version, label.replace(" ", ""))
+        return tuple(codelist.codes) or fallback_codes(label)
+
+    return codes
+
+
+class StandardActivity:
+    """
+    Generates "iati-activity" elements with the elements, attributes
+    and text of the activity standard summary table of `iati_version`.
+
+    `repeats` sets how many of an element to generate, keyed by its path
+    below "iati-activity" ("transaction/description") or its name
+    ("narrative"), up to the most the standard allows. Other elements
+    are generated as often as the standard requires, or once with a
+    probability of `optional` if it does not; so are attributes.
+    `codes` gives the codes to pick from for a codelist's label.
+    """
+
+    def __init__(
+        self,
+        iati_version,
+        repeats: Dict[str, int] = None,
+        optional: float = 0.5,
+        codes: Callable[[str], Sequence[str]] = fallback_codes,
+    ):
+        self.iati_version = str(iati_version)
+        self.standard = standard.activity_standard(iati_version)
+        self.repeats = repeats or {}
+        self.optional = optional
+        self.codes = codes
+
+    def count(self, element: standard.Element, rng: random.Random) -> int:
+        occurrence = element.occurrence
+        for key in (element.path, element.name):
+            if key in self.repeats:
+                count = self.repeats[key]
+                break
+        else:
+            count = occurrence.minimum or int(rng.random() < self.optional)
+        if occurrence.maximum is not None:
+            count = min(count, occurrence.maximum)
+        return count
+
+    def value(self, value: standard.Value, rng: random.Random, words: int = 1) -> str:
+        if value.name == "xml:lang":
+            return rng.choice(LANGS)
+        if value.name == "ref":
+            return f"{PREFIX}-ORG-{rng.randrange(50)}"
+        if value.codelist:
+            return rng.choice(self.codes(value.codelist))
+        xsd_type = (value.xsd_type or "").rpartition(":")[2]
+        day = date(2010, 1, 1) + timedelta(days=rng.randrange(3650))
+        if xsd_type == "decimal":
+            return f"{rng.randrange(100, 10 ** 7)}.{rng.randrange(100):02d}"
+        if xsd_type in ("int", "integer", "positiveInteger", "nonNegativeInteger"):
+            return str(rng.randrange(1, 10))
+        if xsd_type == "boolean":
+            return rng.choice(("0", "1"))
+        if xsd_type == "date":
+            return day.isoformat()
+        if xsd_type == "dateTime":
+            return f"{day.isoformat()}T00:00:00"
+        if xsd_type == "anyURI":
+            return f"https://example.org/{rng.choice(WORDS)}"
+        return _words(rng, words)
+
+    def fill(self, e, element: standard.Element, rng: random.Random):
+        for attribute in element.attributes:
+            if attribute.required or rng.random() < self.optional:
+                e.set(attribute.qualified_name, self.value(attribute, rng))
+        if element.text is not None:
+            e.text = self.value(element.text, rng, words=6)
+        for child in element.children:
+            for _ in range(self.count(child, rng)):
+                self.fill(etree.SubElement(e, child.name), child, rng)
+
+    def __call__(self, number: int, rng: random.Random = None):
+        rng = rng or random.Random(number)
+        identifier = f"{PREFIX}-{self.iati_version.replace('.', '')}-{number:08d}"
+        a = etree.Element("iati-activity", nsmap={"iati-extra": DATASTORE_NS})
+        self.fill(a, self.standard, rng)
+        a.set(f"{{{DATASTORE_NS}}}version", self.iati_version)
+        if a.get("version") is not None:
+            a.set("version", self.iati_version)
+        for e in a.iterchildren("iati-identifier"):
+            e.text = identifier
+        if a.find("iati-identifier") is None:
+            etree.SubElement(a, "iati-identifier").text = identifier
+        for e in a.iterchildren("reporting-org"):
+            e.set("ref", f"{PREFIX}-ORG-{number % 50}")
+        return a
+
+
+def standard_activities(
+    count: int, versions: Sequence, seed: int = 0, **options
+) -> Iterator:
+    """
+    `count` activities shaped by the activity standard for each of
+    `versions`, taking the options of StandardActivity. Each activity
+    depends only on the seed, its version and its number.
+    """
+    for version in versions:
+        activity = StandardActivity(version, **options)
+        for number in range(count):
+            yield activity(number, random.Random(f"{seed}:{version}:{number}"))
+
+
+def write_activities(path, activities: Iterable, iati_version) -> int:
+    """
+    Write `activities` to an "iati-activities" document at `path`,
+    one at a time. Returns the number of activities written.
+    """
+    written = 0
+    with etree.xmlfile(path, encoding="utf-8") as xf:
+        xf.write_declaration()
+        with xf.element("iati-activities", version=str(iati_version)):
+            for a in activities:
+                xf.write(a)
+                written += 1
+    return written
@@ -1,3 +1,1258 @@
-from django.test import TestCase
+import json
+import os
+import tempfile
+from datetime import date
+from decimal import Decimal
+from unittest import mock, skipIf
 
-# Create your tests here.
+from django.core.cache import caches
+from django.core.cache.backends.dummy import DummyCache
+from django.core.exceptions import BadRequest, ImproperlyConfigured
+from django.db import DatabaseError, connection
+from django.http import HttpResponse, StreamingHttpResponse
+from django.test import (
+    RequestFactory,
+    SimpleTestCase,
+    TestCase,
+    TransactionTestCase,
+    override_settings,
+)
+from django.utils import timezone
+from django.views import View
+from lxml import etree
+
+from iatistore import (
+    benchmark,
+    generations,
+    matviews,
+    partitions,
+    shredder,
+    standard,
+    views,
+)
+from iatistore.apps import check_django_version
+from iatistore.caching import CachedResponseMixin, response_cache
+from iatistore.codelists import Codelist, name_codes
+from iatistore.export import (
+    ExportColumn,
+    ipc_chunks,
+    pyarrow,
+    record_batches,
+    write_parquet,
+)
+from iatistore.ingest import DATASTORE_NS
+from iatistore.models import (
+    UNIFIED_TABLES,
+    Changeset,
+    CombinedNarratives,
+    IatiActivities,
+    IatiCodelist,
+    IatiCodelistItem,
+    IatiXmlColumn,
+    IatiXmlTable,
+    UnifiedXmlTable,
+    iati_versions,
+    index_name,
+    sql_statements,
+    unique_rows,
+)
+from iatistore.pipeline import ActivityPipeline
+from iatistore.queries import (
+    ActivityQuery,
+    NarrativeSearch,
+    shredded_transactions_sql,
+    transactions_sql,
+)
+from iatistore.streaming import iterate_rows
+from iatistore.synthetic import PREFIX, StandardActivity
+
+
+def activity_row(identifier: str, content_hash: str, version: str = "2.03") -> dict:
+    return dict(
+        id=identifier.lower(),
+        iati_identifier=identifier,
+        content=f"<iati-activity><iati-identifier>{identifier}</iati-identifier>"
+        "</iati-activity>",
+        iati_version=version,
+        content_hash=content_hash,
+        reporting_org_ref=None,
+    )
+
+
+def datastore_page(*activities, version: str = "2.03") -> bytes:
+    """
+    A page of datastore XML with an activity per (identifier, title)
+    """
+    return (
+        f'<iati-activities xmlns:iati-extra="{DATASTORE_NS}">'
+        + "".join(
+            f'<iati-activity iati-extra:version="{version}">'
+            f"<iati-identifier>{identifier}</iati-identifier>"
+            f"<title><narrative>{title}</narrative></title></iati-activity>"
+            for identifier, title in activities
+        )
+        + "</iati-activities>"
+    ).encode()
+
+
+def empty_changeset() -> Changeset:
+    return Changeset(
+        inserted=[], updated=[], unchanged=[], disappeared=[], failed=[], skipped=[]
+    )
+
+
+class UniqueRowsTests(SimpleTestCase):
+    def test_keeps_the_last_row_of_each_id(self):
+        rows = [
+            dict(id="xm-1", iati_identifier="XM-1", content="a"),
+            dict(id="xm-2", iati_identifier="XM-2", content="b"),
+            dict(id="xm-1", iati_identifier="XM 1", content="c"),
+        ]
+        with self.assertLogs("iatistore.models", "WARNING"):
+            unique, duplicates = unique_rows(rows)
+        self.assertEqual([row["content"] for row in unique], ["c", "b"])
+        self.assertEqual(duplicates, [rows[0]])
+
+    def test_no_duplicates(self):
+        rows = [dict(id="xm-1", iati_identifier="XM-1")]
+        self.assertEqual(unique_rows(rows), (rows, []))
+
+
+class WriteChangesTests(TestCase):
+    def setUp(self):
+        IatiActivities.objects.create(**activity_row("XM-1", "same"))
+        IatiActivities.objects.create(**activity_row("XM-2", "old"))
+
+    def test_outcomes(self):
+        changes = empty_changeset()
+        rows = [
+            activity_row("XM-1", "same"),
+            activity_row("XM-2", "new"),
+            activity_row("XM-3", "new"),
+        ]
+        written = IatiActivities.write_changes(rows, timezone.now(), changes)
+        self.assertEqual(written, 2)
+        self.assertEqual(changes.unchanged, ["xm-1"])
+        self.assertEqual(changes.updated, ["xm-2"])
+        self.assertEqual(changes.inserted, ["xm-3"])
+        self.assertEqual(changes.failed, [])
+
+    def test_rows_not_written_are_failed(self):
+        changes = empty_changeset()
+        rows = [activity_row("XM-2", "new"), activity_row("XM-3", "new")]
+        with mock.patch.object(IatiActivities, "upsert", return_value=[]):
+            written = IatiActivities.write_changes(rows, timezone.now(), changes)
+        self.assertEqual(written, 0)
+        self.assertEqual(changes.changed, [])
+        self.assertEqual(changes.failed, ["xm-2", "xm-3"])
+
+
+class FetchTests(TestCase):
+    def test_unreadable_activity_has_not_disappeared(self):
+        IatiActivities.objects.create(**activity_row("XM-1", "old"))
+        IatiActivities.objects.create(**activity_row("XM-2", "old"))
+        activities = list(
+            etree.fromstring(datastore_page(("XM-1", "first"), ("XM-2", "second")))
+        )
+        # Without its version, XM-2 cannot be read
+        del activities[1].attrib[f"{{{DATASTORE_NS}}}version"]
+        with mock.patch("iatistore.models.DataStoreRequest") as request:
+            request.return_value.activities.return_value = iter(activities)
+            changes = IatiActivities.fetch()
+        self.assertEqual(changes.updated, ["xm-1"])
+        self.assertEqual(changes.failed, ["xm-2"])
+        self.assertEqual(changes.disappeared, [])
+
+
+class CopyActivitiesTests(TestCase):
+    def copy(self, *activities) -> int:
+        with mock.patch.object(shredder, "shred_on_ingest", return_value=False):
+            return IatiActivities.copy_activities(
+                etree.fromstring(datastore_page(*activities))
+            )
+
+    def test_merged_counts_only_the_changed(self):
+        self.assertEqual(self.copy(("XM-1", "first"), ("XM-2", "second")), 2)
+        merged = self.copy(("XM-1", "first"), ("XM-2", "changed"), ("XM-3", "third"))
+        self.assertEqual(merged, 2)
+        self.assertEqual(IatiActivities.objects.count(), 3)
+
+    def test_statements(self):
+        script = "-- a comment;\nUPDATE a SET b = 1;\n\nDELETE FROM a;\n"
+        self.assertEqual(
+            sql_statements(script), ["UPDATE a SET b = 1", "DELETE FROM a"]
+        )
+
+
+class ActivityPipelineTests(TestCase):
+    pages = [
+        datastore_page(("XM-1", "first"), ("XM-2", "second")),
+        datastore_page(("XM-3", "third")),
+        datastore_page(("XM-1", "fourth")),
+    ]
+
+    def stub(self, number: int) -> bytes:
+        return self.pages[number] if number < len(self.pages) else b""
+
+    def setUp(self):
+        IatiActivities.objects.create(**activity_row("XM-9", "gone"))
+
+    def test_stub_datastore(self):
+        changes = ActivityPipeline(self.stub, fetchers=3, parsers=2).run()
+        self.assertEqual(sorted(changes.inserted), ["xm-1", "xm-2", "xm-3"])
+        self.assertEqual(changes.skipped, ["XM-1"])
+        self.assertEqual(changes.disappeared, ["xm-9"])
+        # Pages are written in page order, so the later copy wins
+        self.assertIn("fourth", IatiActivities.objects.get(pk="xm-1").content)
+
+    def test_failed_page(self):
+        def stub(number: int) -> bytes:
+            if number == 1:
+                raise IOError("Unavailable")
+            return self.stub(number)
+
+        pipeline = ActivityPipeline(stub, fetchers=2, parsers=1, retries=1)
+        changes = pipeline.run()
+        self.assertEqual(pipeline.failed_pages, [1])
+        self.assertEqual(sorted(changes.inserted), ["xm-1", "xm-2"])
+        # Activities on the lost page may still exist
+        self.assertEqual(changes.disappeared, [])
+
+    def test_unreadable_activity_has_not_disappeared(self):
+        IatiActivities.objects.create(**activity_row("XM-8", "old"))
+        pages = [
+            datastore_page(("XM-1", "first")),
+            # Without its version, XM-8 cannot be read
+            datastore_page(("XM-8", "unreadable")).replace(
+                b' iati-extra:version="2.03"', b""
+            ),
+        ]
+        changes = ActivityPipeline(
+            lambda number: pages[number] if number < len(pages) else b"",
+            fetchers=2,
+            parsers=1,
+        ).run()
+        self.assertEqual(changes.failed, ["xm-8"])
+        self.assertEqual(changes.disappeared, ["xm-9"])
+
+    def test_failed_write_stops_fetching(self):
+        fetched = []
+
+        def endless(number: int) -> bytes:
+            fetched.append(number)
+            return datastore_page((f"XM-{number}", "title"))
+
+        pipeline = ActivityPipeline(
+            endless, fetchers=2, parsers=1, batch_size=1, queue_size=1, window=3
+        )
+        with mock.patch.object(
+            IatiActivities, "write_changes", side_effect=DatabaseError
+        ):
+            with self.assertRaises(DatabaseError):
+                pipeline.run()
+        # Only the first page was written, so the window moved on once
+        self.assertLessEqual(len(fetched), pipeline.window + 1)
+
+
+class MatviewRebuildTests(TransactionTestCase):
+    """
+    Views are built on worker connections, so the data
+    they read from has to be committed
+    """
+
+    def setUp(self):
+        IatiActivities.objects.create(**activity_row("XM-1", "hash"))
+        self.table = IatiXmlTable(
+            row_expression="/iati-activity", iati_version=Decimal("2.03")
+        )
+        patcher = mock.patch.object(
+            IatiXmlTable,
+            "sql",
+            "SELECT iati_identifier FROM iatistore_iatiactivities",
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.assertTrue(self.table.matview_create())
+        name = self.table.table_name
+        with connection.cursor() as c:
+            c.execute(f'CREATE VIEW "{name}_ids" AS SELECT * FROM "{name}"')
+            c.execute(
+                f'CREATE MATERIALIZED VIEW "{name}_count" AS '
+                f'SELECT count(*) AS n FROM "{name}_ids"'
+            )
+            c.execute(f'CREATE INDEX "{name}_count_n" ON "{name}_count" (n)')
+        self.addCleanup(self.drop_views)
+        IatiActivities.objects.create(**activity_row("XM-2", "hash"))
+
+    def drop_views(self):
+        name = self.table.table_name
+        with connection.cursor() as c:
+            c.execute(f'DROP MATERIALIZED VIEW IF EXISTS "{name}_count"')
+            c.execute(f'DROP VIEW IF EXISTS "{name}_ids"')
+            c.execute(f'DROP MATERIALIZED VIEW IF EXISTS "{self.table.shadow_name}"')
+            c.execute(f'DROP MATERIALIZED VIEW IF EXISTS "{name}"')
+
+    def counts(self):
+        name = self.table.table_name
+        with connection.cursor() as c:
+            c.execute(f'SELECT count(*) FROM "{name}_ids"')
+            ids = c.fetchone()[0]
+            c.execute(f'SELECT n FROM "{name}_count"')
+            count = c.fetchone()[0]
+            c.execute(
+                "SELECT 1 FROM pg_indexes WHERE indexname = %s", [f"{name}_count_n"]
+            )
+            indexed = c.fetchone() is not None
+        return ids, count, indexed
+
+    def test_rebuild_recreates_dependents(self):
+        self.assertTrue(self.table.rebuild())
+        self.assertEqual(self.counts(), (2, 2, True))
+
+    def test_rebuild_on_workers(self):
+        (timing,) = matviews.rebuild([self.table], workers=2)
+        self.assertTrue(timing.ok)
+        self.assertEqual(self.counts(), (2, 2, True))
+
+    def test_refresh_swaps_in_on_the_calling_connection(self):
+        with mock.patch.object(matviews, "swap_in", wraps=matviews.swap_in) as swap:
+            (timing,) = matviews.rebuild([self.table], workers=2, refresh=True)
+        swap.assert_called_once_with([self.table])
+        self.assertTrue(timing.ok)
+        self.assertEqual(self.counts(), (2, 2, True))
+
+    def test_refresh_concurrently(self):
+        self.table.unique_columns = ("iati_identifier",)
+        self.table.matview_index()
+        with mock.patch.object(matviews, "swap_in") as swap:
+            (timing,) = matviews.rebuild([self.table], workers=2, refresh=True)
+        swap.assert_not_called()
+        self.assertTrue(timing.ok)
+        # Refreshed in place, so the dependents were left alone
+        self.assertEqual(self.counts(), (2, 1, True))
+
+    def test_refresh_by_swap(self):
+        self.assertTrue(self.table.matview_refresh())
+        self.assertEqual(self.counts(), (2, 2, True))
+
+    def test_refresh_concurrently_in_place(self):
+        self.table.unique_columns = ("iati_identifier",)
+        self.table.matview_index()
+        self.assertTrue(self.table.matview_is_unique())
+        self.assertTrue(self.table.matview_refresh())
+        self.assertEqual(self.counts(), (2, 1, True))
+
+    def test_refresh_creates_a_missing_view(self):
+        self.drop_views()
+        self.assertTrue(self.table.matview_refresh())
+        self.assertTrue(self.table.matview_exists())
+        self.assertEqual(benchmark.count_rows(self.table.table_name), 2)
+
+    def test_failed_build_leaves_views_alone(self):
+        with mock.patch.object(IatiXmlTable, "sql", "SELECT nonsense"):
+            (timing,) = matviews.rebuild([self.table], workers=2)
+        self.assertFalse(timing.ok)
+        self.assertEqual(self.counts(), (1, 1, True))
+
+
+class MatviewIndexTests(TestCase):
+    def setUp(self):
+        self.table = IatiXmlTable.objects.create(
+            row_expression="/iati-activity/transaction",
+            document_expression='"content"',
+            iati_version=Decimal("2.03"),
+        )
+        self.table.columns.add(
+            IatiXmlColumn.objects.create(
+                col_name="ref", column_expression="@ref", col_xsd_type="text"
+            ),
+            IatiXmlColumn.objects.create(
+                col_name="transaction_type_code",
+                column_expression="transaction-type/@code",
+                col_xsd_type="text",
+                indexed=True,
+            ),
+        )
+
+    def test_indexed_columns(self):
+        self.assertEqual(
+            self.table.indexed_columns, ["iati_identifier", "transaction_type_code"]
+        )
+
+    def test_index_names_fit(self):
+        names = {
+            index_name("x" * 60, ["iati_identifier"]),
+            index_name("x" * 60, ["transaction_type_code"]),
+        }
+        self.assertEqual(len(names), 2)
+        self.assertTrue(all(len(name) <= 63 for name in names))
+
+    def test_indexes_are_created_with_the_view(self):
+        sql = (
+            "SELECT iati_identifier, NULL::text AS transaction_type_code "
+            "FROM iatistore_iatiactivities"
+        )
+        self.table.unique_columns = ("iati_identifier",)
+        with mock.patch.object(IatiXmlTable, "sql", sql):
+            self.assertTrue(self.table.matview_create())
+        with connection.cursor() as c:
+            c.execute(
+                "SELECT indexname FROM pg_indexes WHERE tablename = %s",
+                [self.table.table_name],
+            )
+            created = {name for name, in c.fetchall()}
+        expected = {name for name, _ in self.table.index_sql(self.table.table_name)}
+        self.assertEqual(created, expected)
+        self.assertEqual(len(expected), 3)
+        self.assertTrue(self.table.matview_is_unique())
+
+
+class StreamingTests(TestCase):
+    @override_settings(IATISTORE_CURSOR_ITERSIZE=2)
+    def test_rows_in_batches(self):
+        rows = iterate_rows("SELECT n FROM generate_series(1, 5) n ORDER BY n")
+        self.assertEqual(list(rows), [{"n": n} for n in range(1, 6)])
+
+    def test_no_rows(self):
+        self.assertEqual(list(iterate_rows("SELECT 1 AS n WHERE false")), [])
+
+    def test_errors_before_streaming(self):
+        # Raised by the call, before a response has started
+        with self.assertRaises(DatabaseError):
+            iterate_rows('SELECT * FROM "iatistore_no_such_view"')
+
+
+class GenerationsTests(TestCase):
+    def test_zero_until_bumped(self):
+        with connection.cursor() as c:
+            c.execute("CREATE TEMP SEQUENCE iatistore_test_generation")
+        self.assertEqual(generations.current("iatistore_test_generation"), 0)
+        self.assertEqual(generations.bump("iatistore_test_generation"), 1)
+        self.assertEqual(generations.current("iatistore_test_generation"), 1)
+
+
+class CachedView(CachedResponseMixin, View):
+    def get(self, request):
+        return HttpResponse(request.headers.get("Accept", ""))
+
+
+@override_settings(
+    CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}}
+)
+@mock.patch("iatistore.caching.generations.current", return_value=1)
+class CachedResponseTests(SimpleTestCase):
+    def get(self, **headers):
+        with mock.patch.object(
+            CachedView, "get", autospec=True, side_effect=CachedView.get
+        ) as view:
+            request = RequestFactory().get("/cached/", **headers)
+            response = CachedView.as_view()(request)
+        return response, view.called
+
+    def setUp(self):
+        caches["default"].clear()
+
+    def test_cached_by_accept(self, current):
+        response, called = self.get(HTTP_ACCEPT="application/json")
+        self.assertTrue(called)
+        self.assertEqual(response["Vary"], "Accept")
+        response, called = self.get(HTTP_ACCEPT="application/json")
+        self.assertFalse(called)
+        self.assertEqual(response.content, b"application/json")
+        self.assertEqual(response["Vary"], "Accept")
+        response, called = self.get(HTTP_ACCEPT="application/x-protobuf")
+        self.assertTrue(called)
+
+    def test_not_modified(self, current):
+        response, _ = self.get()
+        response, called = self.get(HTTP_IF_NONE_MATCH=response["ETag"])
+        self.assertFalse(called)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response["Vary"], "Accept")
+
+
+class ExportTests(SimpleTestCase):
+    def test_arrow_without_pyarrow(self):
+        with mock.patch("iatistore.export.pyarrow", None):
+            with self.assertRaises(ImproperlyConfigured):
+                ipc_chunks(mock.Mock())
+
+    def test_types_from_xsd(self):
+        self.assertEqual(
+            ExportColumn.from_xsd("value", "xsd:decimal").export_type, "number"
+        )
+        self.assertEqual(ExportColumn.from_xsd("date", "date").export_type, "date")
+        self.assertEqual(ExportColumn.from_xsd("ref", None).export_type, "text")
+
+
+@skipIf(pyarrow is None, "pyarrow is not installed")
+class ArrowExportTests(TestCase):
+    def setUp(self):
+        IatiActivities.objects.create(**activity_row("XM-1", "hash"))
+        self.table = IatiXmlTable.objects.create(
+            row_expression="/iati-activity/transaction",
+            document_expression='"content"',
+            iati_version=Decimal("2.03"),
+        )
+        for name, xsd_type in (("value", "xsd:decimal"), ("value_date", "xsd:date")):
+            self.table.columns.add(
+                IatiXmlColumn.objects.create(
+                    col_name=name, column_expression=name, col_xsd_type=xsd_type
+                )
+            )
+        sql = (
+            "SELECT iati_identifier, iati_version, v.* "
+            "FROM iatistore_iatiactivities, "
+            "(VALUES ('100.5', '2020-01-31'), ('n/a', 'soon')) v(value, value_date)"
+        )
+        with mock.patch.object(IatiXmlTable, "sql", sql):
+            self.assertTrue(self.table.matview_create())
+
+    def test_record_batches(self):
+        batches = list(record_batches(self.table, batch_size=1))
+        self.assertEqual([batch.num_rows for batch in batches], [1, 1])
+        values = pyarrow.Table.from_batches(batches).to_pydict()
+        # Values which do not parse as their type are nulls
+        self.assertEqual(sorted(values["value"], key=str), [100.5, None])
+        self.assertIn(date(2020, 1, 31), values["value_date"])
+        self.assertEqual(values["iati_version"], [Decimal("2.03")] * 2)
+
+    def test_ipc_stream(self):
+        content = b"".join(ipc_chunks(self.table, batch_size=1))
+        table = pyarrow.ipc.open_stream(content).read_all()
+        self.assertEqual(table.num_rows, 2)
+        self.assertEqual(table.schema.field("value").type, pyarrow.float64())
+
+    def test_parquet(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "transactions.parquet")
+            self.assertEqual(write_parquet(self.table, path, batch_size=1), 2)
+            parquet = pyarrow.parquet.ParquetFile(path)
+            self.assertEqual(parquet.metadata.num_rows, 2)
+            self.assertEqual(parquet.metadata.num_row_groups, 2)
+
+
+TRANSACTION_TYPES = Codelist(
+    [("3", {"en": "Disbursement", "fr": "Décaissement"}), ("4", {"en": "Expenditure"})]
+)
+
+
+class CodeNamesTests(SimpleTestCase):
+    def namers(self, lang: str) -> dict:
+        return {"type": lambda code: TRANSACTION_TYPES.name(code, lang)}
+
+    def test_name_codes(self):
+        rows = [{"type": "3"}, {"type": None}]
+        self.assertEqual(
+            list(name_codes(rows, self.namers("fr"))),
+            [
+                {"type": "3", "type_name": "Décaissement"},
+                {"type": None, "type_name": None},
+            ],
+        )
+
+    @skipIf(pyarrow is None, "pyarrow is not installed")
+    def test_export_names(self):
+        columns = [
+            ExportColumn("iati_identifier", "text"),
+            ExportColumn("type", "text"),
+        ]
+        rows = [("XM-1", "4"), ("XM-2", "5")]
+        with mock.patch(
+            "iatistore.export.export_columns", return_value=columns
+        ), mock.patch(
+            "iatistore.export.column_namers", return_value=self.namers("fr")
+        ), mock.patch(
+            "iatistore.export.fetch_batches", return_value=([], iter([rows]))
+        ):
+            (batch,) = record_batches(mock.Mock(table_name="view"), lang="fr")
+        self.assertEqual(batch.to_pydict()["type_name"], ["Expenditure", None])
+
+
+class ActivityQueryTests(SimpleTestCase):
+    def query(self, **params) -> ActivityQuery:
+        return ActivityQuery(RequestFactory().get("/", params))
+
+    def test_filters(self):
+        sql, params = self.query(iati_identifier="XM-1", iati_version="2.03").apply(
+            'SELECT * FROM "view"'
+        )
+        self.assertIn("iati_identifier = %s AND iati_version = %s", sql)
+        self.assertEqual(params, ["XM-1", Decimal("2.03")])
+
+    def test_bad_limit(self):
+        with self.assertRaises(BadRequest):
+            self.query(limit="0")
+        with self.assertRaises(BadRequest):
+            self.query(limit="many")
+
+    def test_page_end_is_found_on_keys(self):
+        query = self.query(limit="2", after="XM-1")
+        with mock.patch.object(ActivityQuery, "_find_page_end") as find_page_end:
+            query.apply(
+                "SELECT ... GROUP BY iati_identifier",
+                keys='SELECT iati_identifier, iati_version FROM "transactions"',
+            )
+        relation, clauses, params = find_page_end.call_args[0]
+        self.assertEqual(
+            relation, '(SELECT iati_identifier, iati_version FROM "transactions") src'
+        )
+        self.assertEqual(params, ["XM-1"])
+
+    def test_next_page(self):
+        query = self.query(limit="2")
+        with mock.patch.object(ActivityQuery, "_find_page_end"):
+            query.next = "XM-2"
+            sql, params = query.apply('SELECT * FROM "view"')
+        self.assertIn("iati_identifier <= %s", sql)
+        self.assertTrue(sql.endswith("ORDER BY iati_identifier"))
+        self.assertIn("after=XM-2", query.next_url())
+
+
+class ActivityPaginationTests(TestCase):
+    # Two rows per activity, as a view of transactions would have
+    source = (
+        "SELECT iati_identifier, iati_version, n "
+        "FROM iatistore_iatiactivities, generate_series(1, 2) n"
+    )
+
+    def setUp(self):
+        for identifier in ("XM-1", "XM-2", "XM-3", "XM-4", "XM-5"):
+            row = activity_row(identifier, "hash")
+            if identifier in ("XM-1", "XM-3"):
+                row["reporting_org_ref"] = "XM-ODD"
+            IatiActivities.objects.create(**row)
+
+    def pages(self, **params) -> list:
+        pages = []
+        while True:
+            query = ActivityQuery(RequestFactory().get("/", params))
+            sql, sql_params = query.apply(self.source)
+            pages.append(
+                [row["iati_identifier"] for row in iterate_rows(sql, sql_params)]
+            )
+            if query.next is None:
+                return pages
+            params["after"] = query.next
+
+    def test_pages_hold_every_row_of_an_activity(self):
+        self.assertEqual(
+            self.pages(limit="2"),
+            [
+                ["XM-1", "XM-1", "XM-2", "XM-2"],
+                ["XM-3", "XM-3", "XM-4", "XM-4"],
+                ["XM-5", "XM-5"],
+            ],
+        )
+
+    def test_filtered_pages(self):
+        self.assertEqual(
+            self.pages(limit="1", reporting_org="XM-ODD"),
+            [["XM-1", "XM-1"], ["XM-3", "XM-3"]],
+        )
+
+    def test_last_page_is_full(self):
+        self.assertEqual(len(self.pages(limit="5")), 1)
+
+
+def participating_orgs_sql(table) -> str:
+    """
+    Stands in for the participating-org view SQL of an IatiXmlTable
+    """
+    return (
+        "SELECT iati_identifier, iati_version, 'funding' AS type, "
+        "reporting_org_ref AS ref, '1' AS role FROM iatistore_iatiactivities "
+        f"WHERE iati_version = {table.iati_version}"
+    )
+
+
+@override_settings(
+    CACHES={"default": {"BACKEND": "django.core.cache.backends.dummy.DummyCache"}}
+)
+class UnifiedTableEndpointTests(TestCase):
+    row_expression = "/iati-activity/participating-org"
+
+    def setUp(self):
+        patcher = mock.patch.object(
+            IatiXmlTable, "sql", property(participating_orgs_sql)
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        for identifier, version in (("XM-1", "2.01"), ("XM-2", "2.03")):
+            row = activity_row(identifier, "hash", version)
+            row["reporting_org_ref"] = f"{identifier}-ORG"
+            IatiActivities.objects.create(**row)
+        for version in iati_versions:
+            table = IatiXmlTable.objects.create(
+                row_expression=self.row_expression,
+                document_expression='"content"',
+                iati_version=version,
+            )
+            self.assertTrue(table.matview_create())
+        self.table = UNIFIED_TABLES[self.row_expression]
+
+    def get(self, view, **params):
+        return view.as_view()(RequestFactory().get("/", params))
+
+    def test_not_built_yet(self):
+        for view in (
+            views.IatiActivities,
+            views.IatiTransactions,
+            views.IatiParticipatingOrganisation,
+        ):
+            self.assertEqual(self.get(view).status_code, 503)
+        # Only "rebuild_matviews" builds the unified tables
+        self.assertFalse(self.table.exists())
+
+    def test_rebuild(self):
+        (timing,) = matviews.rebuild_unified([self.table])
+        self.assertTrue(timing.ok)
+        rows = iterate_rows(
+            f'SELECT iati_identifier, iati_version, ref FROM "{self.table.table_name}" '
+            "ORDER BY iati_identifier"
+        )
+        self.assertEqual(
+            [(row["iati_identifier"], str(row["iati_version"])) for row in rows],
+            [("XM-1", "2.01"), ("XM-2", "2.03")],
+        )
+        self.assertEqual(
+            partitions.partition_versions(self.table.table_name), list(iati_versions)
+        )
+
+    def test_rebuild_keeps_dependent_views(self):
+        self.assertTrue(self.table.rebuild())
+        with connection.cursor() as c:
+            c.execute(
+                f'CREATE VIEW "orgs" AS SELECT ref FROM "{self.table.table_name}"'
+            )
+        IatiActivities.objects.create(**activity_row("XM-3", "hash", "2.03"))
+        IatiXmlTable.objects.get(
+            row_expression=self.row_expression, iati_version=Decimal("2.03")
+        ).rebuild()
+        self.assertTrue(self.table.rebuild())
+        self.assertEqual(len(list(iterate_rows('SELECT * FROM "orgs"'))), 3)
+
+    def test_endpoint_reads_the_unified_table(self):
+        self.assertTrue(self.table.rebuild())
+        response = self.get(views.IatiParticipatingOrganisation, limit="1")
+        self.assertEqual(response.status_code, 200)
+        content = json.loads(b"".join(response.streaming_content))
+        self.assertEqual([row["ref"] for row in content], ["XM-1-ORG"])
+        self.assertIn("after=XM-1", response["Link"])
+
+
+TRANSACTIONS = """
+<iati-activity xml:lang="en">
+  <iati-identifier>XM-1</iati-identifier>
+  <title>
+    <narrative>Water</narrative>
+    <narrative xml:lang="fr">Eau</narrative>
+  </title>
+  <transaction ref="first">
+    <transaction-type code="3"/>
+    <value currency="EUR" value-date="2020-01-31">100</value>
+  </transaction>
+  <transaction>
+    <transaction-type code="4"/>
+    <value value-date="2019-12-31">50.5</value>
+    <description><narrative>Second</narrative></description>
+  </transaction>
+</iati-activity>
+"""
+
+
+class ShredPendingTests(TestCase):
+    def test_generation_is_bumped_once_per_run(self):
+        for identifier in ("XM-1", "XM-2", "XM-3"):
+            IatiActivities.objects.create(**activity_row(identifier, "hash"))
+        with mock.patch("iatistore.shredder.generations.bump") as bump:
+            self.assertEqual(shredder.shred_pending(batch_size=1), 3)
+            self.assertEqual(shredder.shred_pending(batch_size=1), 0)
+        bump.assert_called_once()
+
+
+class ActivityTransactionsTests(SimpleTestCase):
+    def message(self, version: str):
+        row = dict(
+            iati_identifier="XM-1",
+            version=version,
+            value=[100.0],
+            currency=["EUR"],
+            datestamp=[20200131],
+            transaction_type_code=["3"],
+            id=["first"],
+        )
+        (activity,) = views.activity_transactions([row])
+        return activity
+
+    def test_version(self):
+        activity = self.message("V203")
+        self.assertEqual(activity.type, views.transaction_pb2.IatiVersion.V203)
+        self.assertEqual(activity.transactions[0].currency, "EUR")
+
+    def test_version_without_enum_value(self):
+        self.assertFalse(self.message("V103").HasField("type"))
+
+
+class TransactionsSqlTests(TestCase):
+    def setUp(self):
+        with connection.cursor() as c:
+            c.execute(
+                """
+                CREATE TEMP VIEW "transactions_v203" AS
+                SELECT * FROM (VALUES
+                    ('XM-1', 2.03, '50.5', NULL, '2020-01-31', 4, NULL),
+                    ('XM-1', 2.03, '100', 'EUR', '2019-12-31', 3, 'first')
+                ) v(iati_identifier, iati_version, value, value_currency,
+                    value_value_date, transaction_type_code, ref)
+                """
+            )
+            c.execute(
+                """
+                CREATE TEMP VIEW "transactions_v201" AS
+                SELECT * FROM (VALUES
+                    ('XM-2', 2.01, '7', 'USD', '2018-06-01', 1, NULL)
+                ) v(iati_identifier, iati_version, value, value_currency,
+                    value_value_date, transaction_type_code, ref)
+                """
+            )
+
+    def test_grouped_and_typed_per_activity(self):
+        sql = transactions_sql(["transactions_v203", "transactions_v201"])
+        rows = {
+            row["iati_identifier"]: row
+            for row in iterate_rows(f"SELECT * FROM ({sql}) t")
+        }
+        self.assertEqual(rows["XM-1"]["version"], "V203")
+        self.assertEqual(rows["XM-2"]["version"], "V201")
+        # Ordered by value date
+        self.assertEqual(rows["XM-1"]["value"], [100.0, 50.5])
+        self.assertEqual(rows["XM-1"]["datestamp"], [20191231, 20200131])
+        self.assertEqual(rows["XM-1"]["transaction_type_code"], ["3", "4"])
+        self.assertEqual(rows["XM-1"]["id"], ["first", "XM-1 - 2"])
+        self.assertEqual(rows["XM-2"]["currency"], ["USD"])
+
+
+def read_delimited(content: bytes, message_type) -> list:
+    """
+    Decode a stream of length-delimited protobuf messages
+    """
+    messages, position = [], 0
+    while position < len(content):
+        length, shift = 0, 0
+        while True:
+            byte = content[position]
+            position += 1
+            length |= (byte & 0x7F) << shift
+            shift += 7
+            if not byte & 0x80:
+                break
+        messages.append(message_type.FromString(content[position : position + length]))
+        position += length
+    return messages
+
+
+@override_settings(
+    CACHES={"default": {"BACKEND": "django.core.cache.backends.dummy.DummyCache"}}
+)
+@mock.patch.object(shredder, "shred_on_ingest", return_value=True)
+class DelimitedTransactionsTests(TestCase):
+    def setUp(self):
+        for identifier in ("XM-1", "XM-2"):
+            row = dict(activity_row(identifier, "hash"), content=TRANSACTIONS)
+            IatiActivities.objects.create(**row)
+            shredder.shred_rows([row])
+
+    def get(self, **params):
+        request = RequestFactory().get("/iatitransactions", params)
+        return views.IatiTransactions.as_view()(request)
+
+    def test_varint(self, shred_on_ingest):
+        for value, encoded in ((0, b"\x00"), (127, b"\x7f"), (300, b"\xac\x02")):
+            self.assertEqual(views.varint(value), encoded)
+
+    def test_a_message_per_activity(self, shred_on_ingest):
+        response = self.get(format="delimited")
+        self.assertTrue(response.streaming)
+        content = b"".join(response.streaming_content)
+        activities = read_delimited(content, views.transaction_pb2.ActivityTransactions)
+        self.assertEqual(
+            [activity.iati_identifier for activity in activities], ["XM-1", "XM-2"]
+        )
+        self.assertEqual(len(activities[0].transactions), 2)
+
+    def test_same_activities_as_the_list(self, shred_on_ingest):
+        delimited = read_delimited(
+            b"".join(self.get(format="delimited").streaming_content),
+            views.transaction_pb2.ActivityTransactions,
+        )
+        activity_list = views.transaction_pb2.ActivityTransactionList.FromString(
+            self.get().content
+        )
+        self.assertEqual(list(activity_list.activities), delimited)
+
+
+class ShreddedReadersTests(TestCase):
+    def setUp(self):
+        row = dict(activity_row("XM-1", "hash"), content=TRANSACTIONS)
+        IatiActivities.objects.create(**row)
+        shredder.shred_rows([row])
+
+    def test_transactions_in_document_order(self):
+        (row,) = iterate_rows(shredded_transactions_sql())
+        self.assertEqual(row["version"], "V203")
+        self.assertEqual(row["value"], [100.0, 50.5])
+        self.assertEqual(row["currency"], ["EUR", None])
+        self.assertEqual(row["datestamp"], [20200131, 20191231])
+        self.assertEqual(row["transaction_type_code"], ["3", "4"])
+        self.assertEqual(row["id"], ["first", "XM-1 - 2"])
+
+    def search(self, **params):
+        request = RequestFactory().get("/", params)
+        paths = [
+            ("/iati-activity/title", "title", True),
+            ("/iati-activity/transaction", "transaction", False),
+        ]
+        sql, sql_params = NarrativeSearch(request).apply_shredded(paths)
+        return [row["iati_identifier"] for row in iterate_rows(sql, sql_params)]
+
+    def test_narrative_search(self):
+        self.assertEqual(self.search(q="water"), ["XM-1"])
+        self.assertEqual(
+            self.search(q="second", narrative_type="transaction"), ["XM-1"]
+        )
+        self.assertEqual(self.search(q="second", narrative_type="title"), [])
+        self.assertEqual(self.search(q="water", narrative_type="unknown"), [])
+
+    def test_narrative_search_languages(self):
+        # Stemmed for every language without "lang"
+        self.assertEqual(self.search(q="waters"), ["XM-1"])
+        self.assertEqual(self.search(q="eaux"), ["XM-1"])
+        self.assertEqual(self.search(q="eaux", lang="fr"), ["XM-1"])
+        self.assertEqual(self.search(q="eau", lang="en"), [])
+        self.assertEqual(self.search(q="water", lang="fr-FR"), [])
+
+    def test_search_query(self):
+        request = RequestFactory().get("/", {"q": "water"})
+        query, params = NarrativeSearch(request).query()
+        self.assertEqual(query.count("websearch_to_tsquery"), len(params) // 2)
+        self.assertIn("simple", params)
+
+
+class PartitionTests(TestCase):
+    def partition_of(self, pk: str) -> str:
+        with connection.cursor() as c:
+            c.execute(
+                "SELECT tableoid::regclass::text FROM iatistore_iatiactivities "
+                "WHERE id = %s",
+                [pk],
+            )
+            return c.fetchone()[0].strip('"')
+
+    def test_new_version_moves_out_of_the_default_partition(self):
+        IatiActivities.objects.create(**activity_row("XM-1", "hash", "9.99"))
+        self.assertEqual(self.partition_of("xm-1"), partitions.default_name())
+        self.assertTrue(partitions.add_partition("9.99"))
+        self.assertFalse(partitions.add_partition("9.99"))
+        self.assertIn(Decimal("9.99"), partitions.partition_versions())
+        self.assertEqual(self.partition_of("xm-1"), partitions.partition_name("9.99"))
+
+    def test_republished_activity_moves_version(self):
+        IatiActivities.upsert([activity_row("XM-1", "old", "2.03")])
+        IatiActivities.upsert([activity_row("XM-1", "new", "9.99")])
+        (activity,) = IatiActivities.objects.filter(pk="xm-1")
+        self.assertEqual(activity.iati_version, Decimal("9.99"))
+
+
+def codelist_row(label: str, *codes: str) -> dict:
+    items = "".join(
+        f"<codelist-item><code>{code}</code>"
+        f"<name><narrative>{code} name</narrative></name></codelist-item>"
+        for code in codes
+    )
+    content = (
+        f'<codelist name="{label}" complete="1" xml:lang="en">'
+        f"<metadata><name><narrative>{label}</narrative></name></metadata>"
+        f"<codelist-items>{items}</codelist-items></codelist>"
+    )
+    return dict(
+        iati_version=Decimal("2.03"),
+        label=label,
+        embedded=False,
+        content=content,
+        content_hash="-".join(codes),
+        complete=True,
+    )
+
+
+class CodelistSyncTests(TestCase):
+    def sync(self, *codes: str) -> int:
+        def request_content(iati_version, label, embedded):
+            if iati_version == Decimal("2.03") and label == "Version":
+                return codelist_row(label, *codes)
+            return None
+
+        with mock.patch.object(
+            IatiCodelist, "request_content", side_effect=request_content
+        ), mock.patch("iatistore.models.iati_versions", [Decimal("2.03")]):
+            return IatiCodelist.sync_all(workers=2)
+
+    def items(self):
+        return dict(IatiCodelistItem.objects.values_list("code", "name"))
+
+    def test_sync(self):
+        self.assertEqual(self.sync("2.02", "2.03"), 1)
+        codelist = IatiCodelist.objects.get()
+        self.assertEqual(codelist.name, {"en": "Version"})
+        self.assertEqual(codelist.shredded_hash, codelist.content_hash)
+        self.assertEqual(
+            self.items(), {"2.02": {"en": "2.02 name"}, "2.03": {"en": "2.03 name"}}
+        )
+
+    def test_resync_updates_in_place(self):
+        self.sync("2.02", "2.03")
+        self.sync("2.03", "2.04")
+        self.assertEqual(IatiCodelist.objects.count(), 1)
+        self.assertEqual(sorted(self.items()), ["2.03", "2.04"])
+
+    def test_unchanged_codelists_are_not_reshredded(self):
+        self.sync("2.03")
+        with mock.patch("iatistore.models.generations.bump") as bump:
+            self.sync("2.03")
+        self.assertEqual(IatiCodelist.update_from_content(), [])
+        bump.assert_not_called()
+
+    def test_only_changed_codelists_and_items_are_touched(self):
+        versions = IatiCodelist.objects.create(
+            **codelist_row("Version", "2.02", "2.03")
+        )
+        currencies = IatiCodelist.objects.create(**codelist_row("Currency", "EUR"))
+        IatiCodelist.update_from_content()
+        before = dict(IatiCodelistItem.objects.values_list("code", "pk"))
+
+        changed = codelist_row("Version", "2.03", "2.04")
+        IatiCodelist.objects.filter(pk=versions.pk).update(
+            content=changed["content"], content_hash=changed["content_hash"]
+        )
+        self.assertEqual(IatiCodelist.update_from_content(), [versions.pk])
+        after = dict(IatiCodelistItem.objects.values_list("code", "pk"))
+        self.assertEqual(sorted(after), ["2.03", "2.04", "EUR"])
+        # Items which did not change keep their rows
+        self.assertEqual(after["2.03"], before["2.03"])
+        self.assertEqual(after["EUR"], before["EUR"])
+        self.assertEqual(
+            IatiCodelistItem.objects.get(code="EUR").codelist_id, currencies.pk
+        )
+
+    @mock.patch.object(IatiXmlTable, "refresh_enriched")
+    def test_enriched_views_are_refreshed_on_change(self, refresh_enriched):
+        self.sync("2.03")
+        refresh_enriched.assert_called_once()
+        self.sync("2.03")
+        refresh_enriched.assert_called_once()
+        self.sync("2.03", "2.04")
+        self.assertEqual(refresh_enriched.call_count, 2)
+
+    def test_enriched_sql_joins_on_label(self):
+        table = IatiXmlTable(
+            row_expression="/iati-activity/transaction",
+            iati_version=Decimal("2.03"),
+            enrich_codelists=True,
+        )
+        labels = [("transaction_type_code", "TransactionType")]
+        with mock.patch.object(
+            IatiXmlTable, "source_sql", "SELECT ..."
+        ), mock.patch.object(IatiXmlTable, "codelist_labels", return_value=labels):
+            sql = table.sql
+        self.assertIn('"codelist_0".iati_version = 2.03', sql)
+        self.assertIn("\"codelist_0\".label = 'TransactionType'", sql)
+        self.assertIn('AS "transaction_type_code_name"', sql)
+
+
+class DjangoVersionCheckTests(SimpleTestCase):
+    def test_supported(self):
+        with mock.patch("django.VERSION", (4, 1, 0, "final", 0)):
+            self.assertEqual(check_django_version(None), [])
+
+    def test_too_old(self):
+        with mock.patch("django.VERSION", (3, 2, 0, "final", 0)):
+            (error,) = check_django_version(None)
+        self.assertEqual(error.id, "iatistore.E001")
+
+
+DEEP_NARRATIVE = """
+<iati-activity>
+  <iati-identifier>XM-1</iati-identifier>
+  <title><narrative>Water</narrative></title>
+  <result><indicator><period><target><comment><location><extension>
+    <narrative>Deep</narrative>
+  </extension></location></comment></target></period></indicator></result>
+</iati-activity>
+"""
+
+
+class CombinedNarrativesTests(TestCase):
+    def setUp(self):
+        self.tables = [
+            mock.Mock(pk=pk, row_expression=row_expression, narrative_type=type_)
+            for pk, row_expression, type_ in (
+                (1, "/iati-activity/title/narrative", "title"),
+                (2, "/iati-activity/title", "title"),
+                (3, "/iati-activity/result/indicator", "result"),
+            )
+        ]
+        row = dict(activity_row("XM-1", "hash"), content=DEEP_NARRATIVE)
+        IatiActivities.objects.create(**row)
+
+    def rows(self) -> list:
+        with mock.patch.object(
+            CombinedNarratives, "narrative_tables", return_value=self.tables
+        ):
+            sql = CombinedNarratives("2.03").sql
+        return [
+            (row["narrative_table_id"], row["narrative_type"], row["text"].strip())
+            for row in iterate_rows(f"SELECT * FROM ({sql}) v ORDER BY 1, 2, 3")
+        ]
+
+    def test_a_row_per_matching_table(self):
+        self.assertEqual(
+            self.rows(),
+            [(1, "title", "Water"), (2, "title", "Water"), (3, "result", "Deep")],
+        )
+
+    def test_narratives_below_the_deepest_path(self):
+        # Only ancestors as deep as the deepest path are read
+        self.tables[2].row_expression = "/iati-activity/result"
+        self.assertIn((3, "result", "Deep"), self.rows())
+
+
+class MeasureEndpointTests(SimpleTestCase):
+    def test_ok(self):
+        view = mock.Mock(return_value=HttpResponse(b"[]"))
+        measurement = benchmark.measure_endpoint("ok.json", view)
+        self.assertTrue(measurement.ok)
+        self.assertEqual(measurement.bytes, 2)
+
+    def test_error_is_recorded(self):
+        view = mock.Mock(side_effect=DatabaseError("no such view"))
+        with self.assertLogs("iatistore.benchmark", "ERROR"):
+            measurement = benchmark.measure_endpoint("broken.json", view)
+        self.assertFalse(measurement.ok)
+        self.assertEqual(measurement.error, "DatabaseError: no such view")
+
+    def test_error_while_streaming(self):
+        def chunks():
+            yield b"["
+            raise DatabaseError("lost connection")
+
+        view = mock.Mock(return_value=StreamingHttpResponse(chunks()))
+        with self.assertLogs("iatistore.benchmark", "ERROR"):
+            measurement = benchmark.measure_endpoint("stream.json", view)
+        self.assertFalse(measurement.ok)
+
+    def test_uncached(self):
+        with benchmark.uncached():
+            self.assertIsInstance(response_cache(), DummyCache)
+        self.assertNotIsInstance(response_cache(), DummyCache)
+
+
+class StandardTests(SimpleTestCase):
+    def attribute(self, iati_version, path: str, name: str) -> standard.Value:
+        root = standard.activity_standard(iati_version)
+        (element,) = [element for element in root.walk() if element.path == path]
+        (attribute,) = [value for value in element.attributes if value.name == name]
+        return attribute
+
+    def test_103_elements_of_activity_are_optional(self):
+        for element in standard.activity_standard("1.03").children:
+            self.assertEqual(element.occurrence.minimum, 0, element)
+
+    def test_103_codelists_from_definitions(self):
+        for path, name, label in (
+            ("transaction/transaction-type", "code", "TransactionType"),
+            ("participating-org", "role", "OrganisationRole"),
+            ("participating-org", "type", "OrganisationType"),
+            ("transaction/value", "currency", "Currency"),
+        ):
+            self.assertEqual(self.attribute("1.03", path, name).codelist, label)
+        self.assertIsNone(self.attribute("1.03", "participating-org", "ref").codelist)
+
+    def test_codelist_label_103(self):
+        self.assertEqual(standard.codelist_label_103("flow_type"), "FlowType")
+        self.assertIsNone(standard.codelist_label_103("organisation"))
+
+
+class ProvisionTests(TestCase):
+    columns = [
+        standard.ColumnDefinition("ref", "@ref", "xsd:string"),
+        standard.ColumnDefinition("value", "value", "xsd:decimal"),
+    ]
+
+    def provision(self, definitions: dict, **options) -> list:
+        with mock.patch.object(standard, "table_definitions", return_value=definitions):
+            return IatiXmlTable.provision(Decimal("2.03"), **options)
+
+    def table_columns(self, row_expression: str) -> list:
+        table = IatiXmlTable.objects.get(row_expression=row_expression)
+        return sorted(table.columns.values_list("col_name", flat=True))
+
+    def test_provision(self):
+        definitions = {
+            "/iati-activity/transaction": self.columns,
+            "/iati-activity/budget": self.columns[1:],
+        }
+        changes = self.provision(definitions)
+        self.assertEqual([change.created for change in changes], [True, True])
+        self.assertEqual(
+            self.table_columns("/iati-activity/transaction"), ["ref", "value"]
+        )
+        # Identical definitions share a column
+        self.assertEqual(IatiXmlColumn.objects.count(), 2)
+        # Nothing differs the second time round
+        self.assertEqual(self.provision(definitions), [])
+
+    def test_changed_columns(self):
+        self.provision({"/iati-activity/transaction": self.columns})
+        moved = standard.ColumnDefinition("ref", "provider-org/@ref", "xsd:string")
+        (change,) = self.provision({"/iati-activity/transaction": [moved]})
+        self.assertFalse(change.created)
+        self.assertEqual(change.added, ["ref"])
+        # Replaced, while "value" is kept without `prune`
+        self.assertEqual(change.removed, ["ref"])
+        self.assertEqual(
+            self.table_columns("/iati-activity/transaction"), ["ref", "value"]
+        )
+        (change,) = self.provision({"/iati-activity/transaction": [moved]}, prune=True)
+        self.assertEqual(change.removed, ["value"])
+
+    def test_dry_run(self):
+        (change,) = self.provision(
+            {"/iati-activity/transaction": self.columns}, dry_run=True
+        )
+        self.assertTrue(change.created)
+        self.assertIsNone(change.table)
+        self.assertFalse(IatiXmlTable.objects.exists())
+
+
+class StandardActivityTests(SimpleTestCase):
+    def codes(self, label: str):
+        return (f"{label}-code",)
+
+    def test_103_codes_and_optional_elements(self):
+        generate = StandardActivity("1.03", optional=0, codes=self.codes)
+        activity = generate(1)
+        # Only the elements the generator always adds
+        self.assertEqual([e.tag for e in activity], ["iati-identifier"])
+
+        generate = StandardActivity(
+            "1.03",
+            repeats={"transaction": 1, "participating-org": 1},
+            optional=1,
+            codes=self.codes,
+        )
+        activity = generate(1)
+        transaction_type = activity.find("transaction/transaction-type")
+        self.assertEqual(transaction_type.get("code"), "TransactionType-code")
+        org = activity.find("participating-org")
+        self.assertEqual(org.get("role"), "OrganisationRole-code")
+        self.assertTrue(org.get("ref").startswith(PREFIX))
@@ -13,6 +13,16 @@ urlpatterns = [
         views.IatiXmlTableJSON.as_view(),
         name="iatixmltable-detail-json",
     ),
+    path(
+        "table/<pk>/content.arrow",
+        views.IatiXmlTableArrow.as_view(),
+        name="iatixmltable-detail-arrow",
+    ),
+    path(
+        "narratives/<pk>/content.arrow",
+        views.NarrativeXmlTableArrow.as_view(),
+        name="narrativexmltable-detail-arrow",
+    ),
     path(
         "iatiactivities.json",
         views.IatiActivities.as_view(),
@@ -28,4 +38,9 @@ urlpatterns = [
         views.IatiParticipatingOrganisation.as_view(),
         name="partorg-json",
     ),
+    path(
+        "narratives/search.json",
+        views.NarrativeSearchJSON.as_view(),
+        name="narrative-search-json",
+    ),
 ]
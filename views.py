@@ -1,11 +1,20 @@
-from django.shortcuts import render
 from django.views.generic import View, ListView, DetailView
-from django.http import JsonResponse, HttpResponse
+from django.http import HttpResponse, StreamingHttpResponse
 from . import models as iatixmltables
-from . import transaction_pb2
-from django.db import connection
-from collections import defaultdict
-from decimal import Decimal, getcontext
+from . import shredder, transaction_pb2
+from .caching import CachedResponseMixin
+from .codelists import column_namers, name_codes
+from .export import ARROW_STREAM, ipc_chunks
+from .queries import (
+    SHREDDED_TRANSACTION_KEYS,
+    TRANSACTION_FIELDS,
+    ActivityQuery,
+    NarrativeSearch,
+    shredded_transactions_sql,
+    transactions_sql,
+)
+from .streaming import iterate_rows, streaming_json_response
+from typing import Iterator
 
 import logging
 
@@ -28,169 +37,213 @@ class IatiXmlTableDetail(DetailView):
 
 
 class IatiXmlTableJSON(DetailView):
+    """
+    The materialized view of an IatiXmlTable. With "?names=<lang>" each
+    column mapped to a codelist is followed by the names of its codes
+    in that language, unless the view has them already (enrich_codelists).
+    """
+
     queryset = iatixmltables.IatiXmlTable.objects.all()
 
-    def get(self, *args, **kwargs):
-        with connection.cursor() as c:
-            c.execute(self.get_object().sql)
-            columns = [col[0] for col in c.description]
-            return JsonResponse(
-                dict(results=[dict(zip(columns, row)) for row in c.fetchall()])
-            )
+    def get(self, request, *args, **kwargs):
+        table = self.get_object()
+        if not table.matview_exists():
+            table.matview_create()
+        query = ActivityQuery(request)
+        sql, params = query.apply(f'SELECT * FROM "{table.table_name}"')
+        rows = iterate_rows(sql, params)
+        lang = request.GET.get("names")
+        if lang and not table.enrich_codelists:
+            rows = name_codes(rows, column_namers(table, lang))
+        response = streaming_json_response(request, rows, next=query.next)
+        return query.add_link(response)
+
+
+class IatiXmlTableArrow(DetailView):
+    """
+    The materialized view of an IatiXmlTable as an Arrow IPC stream,
+    typed from its columns' XSD types, with code names as for the JSON
+    view given "?names=<lang>"
+    """
+
+    queryset = iatixmltables.IatiXmlTable.objects.all()
+
+    def get(self, request, *args, **kwargs):
+        table = self.get_object()
+        if not table.matview_exists():
+            table.matview_create()
+        chunks = ipc_chunks(table, lang=request.GET.get("names"))
+        return StreamingHttpResponse(chunks, content_type=ARROW_STREAM)
+
+
+class NarrativeXmlTableArrow(IatiXmlTableArrow):
+    queryset = iatixmltables.NarrativeXmlTable.objects.all()
 
 
-class IatiActivities(View):
+def not_built(table) -> HttpResponse:
+    """
+    The response of an endpoint whose unified table has not been
+    built yet. Requests never build it: "rebuild_matviews" does.
+    """
+    return HttpResponse(
+        f"{table} has not been built yet", status=503, content_type="text/plain"
+    )
+
+
+class IatiActivities(CachedResponseMixin, View):
     """
     Returns all fields common to IATI versions 2.01, 2.02 and 2.03
-    from the materialized views
+    from the unified "/iati-activity" table
 
-    The matviews need to be created first
+    The matviews and unified tables need to be built first
+    ("rebuild_matviews"); until then this answers 503
     """
 
-    def get(self, *args, **kwargs):
-        tables = iatixmltables.IatiXmlTable.objects.filter(
-            row_expression="/iati-activity"
-        )
+    def get(self, request, *args, **kwargs):
+        table = iatixmltables.UNIFIED_TABLES["/iati-activity"]
+        if not table.exists():
+            return not_built(table)
 
-        columns = list(
-            iatixmltables.IatiXmlColumn.objects.get_versions_for_column(
-                "/iati-activity"
-            )
-            .exclude(col_name__startswith="fss")
-            .exclude(col_name__startswith="crs")
-            .filter(versions__contains=[2.03, 2.01, 2.02])
-            .values_list("col_name", flat=True)
-            .distinct()
+        query = ActivityQuery(request)
+        sql, params = query.apply(f'SELECT * FROM "{table.table_name}"')
+        response = streaming_json_response(
+            request, iterate_rows(sql, params), next=query.next
         )
+        return query.add_link(response)
 
-        columns_join = ", ".join(columns)
 
-        sql = " UNION ".join(
-            [
-                f"SELECT iati_identifier, iati_version, {columns_join} FROM {name}"
-                for name in [t.table_name for t in tables]
-            ]
-        )
-
-        with connection.cursor() as c:
-            c.execute(sql)
-            columns = [col[0] for col in c.description]
-            return JsonResponse(
-                dict(results=[dict(zip(columns, row)) for row in c.fetchall()])
-            )
+def varint(value: int) -> bytes:
+    """
+    Protobuf base 128 varint encoding of a non-negative integer
+    """
+    encoded = bytearray()
+    while True:
+        byte, value = value & 0x7F, value >> 7
+        if value:
+            encoded.append(byte | 0x80)
+        else:
+            encoded.append(byte)
+            return bytes(encoded)
 
 
-from enum import Enum, auto
+def length_delimited(message) -> bytes:
+    body = message.SerializeToString()
+    return varint(len(body)) + body
 
 
-class TransactionQuery(Enum):
-    iati_identifier = auto()
-    iati_version = auto()
-    value = auto()
-    value_currency = auto()
-    value_value_date = auto()
-    transaction_type_code = auto()
-    ref = auto()
+def activity_transactions(rows) -> Iterator[transaction_pb2.ActivityTransactions]:
+    """
+    An ActivityTransactions message for each
+    activity row from queries.transactions_sql
+    """
+    for row in rows:
+        activity = transaction_pb2.ActivityTransactions(
+            iati_identifier=row["iati_identifier"]
+        )
+        # Versions the IatiVersion enum has no value for, such as 1.03,
+        # leave the type unset rather than change the message schema
+        version = getattr(transaction_pb2.IatiVersion, row["version"], None)
+        if version is not None:
+            activity.type = version
+        for values in zip(*(row[field] for field in TRANSACTION_FIELDS)):
+            activity.transactions.add(
+                activity=row["iati_identifier"],
+                **{
+                    field: value
+                    for field, value in zip(TRANSACTION_FIELDS, values)
+                    if value
+                },
+            )
+        yield activity
 
 
-class IatiTransactions(View):
+class IatiTransactions(CachedResponseMixin, View):
     """
-    Returns all fields common to IATI versions 2.01, 2.02 and 2.03
-    from the materialized views
-
-    The matviews need to be created first
+    Returns all fields common to IATI versions 2.01, 2.02 and 2.03,
+    from the IatiActivityTransaction side table when activities are
+    shredded as they are written (IATISTORE_SHRED_ON_INGEST), otherwise
+    from the unified transaction table. That needs to be built first
+    ("rebuild_matviews"); until then this answers 503
+
+    By default the response is one serialized ActivityTransactionList.
+    With "?format=delimited" it is a stream of length-delimited
+    ActivityTransactions messages, one per activity, written as rows
+    arrive so that clients can start decoding straight away.
     """
 
-    def get(self, *args, **kwargs):
-        tables = iatixmltables.IatiXmlTable.objects.filter(
-            row_expression="/iati-activity/transaction"
-        )
-        columns = TransactionQuery
-        columns_join = ", ".join([item.name for item in list(TransactionQuery)])
-
-        sql = " UNION ".join(
-            [
-                f'SELECT  {columns_join}, ROW_NUMBER() OVER (PARTITION BY iati_identifier) AS "ord" FROM {name}'
-                for name in [t.table_name for t in tables]
-            ]
-        )
+    def get(self, request, *args, **kwargs):
+        query = ActivityQuery(request)
+        if shredder.shred_on_ingest():
+            # The side tables are kept current as activities are written
+            sql, params = query.apply(
+                shredded_transactions_sql(),
+                ordered=True,
+                keys=SHREDDED_TRANSACTION_KEYS,
+            )
+        else:
+            table = iatixmltables.UNIFIED_TABLES["/iati-activity/transaction"]
+            if not table.exists():
+                return not_built(table)
+            sql, params = query.apply(
+                transactions_sql([table.table_name]),
+                ordered=True,
+                keys=f'SELECT iati_identifier, iati_version FROM "{table.table_name}"',
+            )
+        activities = activity_transactions(iterate_rows(sql, params))
 
-        activities = transaction_pb2.ActivityTransactionList()
-
-        with connection.cursor() as c:
-
-            c.execute(sql)
-            by_id = defaultdict(list)
-            versions = {}
-            for row in c.fetchall():
-
-                transaction_id = (
-                    row[columns.ref.value - 1]
-                    or f"{row[columns.iati_identifier.value - 1]} - {row[-1]}"
-                )
-                transaction = dict(
-                    value=Decimal(row[columns.value.value - 1]),
-                    currency=row[columns.value_currency.value - 1],
-                    datestamp=int(
-                        row[columns.value_value_date.value - 1].replace("-", "")
-                    ),
-                    transaction_type_code=str(
-                        row[columns.transaction_type_code.value - 1]
-                    ),
-                    activity=row[columns.iati_identifier.value - 1],
-                    id=transaction_id,
-                )
-
-                by_id[row[0]].append(transaction)
-                if row[0] not in versions:
-                    versions[row[0]] = "V%d" % (row[1] * 100)
-
-            for act_id, ts in by_id.items():
-                act = activities.activities.add()
-                act.iati_identifier = act_id
-                act.type = getattr(transaction_pb2.IatiVersion, versions[act_id])
-                for t in ts:
-                    transaction = act.transactions.add()
-                    for field in t.keys():
-                        value = t.get(field)
-                        if value:
-                            setattr(transaction, field, value)
-
-                    ser = transaction.SerializeToString()
-
-                    # Also deserialize
-                    de = transaction_pb2.Transaction()
-                    de.ParseFromString(ser)
-                    logger.debug(de)
-
-        return HttpResponse(
-            activities.SerializeToString(), content_type="application/octet-stream"
-        )
+        if request.GET.get("format") == "delimited":
+            response = StreamingHttpResponse(
+                (length_delimited(activity) for activity in activities),
+                content_type="application/octet-stream",
+            )
+        else:
+            activity_list = transaction_pb2.ActivityTransactionList()
+            activity_list.activities.extend(activities)
+            response = HttpResponse(
+                activity_list.SerializeToString(),
+                content_type="application/octet-stream",
+            )
+        return query.add_link(response)
 
 
-class IatiParticipatingOrganisation(View):
-    def get(self, *args, **kwargs):
+class IatiParticipatingOrganisation(CachedResponseMixin, View):
+    def get(self, request, *args, **kwargs):
+        table = iatixmltables.UNIFIED_TABLES["/iati-activity/participating-org"]
+        if not table.exists():
+            return not_built(table)
 
-        tables = iatixmltables.IatiXmlTable.objects.filter(
-            row_expression="/iati-activity/participating-org"
+        query = ActivityQuery(request)
+        sql, params = query.apply(f'SELECT * FROM "{table.table_name}"')
+        response = streaming_json_response(
+            request, iterate_rows(sql, params), envelope=None
         )
+        return query.add_link(response)
 
-        columns = ["type", "ref", "role"]
 
-        columns_join = ", ".join(columns)
+class NarrativeSearchJSON(CachedResponseMixin, View):
+    """
+    Activities whose narratives match a full text search, best first,
+    searching IatiActivityNarrative when activities are shredded as they
+    are written and the combined narrative views otherwise.
+    See queries.NarrativeSearch for the parameters.
+    """
 
-        sql = " UNION ".join(
-            [
-                f"SELECT iati_identifier, iati_version, {columns_join} FROM {name}"
-                for name in [t.table_name for t in tables]
+    def get(self, request, *args, **kwargs):
+        search = NarrativeSearch(request)
+        if shredder.shred_on_ingest():
+            paths = [
+                path
+                for version in iatixmltables.iati_versions
+                for path in iatixmltables.CombinedNarratives(version).narrative_paths()
             ]
-        )
-
-        with connection.cursor() as c:
-            c.execute(sql)
-            columns = [col[0] for col in c.description]
-            return JsonResponse(
-                [dict(zip(columns, row)) for row in c.fetchall()],
-                safe=False,
-                json_dumps_params={"indent": 1},
-            )
+            sql, params = search.apply_shredded(paths)
+            return streaming_json_response(request, iterate_rows(sql, params))
+        tables = [
+            iatixmltables.CombinedNarratives(version)
+            for version in iatixmltables.iati_versions
+        ]
+        names = [table.table_name for table in tables if table.matview_exists()]
+        if not names:
+            return streaming_json_response(request, [])
+        sql, params = search.apply(names)
+        return streaming_json_response(request, iterate_rows(sql, params))